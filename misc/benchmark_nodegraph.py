@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Measures the time taken to check the file dependencies of a deep graph.
+
+A synthetic graph is built, consisting of a single linear chain of nodes, in
+which every node depends on the previous node, and reads the output file of
+the node 'distance' steps earlier in the chain (in addition to the output of
+the previous node). The checks carried out when building a NodeGraph are then
+timed (see NodeGraph._check_input_dependencies).
+
+With a distance of 1, every node reads the output of the node it depends on,
+and the checks take linear time. Larger distances trigger the worst case of
+the search for producers, which takes time proportional to the length of the
+chain times the distance (see NodeGraph._find_reachable_nodes).
+
+Example:
+  $ python misc/benchmark_nodegraph.py 10000 100000 --distance 1 10 100
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+
+from pypeline.node import Node
+from pypeline.nodegraph import NodeGraph
+
+
+def build_chain(nnodes, distance):
+    nodes = []
+    for node_idx in xrange(nnodes):
+        input_files = ["/dev/null"]
+        for offset in (1, distance):
+            if node_idx >= offset:
+                input_files.extend(nodes[node_idx - offset].output_files)
+
+        nodes.append(Node(input_files=input_files,
+                          output_files=("/nonexistant/node_%i" % node_idx,),
+                          dependencies=nodes[-1:]))
+    return nodes
+
+
+def check_dependencies(nodes):
+    """Returns the time taken to check the file dependencies of the graph;
+    raises NodeGraphError if the checks fail."""
+    sorted_nodes = NodeGraph._sort_nodes(nodes[-1:])
+
+    start_time = time.time()
+    NodeGraph._check_file_dependencies(sorted_nodes)
+    return time.time() - start_time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("nnodes", type=int, nargs="+",
+                        help="Number of nodes in the synthetic chain(s).")
+    parser.add_argument("--distance", type=int, nargs="+", default=[1],
+                        help="Distance between nodes and the (earlier) nodes "
+                             "producing their input files [%(default)s].")
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    print("Nodes\tDistance\tCheck (us/node)")
+    for nnodes in args.nnodes:
+        for distance in args.distance:
+            nodes = build_chain(nnodes, distance)
+            check_time = check_dependencies(nodes)
+
+            print("%i\t%i\t%.2f" % (nnodes, distance,
+                                    check_time * 1e6 / nnodes))
+            sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
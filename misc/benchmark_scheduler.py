@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Measures the overhead of selecting nodes for running in the pipeline.
+
+A synthetic graph is built, consisting of a number of independent chains of
+nodes (resembling the lane -> library -> sample structure of the BAM
+pipeline), all of which are joined by a single final node. The graph is then
+"run", without actually running any nodes, by marking nodes as RUNNING and
+then as DONE, using the same selection logic as Pypeline._run.
+
+Example:
+  $ python misc/benchmark_scheduler.py 10000 100000 1000000
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+
+from pypeline.node import Node
+from pypeline.nodegraph import NodeGraph, FileStatusCache
+from pypeline.scheduler import RunableQueue
+
+
+class _MissingFilesCache(FileStatusCache):
+    """Cache reporting all files as missing, to avoid touching the disk."""
+
+    def prefetch(self, fpaths):
+        pass
+
+    def _get_state(self, fpath):
+        return None
+
+
+def build_graph(nnodes, chain_length):
+    chains = []
+    for chain_idx in xrange(max(1, (nnodes - 1) // chain_length)):
+        input_file = "/dev/null"
+        node = None
+        for node_idx in xrange(chain_length):
+            output_file = "/nonexistant/chain_%i/node_%i" % (chain_idx,
+                                                             node_idx)
+            node = Node(input_files=(input_file,),
+                        output_files=(output_file,),
+                        dependencies=(node,) if node else ())
+            input_file = output_file
+        chains.append(node)
+
+    final_node = Node(input_files=[iter(node.output_files).next()
+                                   for node in chains],
+                      output_files="/nonexistant/final",
+                      dependencies=chains)
+
+    return NodeGraph([final_node], cache_factory=_MissingFilesCache)
+
+
+def _select_legacy(nodegraph, remaining, idle_threads, is_idle):
+    """Selection of nodes, as previously done by Pypeline._start_new_tasks."""
+    selection, finished = [], []
+    for node in remaining:
+        if is_idle or (idle_threads >= node.threads):
+            state = nodegraph.get_node_state(node)
+            if state == nodegraph.RUNABLE:
+                selection.append(node)
+                finished.append(node)
+                idle_threads -= node.threads
+                is_idle = False
+            elif state in (nodegraph.DONE, nodegraph.ERROR):
+                finished.append(node)
+        elif idle_threads <= 0:
+            break
+
+    remaining.difference_update(finished)
+    return selection
+
+
+def simulate(nodegraph, max_threads, legacy):
+    """Runs every node in the graph, returning the number of nodes run, the
+    time spent selecting nodes, and the time spent updating states."""
+    if legacy:
+        remaining = set(nodegraph.iterflat())
+        select = lambda idle, is_idle: \
+            _select_legacy(nodegraph, remaining, idle, is_idle)
+    else:
+        runable = RunableQueue()
+        nodegraph.add_state_observer(runable)
+        select = runable.select
+
+    running = []
+    selection_time = update_time = 0.0
+    nodes_run = 0
+    while True:
+        start_time = time.time()
+        idle_threads = max_threads - sum(node.threads for node in running)
+        selection = select(idle_threads, not running)
+        selection_time += time.time() - start_time
+
+        start_time = time.time()
+        for node in selection:
+            nodegraph.set_node_state(node, NodeGraph.RUNNING)
+            running.append(node)
+
+        if not running:
+            break
+
+        nodegraph.set_node_state(running.pop(0), NodeGraph.DONE)
+        update_time += time.time() - start_time
+        nodes_run += 1
+
+    return nodes_run, selection_time, update_time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("nnodes", type=int, nargs="+",
+                        help="Number of nodes in the synthetic graph(s).")
+    parser.add_argument("--chain-length", type=int, default=4,
+                        help="Length of independent chains of nodes "
+                             "[%(default)s].")
+    parser.add_argument("--max-threads", type=int, default=32,
+                        help="Number of simulated worker slots "
+                             "[%(default)s].")
+    parser.add_argument("--legacy-max-nodes", type=int, default=50000,
+                        help="Also benchmark the legacy, full scan based "
+                             "selection for graphs up to this size "
+                             "[%(default)s].")
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    print("Nodes\tMethod\tSelect (us/node)\tUpdate (us/node)")
+    for nnodes in args.nnodes:
+        methods = [("queue", False)]
+        if nnodes <= args.legacy_max_nodes:
+            methods.append(("legacy", True))
+
+        for (name, legacy) in methods:
+            nodegraph = build_graph(nnodes, args.chain_length)
+            nodes_run, selection_time, update_time \
+                = simulate(nodegraph, args.max_threads, legacy)
+
+            print("%i\t%s\t%.2f\t%.2f"
+                  % (nodes_run, name,
+                     selection_time * 1e6 / nodes_run,
+                     update_time * 1e6 / nodes_run))
+            sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
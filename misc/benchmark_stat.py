@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Compares checking the state of files one by one (FileStatusCache) against
+checking files in parallel, grouped by folder (FileStatusCache.prefetch).
+
+A number of folders are created under the specified root, each containing a
+number of files; only a fraction of the files requested actually exist, as is
+the case when starting a new run of the pipeline. The root should be located
+on the file-system of interest (e.g. NFS / Lustre). Note that results may be
+affected by caching on the client; run on a cold cache for the most realistic
+results.
+
+Example:
+  $ python misc/benchmark_stat.py /scratch/$USER/benchmark --folders 100
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+
+from pypeline.nodegraph import FileStatusCache
+
+
+def build_files(root, nfolders, nfiles, fraction_existing):
+    fpaths = []
+    for folder_idx in xrange(nfolders):
+        dirpath = os.path.join(root, "folder_%i" % (folder_idx,))
+        os.makedirs(dirpath)
+
+        for file_idx in xrange(nfiles):
+            fpath = os.path.join(dirpath, "file_%i" % (file_idx,))
+            if file_idx < nfiles * fraction_existing:
+                with open(fpath, "w"):
+                    pass
+            fpaths.append(fpath)
+    return fpaths
+
+
+def benchmark(fpaths, threads):
+    start_time = time.time()
+    cache = FileStatusCache(threads=threads)
+    if threads:
+        cache.prefetch(fpaths)
+    missing = len(cache.missing_files(fpaths))
+    return missing, time.time() - start_time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root",
+                        help="Folder in which to create test files; must "
+                             "not already exist, and is removed afterwards.")
+    parser.add_argument("--folders", type=int, default=100,
+                        help="Number of folders to create [%(default)s].")
+    parser.add_argument("--files", type=int, default=100,
+                        help="Number of files per folder [%(default)s].")
+    parser.add_argument("--fraction-existing", type=float, default=0.25,
+                        help="Fraction of files actually created "
+                             "[%(default)s].")
+    parser.add_argument("--threads", type=int, action="append",
+                        help="Number of threads used for prefetching; may be "
+                             "specified multiple times [1, 4, 16].")
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if os.path.exists(args.root):
+        sys.stderr.write("ERROR: Root %r already exists!\n" % (args.root,))
+        return 1
+
+    try:
+        fpaths = build_files(args.root, args.folders, args.files,
+                             args.fraction_existing)
+
+        print("Method\tThreads\tMissing\tSeconds")
+        missing, runtime = benchmark(fpaths, None)
+        print("serial\t-\t%i\t%.3f" % (missing, runtime))
+        for threads in (args.threads or (1, 4, 16)):
+            missing, runtime = benchmark(fpaths, threads)
+            print("prefetch\t%i\t%i\t%.3f" % (threads, missing, runtime))
+    finally:
+        shutil.rmtree(args.root)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
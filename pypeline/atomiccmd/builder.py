@@ -161,6 +161,16 @@ class AtomicCmdBuilder:
                               "Fixed": fixed,
                               "Singleton": False})
 
+    def replace_option(self, key, value):
+        """Replaces the value of an option set using 'set_option', even if
+        the option is fixed. This is intended for use by nodes updating
+        options that they are responsible for, e.g. the number of threads
+        (see Node.set_threads), and not for user customization."""
+        old_option = self._get_option_for_editing(key, singleton=True)
+        if not old_option:
+            raise KeyError("Option with key %r does not exist" % key)
+        old_option["Value"] = value
+
     def pop_option(self, key):
         old_option = self._get_option_for_editing(key, singleton=None)
         if not old_option:
@@ -267,6 +277,13 @@ class AtomicCmdBuilder:
 
         return self._object
 
+    def unfinalize(self):
+        """Discards the AtomicCmd object created by 'finalize', allowing the
+        builder to be modified and finalized anew. Builders using this
+        builder as a keyword argument (e.g. IN_STDIN) must likewise be
+        unfinalized, in order for these to use the new AtomicCmd object."""
+        self._object = None
+
     def _get_option_for_editing(self, key, singleton):
         if self._object:
             message = "AtomicCmdBuilder has already been finalized"
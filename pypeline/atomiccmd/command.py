@@ -23,6 +23,7 @@
 import os
 import re
 import sys
+import errno
 import signal
 import types
 import weakref
@@ -32,7 +33,9 @@ import collections
 import pypeline.atomiccmd.pprint as atomicpp
 import pypeline.common.fileutils as fileutils
 import pypeline.common.signals as signals
-from pypeline.common.utilities import safe_coerce_to_tuple
+from pypeline.common.utilities import \
+    safe_coerce_to_tuple, \
+    parse_size
 
 _PIPES = (("IN", "IN_STDIN"),
           ("OUT", "OUT_STDOUT"),
@@ -45,6 +48,8 @@ _FILE_MAP = {"IN": "input",
              "EXEC": "executable",
              "AUX": "auxiliary",
              "CHECK": "requirements"}
+# Memory used by the JVM in addition to the heap (-Xmx), in percent of the heap
+_JVM_OVERHEAD = 25
 
 
 class CmdError(RuntimeError):
@@ -68,7 +73,7 @@ class AtomicCmd(object):
     running children after the termination of the parents."""
     PIPE = subprocess.PIPE
 
-    def __init__(self, command, set_cwd=False, **kwargs):
+    def __init__(self, command, set_cwd=False, memory=None, **kwargs):
         """Takes a command and a set of files.
 
         The command is expected to be an iterable starting with the name of an
@@ -135,15 +140,28 @@ class AtomicCmd(object):
 
         If 'set_cwd' is True, the current working directory is set to the
         temporary directory before the command is executed. Input paths are
-        automatically turned into absolute paths in this case."""
+        automatically turned into absolute paths in this case.
+
+        'memory' is the estimated peak memory usage of the command in MB. If
+        not set, this is derived from the heap-size (-Xmx) of 'java' commands,
+        and is otherwise 0 (unknown / negligible)."""
         self._proc = None
         self._temp = None
         self._running = False
+        self._resource_usage = None
         self._command = map(str, safe_coerce_to_tuple(command))
         self._set_cwd = set_cwd
         if not self._command or not self._command[0]:
             raise ValueError("Empty command in AtomicCmd constructor")
 
+        if memory is None:
+            memory = self._estimate_memory(self._command)
+        elif not isinstance(memory, (types.IntType, types.LongType)) \
+                or memory < 0:
+            raise ValueError("'memory' must be a non-negative integer, not %r"
+                             % (memory,))
+        self._memory = memory
+
         arguments = self._process_arguments(id(self), self._command, kwargs)
         self._files = self._build_files_dict(arguments)
         self._file_sets = self._build_files_map(self._command, arguments)
@@ -161,6 +179,7 @@ class AtomicCmd(object):
             raise CmdError("Calling 'run' on already running command.")
         self._temp = temp
         self._running = True
+        self._resource_usage = None
 
         # kwords for pipes are always built relative to the current directory,
         # since these are opened before (possibly) CD'ing to the temp
@@ -204,7 +223,7 @@ class AtomicCmd(object):
     def ready(self):
         """Returns true if the command has been run to completion,
         regardless of wether or not an error occured."""
-        return self._proc and self._proc.poll() is not None
+        return self._proc and self._poll(blocking=False) is not None
 
     def join(self):
         """Similar to Popen.wait(), but returns the value wrapped in a list,
@@ -214,7 +233,7 @@ class AtomicCmd(object):
             return [None]
 
         self._running = False
-        return_code = self._proc.wait()
+        return_code = self._poll(blocking=True)
         if return_code < 0:
             return_code = signals.to_str(-return_code)
         return [return_code]
@@ -228,7 +247,7 @@ class AtomicCmd(object):
     def terminate(self):
         """Sends SIGTERM to process if it is still running.
         Has no effect if the command has already finished."""
-        if self._proc and self._proc.poll() is None:
+        if self._proc and self._poll(blocking=False) is None:
             try:
                 os.killpg(self._proc.pid, signal.SIGTERM)
             except OSError:
@@ -240,6 +259,21 @@ class AtomicCmd(object):
             return self._file_sets[key]  # pylint: disable=W0212
         return property(_get_property_files)
 
+    @property
+    def memory(self):
+        """Estimated peak memory usage of the command in MB (0 if unknown)."""
+        return self._memory
+
+    @property
+    def resource_usage(self):
+        """Resources used by the command (and any child processes waited on
+        by the command), once it has been joined. This is a dictionary of
+        user / system CPU time ('user_time', 'system_time') in seconds, peak
+        memory usage ('max_rss') in KB, and the number of bytes read from or
+        written to storage ('read_bytes', 'write_bytes'). None if the command
+        has not been run, or if the usage could not be determined."""
+        return self._resource_usage
+
     executables = _property_file_sets("executable")
     requirements = _property_file_sets("requirements")
     input_files = _property_file_sets("input")
@@ -285,6 +319,32 @@ class AtomicCmd(object):
     def __str__(self):
         return atomicpp.pformat(self)
 
+    def _poll(self, blocking):
+        """Equivalent to Popen.poll / Popen.wait, but reaps the process using
+        os.wait4, in order to collect the resource usage of the process."""
+        proc = self._proc
+        while proc.returncode is None:
+            try:
+                pid, status, rusage \
+                    = os.wait4(proc.pid, 0 if blocking else os.WNOHANG)
+            except OSError, error:
+                if error.errno == errno.EINTR:
+                    continue
+                elif error.errno == errno.ECHILD:
+                    # Process was reaped elsewhere; usage is unknown
+                    return proc.wait()
+                raise
+
+            if not pid:
+                return None
+            elif os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            self._resource_usage = _rusage_to_dict(rusage)
+
+        return proc.returncode
+
     def _generate_call(self, temp):
         kwords = self._generate_filenames(self._files, root=temp)
 
@@ -299,6 +359,25 @@ class AtomicCmd(object):
                            "  Call = %s\n  Value not specified for path = %s"
                            % (self._command, error))
 
+    @classmethod
+    def _estimate_memory(cls, command):
+        """Returns the memory usage of a command in MB, based on the (last)
+        -Xmx option passed to 'java', with an allowance for the memory used
+        by the JVM itself, in addition to the heap. Returns 0 otherwise."""
+        if os.path.basename(command[0]) != "java":
+            return 0
+
+        heap_size = 0
+        for field in command:
+            if field.startswith("-Xmx"):
+                try:
+                    heap_size = parse_size(field[4:])
+                except ValueError:
+                    pass
+
+        heap_size = -(-heap_size // (1024 ** 2))
+        return heap_size + heap_size * _JVM_OVERHEAD // 100
+
     @classmethod
     def _process_arguments(cls, proc_id, command, kwargs):
         arguments = collections.defaultdict(dict)
@@ -444,6 +523,21 @@ class AtomicCmd(object):
                         map(frozenset, file_sets.itervalues())))
 
 
+def _rusage_to_dict(rusage):
+    """Converts the resource usage returned by os.wait4 to the dictionary
+    described in AtomicCmd.resource_usage. Block I/O is counted in units of
+    512 bytes, regardless of the block-size of the file-system."""
+    max_rss = rusage.ru_maxrss
+    if sys.platform == "darwin":
+        max_rss //= 1024  # Reported in bytes on OSX
+
+    return {"user_time": rusage.ru_utime,
+            "system_time": rusage.ru_stime,
+            "max_rss": max_rss,
+            "read_bytes": rusage.ru_inblock * 512,
+            "write_bytes": rusage.ru_oublock * 512}
+
+
 # The following ensures proper cleanup of child processes, for example in the
 # case where multiprocessing.Pool.terminate() is called.
 _PROCS = set()
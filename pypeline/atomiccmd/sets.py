@@ -75,6 +75,22 @@ class _CommandSet:
         for command in self._commands:
             command.terminate()
 
+    def _combine_resource_usage(self, combine_rss):
+        """Returns the sum of the resource usage of the commands that have
+        been run (see AtomicCmd.resource_usage), except for the peak memory
+        usage, which is combined using 'combine_rss'; None if no usage has
+        been recorded for any of the commands."""
+        usages = [command.resource_usage for command in self._commands]
+        usages = [usage for usage in usages if usage is not None]
+        if not usages:
+            return None
+
+        combined = {"max_rss": combine_rss(usage["max_rss"]
+                                           for usage in usages)}
+        for key in ("user_time", "system_time", "read_bytes", "write_bytes"):
+            combined[key] = sum(usage[key] for usage in usages)
+        return combined
+
     def __str__(self):
         return atomicpp.pformat(self)
 
@@ -118,6 +134,18 @@ class ParallelCmds(_CommandSet):
                 raise CmdError("ParallelCmds must only contain AtomicCmds or other ParallelCmds!")
         _CommandSet.__init__(self, commands)
 
+    @property
+    def memory(self):
+        """Combined memory usage (in MB) of the commands, run in parallel."""
+        return sum(command.memory for command in self._commands)
+
+    @property
+    def resource_usage(self):
+        """Combined resource usage of the commands (see AtomicCmd), with the
+        peak memory usage being the sum of that of the individual commands,
+        as these are run in parallel."""
+        return self._combine_resource_usage(sum)
+
     def run(self, temp):
         for command in self._commands:
             command.run(temp)
@@ -171,6 +199,18 @@ class SequentialCmds(_CommandSet):
                 raise CmdError("ParallelCmds must only contain AtomicCmds or other ParallelCmds!")
         _CommandSet.__init__(self, commands)
 
+    @property
+    def memory(self):
+        """Highest memory usage (in MB) of the commands, run sequentially."""
+        return max(command.memory for command in self._commands)
+
+    @property
+    def resource_usage(self):
+        """Combined resource usage of the commands (see AtomicCmd), with the
+        peak memory usage being the highest of the individual commands, as
+        these are run sequentially."""
+        return self._combine_resource_usage(max)
+
     def run(self, temp):
         self._ready = False
         for command in self._commands:
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Content based checks of whether or not nodes are outdated.
+
+When enabled (see --content-checksums), a manifest containing the size, mtime
+and MD5 checksum of every input and output file is written for each node,
+once the node has finished running. The manifest is placed next to the
+(first) output file of the node, named '.{filename}.checksums'.
+
+When determining if a node is outdated, the current contents of these files
+are compared to the contents recorded in the manifest, rather than comparing
+time-stamps; files are only hashed if their size or mtime has changed since
+the manifest was written, and the manifest is updated if the contents of the
+files were unchanged. Nodes without a manifest (e.g. created before checksums
+were enabled) are checked using time-stamps.
+
+Similarly, when a manifest is written, checksums recorded in the previous
+manifest of the node, or in the manifests of the nodes that produced its input
+files, are re-used for files for which the size and mtime are unchanged (see
+'known_checksums'); large input files are therefore only hashed once.
+"""
+import os
+import json
+import errno
+import hashlib
+import multiprocessing.pool
+
+
+# Incremented if the structure of the manifest changes
+_MANIFEST_VERSION = 1
+# Number of bytes read at a time when hashing files
+_BLOCK_SIZE = 1024 * 1024
+# Number of files hashed in parallel
+_HASHING_THREADS = 4
+
+
+def manifest_path(output_files):
+    """Returns the path of the manifest for a node with the given output
+    files, or None if there are no output files."""
+    if not output_files:
+        return None
+
+    dirpath, filename = os.path.split(min(output_files))
+    return os.path.join(dirpath, ".%s.checksums" % (filename,))
+
+
+def is_manifest(fpath):
+    """Returns true if the path is that of a manifest (see manifest_path)."""
+    filename = os.path.basename(fpath)
+    return filename.startswith(".") and filename.endswith(".checksums")
+
+
+def hash_files(fpaths, known=None):
+    """Returns a dictionary of path -> (size, mtime, MD5 hexdigest) for the
+    listed files, hashing files in parallel. If 'known' is a dictionary of
+    previously recorded values, the recorded hash is re-used for files for
+    which the size and mtime are unchanged."""
+    known = known or {}
+    stats = dict((fpath, _stat(fpath)) for fpath in fpaths)
+    to_hash = [fpath for (fpath, (size, mtime)) in stats.iteritems()
+               if tuple(known.get(fpath, ())[:2]) != (size, mtime)]
+
+    if len(to_hash) > 1:
+        pool = multiprocessing.pool.ThreadPool(_HASHING_THREADS)
+        try:
+            digests = dict(zip(to_hash, pool.map(_hash_file, to_hash)))
+        finally:
+            pool.terminate()
+    else:
+        digests = dict((fpath, _hash_file(fpath)) for fpath in to_hash)
+
+    result = {}
+    for (fpath, (size, mtime)) in stats.iteritems():
+        digest = digests.get(fpath)
+        if digest is None:
+            digest = known[fpath][2]
+        result[fpath] = (size, mtime, digest)
+    return result
+
+
+def write_manifest(node, known=None):
+    """Hashes the input and output files of a node, and writes the manifest
+    for the node; nothing is written for nodes without output files. If
+    'known' is set (see 'known_checksums'), recorded checksums are re-used
+    for files for which the size and mtime are unchanged."""
+    filename = manifest_path(node.output_files)
+    if filename is None:
+        return
+
+    checksums = hash_files(node.input_files | node.output_files, known)
+    _write_manifest(filename, node.input_files, node.output_files, checksums)
+
+
+def known_checksums(node):
+    """Returns a dictionary of path -> (size, mtime, hexdigest) for files of
+    the node recorded in the current manifest of the node, and in the
+    manifests of the nodes that produced its input files. Since nodes are run
+    without their dependencies, the paths of the latter manifests are
+    recorded when the node is pickled (see Node.__getstate__)."""
+    filenames = getattr(node, "producer_manifests", None)
+    if filenames is None:
+        filenames = producer_manifests(node)
+
+    known = {}
+    for filename in filenames:
+        manifest = read_manifest(filename)
+        if manifest is not None:
+            for (fpath, value) in manifest["outputs"].iteritems():
+                if fpath in node.input_files:
+                    known[fpath] = value
+
+    filename = manifest_path(node.output_files)
+    manifest = read_manifest(filename) if filename else None
+    if manifest is not None:
+        known.update(manifest["inputs"])
+        known.update(manifest["outputs"])
+
+    return known
+
+
+def producer_manifests(node):
+    """Returns the paths of the manifests of the dependencies of a node
+    (including subnodes of MetaNodes) that produce its input files."""
+    manifests = set()
+    visited = set()
+    queue = list(node.dependencies)
+    while queue:
+        dependency = queue.pop()
+        if dependency not in visited:
+            visited.add(dependency)
+            if not dependency.output_files.isdisjoint(node.input_files):
+                manifests.add(manifest_path(dependency.output_files))
+            elif not dependency.output_files:
+                queue.extend(dependency.subnodes)
+
+    return frozenset(manifests)
+
+
+def remove_manifest(node):
+    """Removes the manifest of a node, if it exists."""
+    filename = manifest_path(node.output_files)
+    if filename is not None:
+        try:
+            os.remove(filename)
+        except OSError, error:
+            if error.errno != errno.ENOENT:
+                raise
+
+
+def read_manifest(filename):
+    """Returns a dictionary containing the 'inputs' and 'outputs' recorded in
+    a manifest, each a dictionary of path -> (size, mtime, hexdigest), or None
+    if the manifest does not exist or could not be read."""
+    try:
+        with open(filename) as handle:
+            manifest = json.load(handle)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(manifest, dict) \
+            or manifest.get("version") != _MANIFEST_VERSION:
+        return None
+
+    result = {}
+    for key in ("inputs", "outputs"):
+        result[key] = dict((str(fpath), tuple(value))
+                           for (fpath, value) in manifest[key].iteritems())
+    return result
+
+
+class ChecksumStatusCache(object):
+    """Wrapper around a FileStatusCache, which determines if files are up to
+    date based on their contents, using the manifests written by
+    'write_manifest'. All other functions are forwarded to the wrapped
+    cache."""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def prefetch(self, fpaths):
+        """See FileStatusCache.prefetch."""
+        return self._cache.prefetch(fpaths)
+
+    def files_exist(self, fpaths):
+        """See FileStatusCache.files_exist."""
+        return self._cache.files_exist(fpaths)
+
+    def missing_files(self, fpaths):
+        """See FileStatusCache.missing_files."""
+        return self._cache.missing_files(fpaths)
+
+    def files_up_to_date(self, younger, older):
+        """Returns true if the contents of the files listed in 'younger' and
+        'older' (input and output files of a node) differ from the recorded
+        contents. Time-stamps are compared if no manifest exists, or if the
+        manifest does not list exactly these files."""
+        filename = manifest_path(older)
+        manifest = read_manifest(filename)
+        if manifest is None \
+                or frozenset(manifest["inputs"]) != frozenset(younger) \
+                or frozenset(manifest["outputs"]) != frozenset(older):
+            return self._cache.files_up_to_date(younger, older)
+
+        recorded = dict(manifest["inputs"])
+        recorded.update(manifest["outputs"])
+        try:
+            current = hash_files(recorded, recorded)
+        except (OSError, IOError):
+            return True
+
+        for (fpath, (_, _, digest)) in recorded.iteritems():
+            if current[fpath][2] != digest:
+                return True
+
+        if current != recorded:
+            # Contents are unchanged; record the new size / mtime to avoid
+            # having to hash these files the next time around.
+            try:
+                _write_manifest(filename, younger, older, current)
+            except (OSError, IOError):
+                pass
+
+        return False
+
+
+def _write_manifest(filename, input_files, output_files, checksums):
+    manifest = {"version": _MANIFEST_VERSION,
+                "inputs": dict((fpath, checksums[fpath])
+                               for fpath in input_files),
+                "outputs": dict((fpath, checksums[fpath])
+                                for fpath in output_files)}
+
+    temp_filename = "%s.%i.tmp" % (filename, os.getpid())
+    with open(temp_filename, "w") as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.rename(temp_filename, filename)
+
+
+def _stat(fpath):
+    stat = os.stat(fpath)
+    return (stat.st_size, stat.st_mtime)
+
+
+def _hash_file(fpath):
+    hasher = hashlib.md5()
+    with open(fpath, "rb") as handle:
+        for block in iter(lambda: handle.read(_BLOCK_SIZE), ""):
+            hasher.update(block)
+    return hasher.hexdigest()
@@ -194,6 +194,7 @@ import datetime
 import operator
 
 import pypeline.yaml
+import pypeline.profiling
 from pypeline.common.utilities import group_by_pred
 
 
@@ -214,19 +215,20 @@ def read_makefile(filename, specification):
          }
       }
     """
-    try:
-        with open(filename) as makefile:
-            string = makefile.read()
-            data = pypeline.yaml.safe_load(string)
-    except pypeline.yaml.error.YAMLError, error:
-        raise MakefileError(error)
-
-    mtime = os.path.getmtime(os.path.realpath(filename))
-    mtime_str = datetime.datetime.fromtimestamp(mtime).strftime("%F %T")
-    return {"Makefile": process_makefile(data, specification),
-            "Statistics": {"Filename": filename,
-                           "Hash": hashlib.sha1(string).hexdigest(),
-                           "MTime": mtime_str}}
+    with pypeline.profiling.phase("Parsing makefiles"):
+        try:
+            with open(filename) as makefile:
+                string = makefile.read()
+                data = pypeline.yaml.safe_load(string)
+        except pypeline.yaml.error.YAMLError, error:
+            raise MakefileError(error)
+
+        mtime = os.path.getmtime(os.path.realpath(filename))
+        mtime_str = datetime.datetime.fromtimestamp(mtime).strftime("%F %T")
+        return {"Makefile": process_makefile(data, specification),
+                "Statistics": {"Filename": filename,
+                               "Hash": hashlib.sha1(string).hexdigest(),
+                               "MTime": mtime_str}}
 
 
 def process_makefile(data, specification, path=("root",), apply_defaults=True):
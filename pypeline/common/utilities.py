@@ -174,6 +174,27 @@ def fast_pickle_test(obj):
         assert False # pragma: no coverage
 
 
+def parse_size(value):
+    """Parses a size (e.g. of memory) in bytes, optionally followed by a
+    case-insensitive suffix (k, m, g, or t), as accepted by 'java -Xmx'.
+    Returns the size in bytes, or raises a ValueError if the value could
+    not be parsed."""
+    text = str(value).strip()
+    multiplier = 1
+    if text and text[-1].lower() in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[text[-1].lower()]
+        text = text[:-1]
+
+    if not text.isdigit():
+        raise ValueError("Invalid size %r" % (value,))
+    return int(text) * multiplier
+
+_SIZE_SUFFIXES = {"k": 1024,
+                  "m": 1024 ** 2,
+                  "g": 1024 ** 3,
+                  "t": 1024 ** 4}
+
+
 def fill_dict(destination, source):
     """Returns a copy of 'destination' after setting missing key-
     pairs with copies of those of 'source' recursively."""
@@ -35,6 +35,12 @@ external programs), the RequirementObj caches results. Additionally, to avoid
 redundant calls, RequirementObjs are created using the 'Requirement' function
 which caches RequirementObjs.
 
+Results may also be cached between runs using a VersionCache (see
+'set_version_cache'), in which case the output of a system call is re-used
+until the executable (or any file passed to it, e.g. a JAR file) changes, as
+determined by the path, size, and mtime of these files. Calls not found in
+either cache may be carried out in parallel using 'prefetch'.
+
 For example, to check that the Java version is v1.7 or later:
     obj = Requirement(call=("java", "-version"),
                       search='java version "(\\d+).(\\d+)',
@@ -45,10 +51,15 @@ For example, to check that the Java version is v1.7 or later:
     except VersionRequirementError:
         pass  # requirements not met, or failure to determine version
 """
+import os
 import re
+import errno
+import cPickle
+import logging
 import operator
 import subprocess
 import collections
+import multiprocessing.pool
 
 from pypeline.common.utilities import \
     Immutable, \
@@ -63,6 +74,10 @@ from pypeline.common.fileutils import \
 _CALL_CACHE = {}
 # Cache used to store Requirement object
 _REQUIREMENT_CACHE = {}
+# Persistent cache of the output of system calls (see 'set_version_cache')
+_VERSION_CACHE = None
+# Max number of system calls carried out in parallel by 'prefetch'
+_PREFETCH_THREADS = 8
 
 
 class VersionRequirementError(StandardError):
@@ -148,6 +163,11 @@ class RequirementObj(object):
             match = self._rege.search(output)
             if not match:
                 self._raise_failure(output)
+            elif _VERSION_CACHE is not None \
+                    and not callable(self._call[0]):
+                # Only successful calls are cached, to avoid caching
+                # failures due to transient problems (e.g. lack of memory)
+                _VERSION_CACHE.store(self._call, output)
 
             self._version = tuple(0 if value is None else try_cast(value, int)
                                   for value in match.groups())
@@ -227,6 +247,111 @@ class RequirementObj(object):
             yield "    Call:          %s" % (" ".join(self._call),)
 
 
+class VersionCache(object):
+    """Persistent cache of the output of system calls used to determine
+    versions, keyed on the call and the state (path, size, and mtime) of the
+    executable and of any files passed to it. Call 'save' to write the cache
+    to disk."""
+
+    # Incremented if the structure of the cache changes
+    _CACHE_VERSION = 1
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._logger = logging.getLogger(__name__)
+        self._modified = False
+        # Dictionary of call -> (fingerprint, output)
+        self._calls = {}
+        self._load()
+
+    def lookup(self, call):
+        """Returns the cached output of a system call, or None if the call
+        has not been cached, or if any of the files involved have changed."""
+        record = self._calls.get(call)
+        if record is not None and record[0] == _fingerprint(call):
+            return record[1]
+        return None
+
+    def store(self, call, output):
+        """Records the output of a system call."""
+        fingerprint = _fingerprint(call)
+        if fingerprint is not None \
+                and self._calls.get(call) != (fingerprint, output):
+            self._calls[call] = (fingerprint, output)
+            self._modified = True
+
+    def save(self):
+        """Writes the cache to disk, if it has been modified."""
+        if not self._modified:
+            return True
+
+        cache = {"version": self._CACHE_VERSION,
+                 "calls": self._calls}
+
+        temp_filename = "%s.%i.tmp" % (self._filename, os.getpid())
+        try:
+            dirname = os.path.dirname(self._filename)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(temp_filename, "wb") as handle:
+                cPickle.dump(cache, handle, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_filename, self._filename)
+        except (OSError, IOError), error:
+            self._logger.warning("Could not write version cache %r: %s",
+                                 self._filename, error)
+            return False
+
+        self._modified = False
+        return True
+
+    def _load(self):
+        try:
+            with open(self._filename, "rb") as handle:
+                cache = cPickle.load(handle)
+        except IOError, error:
+            if error.errno != errno.ENOENT:
+                self._logger.warning("Could not read version cache %r: %s",
+                                     self._filename, error)
+            return
+        except (cPickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, IndexError), error:
+            self._logger.warning("Version cache %r is corrupt, ignoring: %s",
+                                 self._filename, error)
+            return
+
+        if isinstance(cache, dict) \
+                and cache.get("version") == self._CACHE_VERSION:
+            self._calls = cache["calls"]
+
+
+def set_version_cache(cache):
+    """Sets the persistent cache (a VersionCache or None) used to look up the
+    output of system calls; returns the previous cache."""
+    global _VERSION_CACHE
+    previous, _VERSION_CACHE = _VERSION_CACHE, cache
+    return previous
+
+
+def prefetch(requirements):
+    """Carries out the system calls required to determine the versions of
+    the listed RequirementObjs in parallel, for calls not already cached."""
+    calls = set()
+    for requirement in requirements:
+        call = requirement._call
+        if not callable(call[0]) and call not in _CALL_CACHE:
+            if _VERSION_CACHE is None or _VERSION_CACHE.lookup(call) is None:
+                calls.add(call)
+
+    if len(calls) > 1:
+        pool = multiprocessing.pool.ThreadPool(min(len(calls),
+                                                   _PREFETCH_THREADS))
+        try:
+            calls = list(calls)
+            _CALL_CACHE.update(zip(calls, pool.map(_run, calls)))
+        finally:
+            pool.terminate()
+
+
 class Check(Immutable, TotallyOrdered):
     # Ignore "missing" members; required due to use of Immutable
     # pylint: disable=E1101
@@ -420,11 +545,37 @@ def _do_call(call):
         if callable(call[0]):
             result = call[0](*call[1:])
         else:
-            result = _run(call)
+            result = None
+            if _VERSION_CACHE is not None:
+                result = _VERSION_CACHE.lookup(call)
+            if result is None:
+                result = _run(call)
         _CALL_CACHE[call] = result
         return result
 
 
+def _fingerprint(call):
+    """Returns a tuple of (path, size, mtime) for the executable, and for any
+    other files listed in a system call, or None if the executable could not
+    be found."""
+    executable = which_executable(call[0])
+    if executable is None:
+        return None
+
+    fpaths = [executable]
+    fpaths.extend(value for value in call[1:] if os.path.isfile(value))
+
+    fingerprint = []
+    for fpath in fpaths:
+        try:
+            stat = os.stat(fpath)
+        except OSError:
+            return None
+        fingerprint.append((os.path.realpath(fpath),
+                            stat.st_size, stat.st_mtime))
+    return tuple(fingerprint)
+
+
 def _pprint_version(value):
     """Pretty-print version tuple; takes a tuple of field numbers / values,
     and returns it as a string joined by dots with a 'v' prepended.
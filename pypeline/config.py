@@ -31,6 +31,8 @@ import multiprocessing
 
 from pypeline.common.fileutils import \
      make_dirs
+from pypeline.common.utilities import \
+     parse_size
 from pypeline.common.console import \
      print_info
 
@@ -50,6 +52,35 @@ class PerHostValue:
         self.is_path = is_path
 
 
+def parse_memory_limit(value):
+    """Parses a memory limit as specified on the command-line (see
+    --max-memory), returning the limit in MB, or None if memory usage is not
+    limited. The value may be 'auto' (the amount of physical memory), 'none'
+    (no limit), or a size in bytes, optionally suffixed with k, m, g, or t."""
+    if value.lower() == "auto":
+        return _get_physical_memory()
+    elif value.lower() == "none":
+        return None
+
+    try:
+        size = parse_size(value)
+    except ValueError:
+        raise ConfigError("Invalid memory limit %r; must be 'auto', 'none', "
+                          "or a size such as '16g'" % (value,))
+    return size // (1024 ** 2)
+
+
+def _get_physical_memory():
+    """Returns the amount of physical memory in MB, or None if this cannot be
+    determined on the current platform."""
+    try:
+        pages = os.sysconf("SC_PHYS_PAGES")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return None
+    return (pages * page_size) // (1024 ** 2)
+
+
 class PerHostConfig:
     """Helper class for optparse.OptionParser use by pypelines; standardizes the
     process of reading / writing overridable CLI options, while allowing per-host
@@ -79,6 +110,14 @@ class PerHostConfig:
         self.temp_root   = PerHostValue(os.path.join("/tmp", getpass.getuser(), pipeline_name), True)
         # At least 2 threads are required for e.g. PE BWA nodes, and generally recommended anyway
         self.max_threads = PerHostValue(max(2, multiprocessing.cpu_count()))
+        # Memory available to nodes; by default the amount of physical memory
+        self.max_memory  = PerHostValue("auto")
+        # Database of historical runtimes of nodes (see pypeline.runtimes)
+        self.runtime_db  = PerHostValue("~/.pypeline/runtimes.sqlite", True)
+        # Cache of version checks (see pypeline.common.versions)
+        self.version_cache = PerHostValue("~/.pypeline/versions.cache", True)
+        # Secret shared with remote workers (see pypeline.executors.remote)
+        self.remote_secret = PerHostValue("~/.pypeline/remote.secret", True)
 
         self._filenames = self._get_filenames(pipeline_name)
         self._handle    = ConfigParser.SafeConfigParser()
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Executors, responsible for running nodes on behalf of a Pypeline; see
+pypeline.executors.base for the interface implemented by executors."""
+import pypeline.executors.batch
+import pypeline.executors.remote
+
+from pypeline.executors.base import ExecutorError
+
+
+def executor_from_options(options):
+    """Returns the executor selected by the command-line options added by
+    'pypeline.executors.remote.add_optiongroup' and 'pypeline.executors.batch.
+    add_optiongroup', or None if nodes are to be run locally. Raises
+    ExecutorError if the executor could not be created."""
+    if options.remote_worker and options.batch_submit:
+        raise ExecutorError("--remote-worker and --batch-submit cannot be "
+                             "used at the same time")
+
+    return pypeline.executors.remote.executor_from_options(options) \
+        or pypeline.executors.batch.executor_from_options(options)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Base class for executors, which run nodes on behalf of a Pypeline.
+
+An executor is responsible for running nodes in processes other than the main
+process, and for reporting back once nodes have finished running. The default
+executor (see pypeline.executors.local) runs nodes using a local pool of
+processes, while other executors may distribute nodes across multiple hosts
+(see pypeline.executors.remote and pypeline.executors.batch).
+
+Nodes are passed to executors as compact task descriptors (see 'make_task'),
+which are what is actually sent to worker processes. A descriptor contains
+the pickled node (see 'serialize_node'; this excludes subnodes and
+dependencies), along with the subset of the pipeline configuration used when
+running nodes. Nodes are serialized once, when the pipeline is started, and
+the payload is re-used when the node is dispatched.
+"""
+import pickle
+import cPickle
+
+import pypeline.runtimes
+
+from pypeline.common.utilities import fast_pickle_test
+
+
+# Incremented if the structure of task descriptors change
+TASK_VERSION = 1
+
+
+class ExecutorError(RuntimeError):
+    """Raised if an executor could not be started, or if a node was lost,
+    e.g. due to the connection to a worker being lost."""
+    pass
+
+
+class BaseExecutor(object):
+    """Interface for executors; see module documentation.
+
+    Nodes are identified by a key (unique among running nodes), which is
+    returned by 'wait' once a node has finished running. The attribute
+    'max_threads' specifies the number of threads that the executor can
+    run at once, and is used to determine how many nodes to start."""
+
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+
+    def start(self, key, node, task):
+        """Starts running a node in the background; the node may be queued
+        by the executor if resources are not immediately available. 'task'
+        is the descriptor of the node (see 'make_task'), which is passed to
+        'run_task' in the worker, while 'node' may be used to determine the
+        resources (threads, memory) required by the task."""
+        raise NotImplementedError()
+
+    def wait(self, blocking=True):
+        """Returns a tuple of (key, error, stats) for a node that has finished
+        running, where 'error' is the exception raised when running the node,
+        or None if the node was run successfully, and 'stats' are the runtime
+        statistics returned by 'run_task' (None if the node failed).
+
+        If no nodes have finished and 'blocking' is false, or if waiting was
+        interrupted (e.g. by SIGINT), None is returned."""
+        raise NotImplementedError()
+
+    def set_runtime_estimates(self, estimate_runtime):
+        """Called with a function returning the expected runtime of a node in
+        seconds, or None if no estimate is available (see RunableQueue), if
+        runtimes are recorded for the pipeline. Ignored by default."""
+
+    def process_ids(self):
+        """Returns a dictionary of key -> PID of the process on the local host
+        running the corresponding node, for nodes run locally; used to report
+        resource usage (see pypeline.metrics). May be called from any
+        thread."""
+        return {}
+
+    def close(self):
+        """Waits for running nodes to finish, and releases any resources."""
+        raise NotImplementedError()
+
+    def terminate(self):
+        """Terminates running nodes without waiting for them to finish, and
+        releases any resources; used if the pipeline is interrupted (CTRL-C
+        pressed twice). By default, this is equivalent to 'close', which is
+        sufficient for executors for which 'close' does not block."""
+        self.close()
+
+
+class TaskConfig(object):
+    """The subset of the pipeline configuration used by Node.run; passed to
+    nodes run by 'run_task', in place of the full configuration."""
+
+    def __init__(self, temp_root, content_checksums=False):
+        self.temp_root = temp_root
+        self.content_checksums = content_checksums
+
+
+def serialize_node(node):
+    """Returns the pickled node, for use with 'make_task'. Raises a
+    pickle.PicklingError if the node cannot be pickled."""
+    try:
+        return cPickle.dumps(node, cPickle.HIGHEST_PROTOCOL)
+    except (TypeError, cPickle.PicklingError):
+        # Raises PicklingError with a more informative message
+        fast_pickle_test(node)
+        raise pickle.PicklingError("Could not pickle %r" % (node,))
+
+
+def make_task(payload, config):
+    """Returns a task descriptor for a node serialized using
+    'serialize_node', to be run using 'run_task'."""
+    return (TASK_VERSION,
+            payload,
+            config.temp_root,
+            bool(getattr(config, "content_checksums", False)))
+
+
+def run_task(task):
+    """Runs the node described by a task descriptor (see 'make_task') in the
+    current process, returning the runtime statistics of the node (see
+    pypeline.runtimes). This function is used by executors to run nodes in
+    worker processes; any exceptions are propagated."""
+    if task[0] != TASK_VERSION:
+        raise ExecutorError("Task was created by a different version of "
+                            "the pipeline")
+
+    _, payload, temp_root, content_checksums = task
+    node = cPickle.loads(payload)
+    config = TaskConfig(temp_root, content_checksums)
+
+    return pypeline.runtimes.measure(node.run, node, config)
+
+
+def picklable_error(error):
+    """Returns the exception if it can be pickled (and hence returned to the
+    main process), or a ExecutorError with the same message otherwise."""
+    try:
+        cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL)
+    except (TypeError, cPickle.PicklingError):
+        return ExecutorError("%s: %s" % (error.__class__.__name__, error))
+    return error
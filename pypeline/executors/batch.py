@@ -0,0 +1,453 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Executor running nodes as jobs submitted to a batch-queue system.
+
+Nodes are written to a job folder, as task descriptors (see
+pypeline.executors.base), (see --batch-root), which must reside on a
+file-system shared with the compute nodes, and a job script is submitted
+using a user supplied command (see --batch-submit), e.g. 'sbatch' (SLURM) or
+'qsub' (SGE). When run, the job script runs the nodes using this module (see
+'main'), and writes the result of each node to the job folder. The pipeline
+polls the job folders for results, and optionally uses a status command (see
+--batch-status) to detect jobs that have ended without producing results,
+e.g. due to having been killed by the batch-queue system.
+
+The submit command may contain the fields '{threads}', '{memory}' (MB), and
+'{name}', which are replaced with the requirements of the job; the path to
+the job script is appended to the command. Tasks for which the memory usage
+is unknown (0) are assigned a default amount of memory (see
+--batch-default-memory), since e.g. SLURM reserves all memory on a host when
+requesting 0 MB. The job ID is the first number written by the submit command
+to STDOUT. The status command is called with the job ID appended, and a job
+is considered to be queued or running if the command returns 0 and writes
+anything to STDOUT. If the pipeline is terminated (CTRL-C pressed twice),
+queued and running jobs are cancelled using the cancel command (see
+--batch-cancel), called with the IDs of the jobs appended.
+
+Single-threaded nodes that are expected to be cheap, such as indexing nodes,
+are bundled into a single job, in order to reduce per-job overhead. Nodes in a
+bundle are run sequentially. A node is considered cheap if its estimated
+runtime is less than pypeline.scheduler.DEFAULT_COST seconds; recorded
+runtimes are used if available (see 'set_runtime_estimates'), and otherwise
+the per-class estimates (see pypeline.scheduler.estimate_cost), in which only
+a few cheap classes are listed below the default cost.
+"""
+import os
+import re
+import sys
+import time
+import errno
+import shlex
+import cPickle
+import logging
+import optparse
+import tempfile
+import subprocess
+import collections
+
+import pypeline
+
+from pypeline.scheduler import \
+    estimate_cost, \
+    DEFAULT_COST
+from pypeline.executors.base import \
+    BaseExecutor, \
+    ExecutorError, \
+    run_task, \
+    picklable_error
+from pypeline.common.fileutils import \
+    make_dirs, \
+    try_rmtree
+
+
+# Name of the job script written to each job folder
+_JOB_SCRIPT = "job.sh"
+# Name of the file to which output from the job script is written
+_JOB_LOG = "job.log"
+# Regular expression used to find the job ID in the output of --batch-submit
+_JOB_ID = re.compile(r"\d+")
+
+
+def add_optiongroup(parser):
+    """Adds an option-group to an OptionParser object, with options
+    pertaining to running nodes as jobs on a batch-queue system."""
+    group = optparse.OptionGroup(parser, "Batch-queue jobs")
+    group.add_option("--batch-submit", default=None, metavar="COMMAND",
+                     help="Run tasks as jobs submitted to a batch-queue "
+                          "system using this command, e.g. 'sbatch "
+                          "--parsable -c {threads} --mem {memory}M'. The "
+                          "path to the job script is appended to the "
+                          "command, and the first number written to STDOUT "
+                          "is used as the job ID. --max-threads limits the "
+                          "combined number of threads used by queued and "
+                          "running jobs.")
+    group.add_option("--batch-status", default=None, metavar="COMMAND",
+                     help="Command used to check if a job is still queued or "
+                          "running, e.g. 'squeue -h -j'; the job ID is "
+                          "appended to the command. If not set, jobs killed "
+                          "by the batch-queue system are not detected.")
+    group.add_option("--batch-cancel", default=None, metavar="COMMAND",
+                     help="Command used to cancel queued or running jobs if "
+                          "the pipeline is terminated (CTRL-C pressed "
+                          "twice), e.g. 'scancel' or 'qdel'; the job IDs are "
+                          "appended to the command. If not set, jobs are "
+                          "left running.")
+    group.add_option("--batch-default-memory", default=2048, type=int,
+                     metavar="MB",
+                     help="Memory requested ({memory}) for jobs in which "
+                          "the memory usage of tasks is unknown [%default]")
+    group.add_option("--batch-root", default="batch_jobs",
+                     help="Folder in which job scripts and results are "
+                          "stored; must be on a file-system shared with the "
+                          "compute nodes [%default]")
+    group.add_option("--batch-bundle-size", default=20, type=int,
+                     help="Max number of small tasks (e.g. indexing) run "
+                          "by a single job [%default]")
+    group.add_option("--batch-poll-interval", default=15.0, type=float,
+                     help="Seconds between checks for finished jobs "
+                          "[%default]")
+    parser.add_option_group(group)
+
+
+def executor_from_options(options):
+    """Returns a BatchExecutor based on the options listed in options (see
+    'add_optiongroup'), or None if --batch-submit was not specified."""
+    if not options.batch_submit:
+        return None
+
+    return BatchExecutor(max_threads=options.max_threads,
+                         submit_cmd=options.batch_submit,
+                         status_cmd=options.batch_status,
+                         cancel_cmd=options.batch_cancel,
+                         default_memory=options.batch_default_memory,
+                         root=options.batch_root,
+                         bundle_size=options.batch_bundle_size,
+                         poll_interval=options.batch_poll_interval)
+
+
+class BatchExecutor(BaseExecutor):
+    """Executor submitting nodes as jobs to a batch-queue system; see module
+    documentation. Small nodes started between calls to 'wait' are bundled
+    into jobs of up to 'bundle_size' nodes."""
+
+    def __init__(self, max_threads, submit_cmd, status_cmd=None,
+                 cancel_cmd=None, default_memory=2048, root="batch_jobs",
+                 bundle_size=20, poll_interval=15.0):
+        BaseExecutor.__init__(self, max_threads)
+        self._logger = logging.getLogger(__name__)
+        self._submit_cmd = shlex.split(submit_cmd)
+        self._status_cmd = shlex.split(status_cmd) if status_cmd else None
+        self._cancel_cmd = shlex.split(cancel_cmd) if cancel_cmd else None
+        self._default_memory = default_memory
+        self._bundle_size = max(1, bundle_size)
+        self._poll_interval = poll_interval
+        self._estimate_runtime = None
+
+        try:
+            make_dirs(root)
+        except OSError, error:
+            raise ExecutorError("Could not create batch root %r: %s"
+                                % (root, error))
+        self._root = os.path.abspath(root)
+
+        # Small nodes, not yet submitted: list of (key, node, task)
+        self._bundle = []
+        # Submitted jobs
+        self._jobs = []
+        # Queue of (key, error, stats) not yet returned by 'wait'
+        self._finished = collections.deque()
+
+    def start(self, key, node, task):
+        """See BaseExecutor.start."""
+        if self._is_cheap(node):
+            self._bundle.append((key, node, task))
+            if len(self._bundle) >= self._bundle_size:
+                self._submit_bundle()
+        else:
+            self._submit([(key, node, task)])
+
+    def set_runtime_estimates(self, estimate_runtime):
+        """See BaseExecutor.set_runtime_estimates."""
+        self._estimate_runtime = estimate_runtime
+
+    def wait(self, blocking=True):
+        """See BaseExecutor.wait."""
+        self._submit_bundle()
+
+        while not self._finished and self._jobs:
+            self._poll()
+            if self._finished or not blocking:
+                break
+
+            # Sleep is cut short by signals (e.g. SIGINT); handled by caller
+            time.sleep(self._poll_interval)
+            blocking = False  # only poll once more
+
+        if self._finished:
+            return self._finished.popleft()
+        return None
+
+    def close(self):
+        """See BaseExecutor.close. Jobs that are still queued or running are
+        not cancelled; job folders of failed jobs are kept."""
+        self._submit_bundle()
+        if self._jobs:
+            self._logger.warning("%i batch job(s) still queued or running; "
+                                 "see %r", len(self._jobs), self._root)
+
+        try:
+            os.rmdir(self._root)
+        except OSError:
+            pass  # Not empty; kept for inspection
+
+    def terminate(self):
+        """See BaseExecutor.terminate. Small nodes not yet submitted are
+        dropped, and queued or running jobs are cancelled using the cancel
+        command, if any; job folders are kept for inspection."""
+        self._bundle = []
+        if self._jobs and self._cancel_cmd is not None:
+            command = self._cancel_cmd + [job.job_id for job in self._jobs]
+            try:
+                proc = subprocess.Popen(command,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        close_fds=True)
+                _, stderr = proc.communicate()
+            except OSError, error:
+                self._logger.error("Could not run cancel command %r: %s",
+                                   command[0], error)
+            else:
+                if proc.returncode:
+                    self._logger.error("Cancel command failed with return-"
+                                       "code %i: %s", proc.returncode,
+                                       stderr.strip())
+                else:
+                    self._jobs = []
+
+        self.close()
+
+    def _is_cheap(self, node):
+        """Returns true if a node may be bundled with other nodes; nodes of
+        classes with no known cost are never bundled, unless recorded
+        runtimes show these to be cheap."""
+        if node.threads != 1:
+            return False
+
+        runtime = None
+        if self._estimate_runtime is not None:
+            runtime = self._estimate_runtime(node)
+        if runtime is None:
+            runtime = estimate_cost(node)
+
+        return runtime < DEFAULT_COST
+
+    def _submit_bundle(self):
+        if self._bundle:
+            bundle, self._bundle = self._bundle, []
+            self._submit(bundle)
+
+    def _submit(self, tasks):
+        """Writes a job folder for the tasks, and submits the job script."""
+        job = _Job(tempfile.mkdtemp(prefix="job_", dir=self._root), tasks)
+        memory = job.memory or self._default_memory
+        command = [value.format(threads=job.threads,
+                                memory=memory,
+                                name=job.name)
+                   for value in self._submit_cmd]
+        command.append(job.write_script())
+
+        try:
+            proc = subprocess.Popen(command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    close_fds=True)
+            stdout, stderr = proc.communicate()
+        except OSError, error:
+            self._fail(job, "Could not run submit command %r: %s"
+                       % (command[0], error))
+            return
+
+        match = _JOB_ID.search(stdout)
+        if proc.returncode:
+            self._fail(job, "Submit command failed with return-code %i: %s"
+                       % (proc.returncode, stderr.strip()))
+        elif not match:
+            self._fail(job, "Could not find job ID in output of submit "
+                            "command: %r" % (stdout.strip(),))
+        else:
+            job.job_id = match.group()
+            self._jobs.append(job)
+
+    def _poll(self):
+        """Collects results from submitted jobs, and fails any nodes belonging
+        to jobs that have ended without producing results."""
+        jobs = []
+        for job in self._jobs:
+            # Check status first, as results are written before a job ends
+            is_alive = self._is_alive(job)
+            self._finished.extend(job.collect())
+            if not job.tasks:
+                if not job.failed:
+                    try_rmtree(job.root)
+            elif not is_alive:
+                self._fail(job, "Batch job %s ended without producing "
+                                "results; see %r"
+                           % (job.job_id, os.path.join(job.root, _JOB_LOG)))
+            else:
+                jobs.append(job)
+        self._jobs = jobs
+
+    def _is_alive(self, job):
+        if self._status_cmd is None:
+            return True
+
+        command = self._status_cmd + [job.job_id]
+        try:
+            proc = subprocess.Popen(command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    close_fds=True)
+            stdout, _ = proc.communicate()
+        except OSError, error:
+            self._logger.warning("Could not run status command %r: %s",
+                                 command[0], error)
+            return True
+
+        return not proc.returncode and bool(stdout.strip())
+
+    def _fail(self, job, message):
+        error = ExecutorError(message)
+        for key in job.tasks.itervalues():
+            self._finished.append((key, error, None))
+        job.tasks.clear()
+
+
+class _Job(object):
+    """A job folder containing one or more pickled tasks."""
+
+    def __init__(self, root, tasks):
+        self.root = root
+        self.job_id = None
+        self.failed = False
+        self.threads = max(node.threads for (_, node, _) in tasks)
+        self.memory = max(node.memory for (_, node, _) in tasks)
+        self.name = "paleomix_%s" % (tasks[0][1].__class__.__name__,)
+        # Dictionary of task index -> key, for tasks without results
+        self.tasks = {}
+
+        for (index, (key, _, task)) in enumerate(tasks):
+            filename = os.path.join(root, "task_%i.pickle" % (index,))
+            with open(filename, "wb") as handle:
+                cPickle.dump(task, handle, cPickle.HIGHEST_PROTOCOL)
+            self.tasks[index] = key
+
+    def write_script(self):
+        """Writes the job script, returning the path of the script."""
+        module_root = os.path.dirname(os.path.dirname(pypeline.__file__))
+        filename = os.path.join(self.root, _JOB_SCRIPT)
+        with open(filename, "w") as handle:
+            handle.write("#!/bin/sh\n")
+            handle.write("PYTHONPATH=%s${PYTHONPATH:+:$PYTHONPATH}\n"
+                         % (_quote(module_root),))
+            handle.write("export PYTHONPATH\n")
+            handle.write("exec %s -m pypeline.executors.batch %s > %s 2>&1\n"
+                         % (_quote(sys.executable), _quote(self.root),
+                            _quote(os.path.join(self.root, _JOB_LOG))))
+        os.chmod(filename, 0755)
+        return filename
+
+    def collect(self):
+        """Returns a list of (key, error, stats) for tasks that have finished
+        since the last call; results are removed from 'tasks'."""
+        results = []
+        for index in sorted(self.tasks):
+            result = _read_result(self.root, index)
+            if result is not None:
+                error, stats = result
+                self.failed |= error is not None
+                results.append((self.tasks.pop(index), error, stats))
+        return results
+
+
+def _quote(value):
+    return "'%s'" % (value.replace("'", "'\\''"),)
+
+
+def _read_result(root, index):
+    filename = os.path.join(root, "task_%i.result" % (index,))
+    try:
+        with open(filename, "rb") as handle:
+            return cPickle.load(handle)
+    except IOError, error:
+        if error.errno != errno.ENOENT:
+            return (ExecutorError("Could not read result %r: %s"
+                                  % (filename, error)), None)
+    except (cPickle.UnpicklingError, EOFError, AttributeError,
+            ImportError, IndexError), error:
+        return (ExecutorError("Could not read result %r: %s"
+                              % (filename, error)), None)
+    return None
+
+
+def _run_task(root, index):
+    """Runs a single pickled task, and writes the result to the job folder."""
+    try:
+        filename = os.path.join(root, "task_%i.pickle" % (index,))
+        with open(filename, "rb") as handle:
+            task = cPickle.load(handle)
+        result = (None, run_task(task))
+    except Exception, error:
+        result = (picklable_error(error), None)
+
+    filename = os.path.join(root, "task_%i.result" % (index,))
+    temp_filename = "%s.%i.tmp" % (filename, os.getpid())
+    with open(temp_filename, "wb") as handle:
+        cPickle.dump(result, handle, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_filename, filename)
+
+    return result[0] is None
+
+
+def main(argv):
+    """Runs the nodes in a job folder; called by job scripts."""
+    if len(argv) != 1:
+        sys.stderr.write("Usage: python -m pypeline.executors.batch "
+                         "JOB_FOLDER\n")
+        return 1
+
+    logging.basicConfig(level=logging.INFO)
+    root = argv[0]
+    indices = sorted(int(filename.split("_")[1].split(".")[0])
+                     for filename in os.listdir(root)
+                     if filename.startswith("task_")
+                     and filename.endswith(".pickle"))
+
+    return_code = 0
+    for index in indices:
+        if not _run_task(root, index):
+            return_code = 1
+    return return_code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
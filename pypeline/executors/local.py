@@ -0,0 +1,256 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Executor running nodes using local worker processes.
+
+This is the default executor used by Pypeline; see pypeline.executors.base.
+
+Rather than forking the (potentially very large) main process, every worker
+is a new Python process started using 'python -m pypeline.executors.local',
+which only imports the modules required to run the tasks it receives. Worker
+memory usage therefore does not depend on the size of the pipeline. Workers
+run one task at a time, and are re-used for subsequent tasks.
+
+Workers receive messages on stdin and reply on stdout, using the message
+format of multiprocessing.connection; the stdout of the worker itself is
+redirected to stderr, to prevent output from corrupting messages. As with
+multiprocessing's 'spawn' start-method, the first message sent to a worker is
+the 'sys.path' of the pipeline, so that the modules defining nodes may be
+imported by the worker.
+
+Messages sent from the pipeline to a worker:
+  sys.path                    -- Sent once, when the worker is started.
+  (key, task)                 -- Run the task (see 'make_task').
+
+Messages sent from a worker to the pipeline:
+  (key, error, stats)         -- Task finished running; 'error' is None if
+                                 the node was run succesfully.
+
+Workers terminate once stdin is closed. Workers ignore SIGINT, and are instead
+sent SIGTERM if the pipeline is terminated (see 'LocalExecutor.terminate'),
+which kills the commands run by the current task (see AtomicCmd).
+"""
+import os
+import sys
+import errno
+import select
+import signal
+import collections
+import subprocess
+import _multiprocessing
+
+import pypeline
+
+from pypeline.executors.base import \
+    BaseExecutor, \
+    ExecutorError, \
+    run_task, \
+    picklable_error
+
+
+class LocalExecutor(BaseExecutor):
+    """Runs nodes in worker processes, each running one node at a time;
+    workers are started as needed, and at most 'max_threads' idle workers
+    are kept for re-use."""
+
+    def __init__(self, max_threads):
+        BaseExecutor.__init__(self, max_threads)
+        # List of workers not currently running a node
+        self._idle = []
+        # Dictionary of keys -> workers running the corresponding node
+        self._running = {}
+        # Queue of (key, error, stats) not yet returned by 'wait'
+        self._finished = collections.deque()
+
+    def start(self, key, node, task):
+        """See BaseExecutor.start."""
+        try:
+            worker = self._idle.pop() if self._idle else _Worker()
+            worker.start(key, task)
+        except (OSError, IOError), error:
+            error = ExecutorError("Could not start worker process: %s"
+                                  % (error,))
+            self._finished.append((key, error, None))
+            return
+
+        self._running[key] = worker
+
+    def wait(self, blocking=True):
+        """See BaseExecutor.wait."""
+        while not self._finished and self._running:
+            busy = dict((worker.fileno(), worker)
+                        for worker in self._running.itervalues())
+
+            try:
+                ready, _, _ = select.select(busy, [], [],
+                                            None if blocking else 0)
+            except select.error, error:
+                # User pressed ctrl-c (SIGINT), or similar event ...
+                if error.args[0] != errno.EINTR:
+                    raise
+                break
+
+            for fileno in ready:
+                self._receive(busy[fileno])
+
+            if not blocking:
+                break
+
+        if self._finished:
+            return self._finished.popleft()
+        return None
+
+    def process_ids(self):
+        """See BaseExecutor.process_ids."""
+        return dict((key, worker.pid)
+                    for (key, worker) in self._running.items())
+
+    def close(self):
+        """See BaseExecutor.close; waits for running nodes to finish."""
+        for worker in self._idle + self._running.values():
+            worker.close()
+        self._idle = []
+        self._running = {}
+
+    def terminate(self):
+        """See BaseExecutor.terminate; workers running nodes are terminated,
+        killing the commands they are running."""
+        for worker in self._running.itervalues():
+            worker.terminate()
+        self.close()
+
+    def _receive(self, worker):
+        try:
+            key, error, stats = worker.recv()
+        except (EOFError, IOError), error:
+            worker.close()
+            key = worker.key
+            error = ExecutorError("Worker process terminated unexpectedly "
+                                  "(exit code %s)" % (worker.returncode,))
+            stats = None
+        else:
+            if len(self._idle) < self.max_threads:
+                self._idle.append(worker)
+            else:
+                worker.close()
+
+        self._running.pop(key)
+        self._finished.append((key, error, stats))
+
+
+class _Worker(object):
+    """A single worker process; see module documentation."""
+
+    def __init__(self):
+        # Allow the worker to import this module, regardless of where
+        # PALEOMIX is installed; 'sys.path' is passed once started.
+        env = dict(os.environ)
+        module_root = os.path.dirname(os.path.dirname(pypeline.__file__))
+        python_path = env.get("PYTHONPATH")
+        if python_path:
+            module_root = os.pathsep.join((module_root, python_path))
+        env["PYTHONPATH"] = module_root
+
+        self._proc = subprocess.Popen([sys.executable, "-m",
+                                       "pypeline.executors.local"],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      close_fds=True,
+                                      env=env)
+        self._conn_out = _multiprocessing.Connection(
+            os.dup(self._proc.stdin.fileno()), readable=False)
+        self._conn_in = _multiprocessing.Connection(
+            os.dup(self._proc.stdout.fileno()), writable=False)
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._conn_out.send(list(sys.path))
+        self.key = None
+
+    def start(self, key, task):
+        self._conn_out.send((key, task))
+        self.key = key
+
+    def recv(self):
+        return self._conn_in.recv()
+
+    def fileno(self):
+        return self._conn_in.fileno()
+
+    @property
+    def pid(self):
+        return self._proc.pid
+
+    @property
+    def returncode(self):
+        return self._proc.returncode
+
+    def close(self):
+        """Closes the connection to the worker, which terminates once any
+        running task has finished, and waits for the worker to terminate."""
+        if not self._conn_out.closed:
+            self._conn_out.close()
+            self._conn_in.close()
+        self._proc.wait()
+
+    def terminate(self):
+        """Sends SIGTERM to the worker, which kills any commands run by the
+        current task, and waits for the worker to terminate."""
+        if self._proc.returncode is None:
+            try:
+                self._proc.terminate()
+            except OSError:
+                pass  # Worker has already terminated
+        self.close()
+
+
+def main(argv):
+    """Main function for worker processes; see module documentation."""
+    if argv:
+        sys.stderr.write("Usage: python -m pypeline.executors.local\n")
+        return 1
+
+    # KeyboardInterrupts are handled by the pipeline
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    conn_in = _multiprocessing.Connection(os.dup(0), writable=False)
+    conn_out = _multiprocessing.Connection(os.dup(1), readable=False)
+    with open(os.devnull) as handle:
+        os.dup2(handle.fileno(), 0)
+    os.dup2(2, 1)
+
+    try:
+        sys.path[:] = conn_in.recv()
+        while True:
+            key, task = conn_in.recv()
+            try:
+                result = (key, None, run_task(task))
+            except Exception, error:
+                result = (key, picklable_error(error), None)
+            conn_out.send(result)
+    except (EOFError, IOError):
+        pass  # Connection to the pipeline closed
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
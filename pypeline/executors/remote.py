@@ -0,0 +1,422 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Executor running nodes on worker daemons on (multiple) remote hosts.
+
+Worker daemons are started on each host using 'paleomix worker', and listen
+for connections from a pipeline (see --remote-worker). Communication uses
+multiprocessing.connection, i.e. pickled messages sent over a socket, with
+connections being authenticated using a shared secret (see --remote-secret).
+Nodes are sent as task descriptors (see pypeline.executors.base), which
+contain paths as is; all hosts are therefore expected to share file-systems,
+using identical paths for both input / output files, and temporary folders.
+
+Messages sent from the pipeline to a worker:
+  ("run", key, task)          -- Run the task (see 'make_task'), with the
+                                 same semantics as the LocalExecutor.
+  ("close",)                  -- Wait for running nodes, and disconnect.
+  ("terminate",)              -- Terminate running nodes, and disconnect.
+
+Messages sent from a worker to the pipeline:
+  ("hello", version, threads) -- Sent on connection; 'threads' is the number
+                                 of nodes that may be run by the worker.
+  ("done", key, error, stats) -- Node finished running; 'error' is None if
+                                 the node was run succesfully.
+
+A worker serves a single pipeline at a time. If the connection to a pipeline
+is lost, nodes running on the worker are terminated; if the connection to a
+worker is lost, the pipeline considers nodes running on that worker failed.
+"""
+import sys
+import errno
+import select
+import signal
+import logging
+import optparse
+import argparse
+import threading
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+import pypeline
+
+from pypeline.executors.base import \
+    BaseExecutor, \
+    ExecutorError, \
+    run_task, \
+    picklable_error
+
+
+# Default port used by worker daemons
+DEFAULT_PORT = 24578
+
+
+def add_optiongroup(parser, secret_default):
+    """Adds an option-group to an OptionParser object, with options
+    pertaining to running nodes on remote workers."""
+    group = optparse.OptionGroup(parser, "Remote workers")
+    group.add_option("--remote-worker", default=[], action="append",
+                     metavar="HOST[:PORT]",
+                     help="Run tasks on the worker daemon (see 'paleomix "
+                          "worker') at the specified address, rather than "
+                          "locally; may be specified multiple times. The "
+                          "workers must share file-systems with this host. "
+                          "The default port is %i." % (DEFAULT_PORT,))
+    group.add_option("--remote-secret", default=secret_default,
+                     help="File containing the secret shared with remote "
+                          "workers, used to authenticate connections "
+                          "[%default]")
+    parser.add_option_group(group)
+
+
+def executor_from_options(options):
+    """Returns a RemoteExecutor connected to the workers listed in options
+    (see 'add_optiongroup'), or None if no workers were specified. Raises
+    ExecutorError if the workers could not be connected to."""
+    if not options.remote_worker:
+        return None
+
+    try:
+        addresses = [parse_address(value) for value in options.remote_worker]
+    except ValueError, error:
+        raise ExecutorError(str(error))
+
+    return RemoteExecutor(addresses, read_secret(options.remote_secret))
+
+
+def parse_address(value):
+    """Parses a 'host[:port]' string, returning a tuple of (host, port)."""
+    host, _, port = value.rpartition(":")
+    if not host:
+        return (value, DEFAULT_PORT)
+    elif not port.isdigit():
+        raise ValueError("Invalid port in worker address %r" % (value,))
+    return (host, int(port))
+
+
+def read_secret(filename):
+    """Reads the secret shared by pipelines and workers, used to authenticate
+    connections, raising ExecutorError if it could not be read."""
+    try:
+        with open(filename) as handle:
+            secret = handle.read().strip()
+    except IOError, error:
+        raise ExecutorError("Could not read secret from %r: %s"
+                            % (filename, error))
+
+    if not secret:
+        raise ExecutorError("Secret in %r is empty" % (filename,))
+    return secret
+
+
+class RemoteExecutor(BaseExecutor):
+    """Executor running nodes on one or more remote workers (WorkerServer);
+    'max_threads' is the combined number of threads of all workers. Nodes
+    are queued locally until a worker with enough idle threads becomes
+    available; nodes requiring more threads than any worker has are run on
+    otherwise idle workers."""
+
+    def __init__(self, addresses, authkey):
+        self._logger = logging.getLogger(__name__)
+        self._workers = []
+        # Queue of (key, node, task) not yet sent to a worker
+        self._pending = collections.deque()
+        # Queue of (key, error, stats) not yet returned by 'wait'
+        self._finished = collections.deque()
+
+        try:
+            for address in addresses:
+                self._workers.append(_Worker(address, authkey))
+        except:
+            self.close()
+            raise
+
+        BaseExecutor.__init__(self, sum(worker.threads
+                                        for worker in self._workers))
+
+    def start(self, key, node, task):
+        """See BaseExecutor.start."""
+        self._pending.append((key, node, task))
+        self._dispatch()
+
+    def wait(self, blocking=True):
+        """See BaseExecutor.wait."""
+        while not self._finished:
+            busy = dict((worker.conn.fileno(), worker)
+                        for worker in self._workers if worker.running)
+            if not busy:
+                self._fail_pending()
+                break
+
+            try:
+                ready, _, _ = select.select(busy, [], [],
+                                            None if blocking else 0)
+            except select.error, error:
+                if error.args[0] != errno.EINTR:
+                    raise
+                break
+
+            for fileno in ready:
+                self._receive(busy[fileno])
+            self._dispatch()
+
+            if not blocking:
+                break
+
+        if self._finished:
+            return self._finished.popleft()
+        return None
+
+    def close(self):
+        """See BaseExecutor.close."""
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+    def terminate(self):
+        """See BaseExecutor.terminate."""
+        self._pending.clear()
+        for worker in self._workers:
+            worker.terminate()
+        self._workers = []
+
+    def _receive(self, worker):
+        try:
+            _, key, error, stats = worker.conn.recv()
+        except (EOFError, IOError), error:
+            self._logger.error("Lost connection to worker %s:%i: %s",
+                               worker.address[0], worker.address[1], error)
+            self._workers.remove(worker)
+            worker.close()
+
+            error = ExecutorError("Connection to worker %s:%i lost"
+                                  % worker.address)
+            for key in worker.running:
+                self._finished.append((key, error, None))
+            return
+
+        worker.finished(key)
+        self._finished.append((key, error, stats))
+
+    def _dispatch(self):
+        """Sends pending nodes to workers with enough idle threads, in the
+        order in which nodes were started."""
+        pending = collections.deque()
+        while self._pending:
+            key, node, task = item = self._pending.popleft()
+            for worker in self._workers:
+                is_idle = not worker.running
+                if worker.idle >= node.threads \
+                        or (is_idle and node.threads > worker.threads):
+                    worker.start(key, node, task)
+                    break
+            else:
+                pending.append(item)
+        self._pending = pending
+
+    def _fail_pending(self):
+        """Fails nodes that cannot be run, due to all workers being lost."""
+        if not self._workers:
+            error = ExecutorError("No workers available")
+            while self._pending:
+                key, _, _ = self._pending.popleft()
+                self._finished.append((key, error, None))
+
+
+class _Worker(object):
+    """Connection to a single remote worker."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        try:
+            self.conn = multiprocessing.connection.Client(address,
+                                                          authkey=authkey)
+            message, version, threads = self.conn.recv()
+        except (EOFError, IOError, multiprocessing.AuthenticationError), error:
+            raise ExecutorError("Could not connect to worker at %s:%i: %s"
+                                % (address[0], address[1], error))
+
+        if message != "hello" or version != pypeline.__version__:
+            self.conn.close()
+            raise ExecutorError("Worker at %s:%i is running a different "
+                                "version of PALEOMIX (%s)"
+                                % (address[0], address[1], version))
+
+        self.threads = threads
+        self.idle = threads
+        # Dictionary of key -> threads for nodes running on the worker
+        self.running = {}
+
+    def start(self, key, node, task):
+        self.conn.send(("run", key, task))
+        self.running[key] = node.threads
+        self.idle -= node.threads
+
+    def finished(self, key):
+        self.idle += self.running.pop(key)
+
+    def close(self):
+        self._send_and_close(("close",))
+
+    def terminate(self):
+        self._send_and_close(("terminate",))
+
+    def _send_and_close(self, message):
+        try:
+            self.conn.send(message)
+        except (IOError, ValueError):
+            pass  # Connection lost or already closed
+        self.conn.close()
+
+
+class WorkerServer(object):
+    """Worker daemon, running nodes on behalf of a remote pipeline using a
+    pool of 'threads' processes. See module documentation."""
+
+    def __init__(self, address, authkey, threads):
+        self._logger = logging.getLogger(__name__)
+        self._threads = threads
+        self._listener = multiprocessing.connection.Listener(address,
+                                                             authkey=authkey)
+        self.address = self._listener.address
+
+    def serve(self, max_connections=None):
+        """Serves pipelines until 'max_connections' pipelines have been
+        served, or forever if 'max_connections' is None."""
+        while max_connections is None or max_connections > 0:
+            try:
+                conn = self._listener.accept()
+            except (EOFError, IOError,
+                    multiprocessing.AuthenticationError), error:
+                self._logger.warning("Rejected connection: %s", error)
+                continue
+
+            try:
+                self._serve_connection(conn)
+            finally:
+                conn.close()
+
+            if max_connections is not None:
+                max_connections -= 1
+
+    def close(self):
+        self._listener.close()
+
+    def _serve_connection(self, conn):
+        lock = threading.Lock()
+
+        def _callback(result):
+            with lock:
+                try:
+                    conn.send(("done",) + result)
+                except (IOError, ValueError):
+                    pass  # Connection lost; handled in main loop
+
+        pool = multiprocessing.Pool(self._threads, _init_worker)
+        try:
+            with lock:
+                conn.send(("hello", pypeline.__version__, self._threads))
+
+            while True:
+                message = conn.recv()
+                if message[0] == "run":
+                    _, key, task = message
+                    pool.apply_async(_call_run, (key, task),
+                                     callback=_callback)
+                elif message[0] == "close":
+                    pool.close()
+                    pool.join()
+                    break
+                elif message[0] == "terminate":
+                    # Running commands are killed by the pool processes
+                    # (see pypeline.atomiccmd.command._cleanup_children)
+                    self._logger.warning("Pipeline terminated, terminating "
+                                         "running tasks")
+                    break
+                else:
+                    self._logger.error("Unknown message %r", message[0])
+        except (EOFError, IOError), error:
+            self._logger.warning("Connection to pipeline lost, terminating "
+                                 "running tasks: %s", error)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _init_worker():
+    """Ensures that KeyboardInterrupts only occur in the main process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call_run(key, task):
+    """Runs a task in a worker process; returns a tuple of (key, error, stats),
+    where error is the (picklable) exception raised by the node, if any."""
+    try:
+        return key, None, run_task(task)
+    except Exception, error:
+        return key, picklable_error(error), None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="paleomix worker")
+    parser.add_argument("--host", default="",
+                        help="Address on which to listen for connections; by "
+                             "default all interfaces are used.")
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int,
+                        help="Port on which to listen for connections "
+                             "[%(default)s].")
+    parser.add_argument("--threads", default=multiprocessing.cpu_count(),
+                        type=int,
+                        help="Max number of threads to use [%(default)s].")
+    parser.add_argument("--secret", required=True,
+                        help="File containing the secret shared by workers "
+                             "and pipelines, used to authenticate "
+                             "connections.")
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Main function for 'paleomix worker'."""
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        authkey = read_secret(args.secret)
+    except ExecutorError, error:
+        sys.stderr.write("ERROR: %s\n" % (error,))
+        return 1
+
+    server = WorkerServer((args.host, args.port), authkey, args.threads)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Live metrics for a running pipeline (see --metrics-address).
+
+While the pipeline is running, a small HTTP server is run in a background
+thread, which responds to GET requests with a JSON object describing the
+current state of the pipeline:
+
+  {"uptime": 3600.0,               -- Seconds since the pipeline was started
+   "states": {"done": 10, ...},    -- Number of (non-Meta) nodes per state
+   "threads": 4,                   -- Threads used by running nodes
+   "queue_depth": 12,              -- Number of nodes waiting to be started
+   "finished": 10,                 -- Nodes finished since the start
+   "failed": 0,                    -- Nodes failed since the start
+   "throughput": 0.5,              -- Nodes finished per minute, during the
+                                      last 'THROUGHPUT_WINDOW' seconds
+   "running": [{"node": "...",     -- Description of running node
+                "threads": 1,      -- Threads used by the node
+                "elapsed": 120.5,  -- Seconds since the node was started
+                "pid": 1234,       -- PID of the (worker) process running it
+                "processes": 2,    -- Processes in the process tree
+                "cpu_time": 240.1, -- CPU time used by the process tree
+                "rss": 123456},    -- Resident memory (bytes) of the tree
+               ...]}
+
+The server listens on a TCP port ([HOST:]PORT), or on a Unix socket if the
+address contains a '/', e.g. 'curl --unix-socket PATH http://localhost/'.
+CPU time and memory usage are only available for nodes run by processes on
+the local host (see BaseExecutor.process_ids), and are read from /proc for
+each process in the tree of processes started by the worker; if /proc is not
+available, these fields are None.
+"""
+import os
+import json
+import time
+import errno
+import socket
+import logging
+import optparse
+import resource
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+from pypeline.node import MetaNode
+from pypeline.nodegraph import NodeGraph
+
+
+# Window (in seconds) over which throughput is calculated
+THROUGHPUT_WINDOW = 600
+
+_STATE_NAMES = {NodeGraph.DONE: "done",
+                NodeGraph.RUNNING: "running",
+                NodeGraph.RUNABLE: "runable",
+                NodeGraph.QUEUED: "queued",
+                NodeGraph.OUTDATED: "outdated",
+                NodeGraph.ERROR: "failed"}
+
+
+def add_optiongroup(parser):
+    """Adds an option-group to an OptionParser object, with options
+    pertaining to reporting metrics for running pipelines."""
+    group = optparse.OptionGroup(parser, "Metrics")
+    group.add_option("--metrics-address", default=None,
+                     metavar="[HOST:]PORT|PATH",
+                     help="Serve live metrics for the running pipeline as "
+                          "JSON, using HTTP on the specified TCP port, or "
+                          "on a Unix socket if a path is given. By default "
+                          "only connections from localhost are accepted.")
+    parser.add_option_group(group)
+
+
+def parse_address(value):
+    """Parses a '[host:]port' string, returning a tuple of (host, port), or
+    returns the value as is if it is a path (contains a '/')."""
+    if "/" in value:
+        return value
+
+    host, _, port = value.rpartition(":")
+    if not port.isdigit():
+        raise ValueError("Invalid metrics address %r" % (value,))
+    return (host or "localhost", int(port))
+
+
+class PipelineMetrics(object):
+    """NodeGraph observer (see NodeGraph.add_state_observer), collecting the
+    metrics described in the module documentation. 'runable' is the queue of
+    runable nodes (see pypeline.scheduler.RunableQueue), and 'process_ids'
+    is a function returning a dictionary of running node -> PID of the local
+    process running the node, if any. Metrics may be read from any thread
+    using 'snapshot'."""
+
+    def __init__(self, runable=None, process_ids=None):
+        self._lock = threading.Lock()
+        self._runable = runable
+        self._process_ids = process_ids
+        self._start_time = time.time()
+        self._states = [0] * NodeGraph.NUMBER_OF_STATES
+        # Dictionary of running node -> start time
+        self._running = {}
+        self._finished = 0
+        self._failed = 0
+        # Times at which nodes finished, within the throughput window
+        self._finish_times = collections.deque()
+
+    def refresh(self, nodegraph):
+        """See NodeGraph.add_state_observer."""
+        with self._lock:
+            self._states = [0] * NodeGraph.NUMBER_OF_STATES
+            self._running = {}
+            self._count_nodes(nodegraph, nodegraph.iterflat())
+
+    def nodes_added(self, nodegraph, nodes):
+        """See NodeGraph.add_state_observer."""
+        with self._lock:
+            self._count_nodes(nodegraph, nodes)
+
+    def state_changed(self, node, old_state, new_state, _is_primary):
+        """See NodeGraph.add_state_observer."""
+        if isinstance(node, MetaNode):
+            return
+
+        with self._lock:
+            self._states[old_state] -= 1
+            self._states[new_state] += 1
+
+            if new_state == NodeGraph.RUNNING:
+                self._running[node] = time.time()
+            elif old_state == NodeGraph.RUNNING:
+                self._running.pop(node, None)
+                if new_state == NodeGraph.DONE:
+                    self._finished += 1
+                    self._finish_times.append(time.time())
+                elif new_state == NodeGraph.ERROR:
+                    self._failed += 1
+
+    def snapshot(self):
+        """Returns a dictionary of metrics; see module documentation."""
+        current_time = time.time()
+        with self._lock:
+            states = list(self._states)
+            running = dict(self._running)
+            finished, failed = self._finished, self._failed
+
+            finish_times = self._finish_times
+            while finish_times and \
+                    finish_times[0] < current_time - THROUGHPUT_WINDOW:
+                finish_times.popleft()
+            num_recent = len(finish_times)
+
+        process_ids = {}
+        if self._process_ids is not None:
+            process_ids = self._process_ids()
+        process_table = _read_process_table() if process_ids else {}
+
+        running_nodes = []
+        for (node, start_time) in sorted(running.iteritems(),
+                                         key=lambda item: item[1]):
+            pid = process_ids.get(node)
+            usage = _process_tree_usage(process_table, pid)
+            running_nodes.append({"node": str(node),
+                                  "threads": node.threads,
+                                  "elapsed": current_time - start_time,
+                                  "pid": pid,
+                                  "processes": usage[0],
+                                  "cpu_time": usage[1],
+                                  "rss": usage[2]})
+
+        window = min(THROUGHPUT_WINDOW, current_time - self._start_time)
+        return {"uptime": current_time - self._start_time,
+                "states": dict((name, states[state])
+                               for (state, name) in _STATE_NAMES.iteritems()),
+                "threads": sum(node.threads for node in running),
+                "queue_depth": len(self._runable or ()),
+                "finished": finished,
+                "failed": failed,
+                "throughput": (num_recent * 60.0 / window) if window else 0.0,
+                "running": running_nodes}
+
+    def _count_nodes(self, nodegraph, nodes):
+        current_time = time.time()
+        for node in nodes:
+            if not isinstance(node, MetaNode):
+                state = nodegraph.get_node_state(node)
+                self._states[state] += 1
+                if state == NodeGraph.RUNNING:
+                    self._running[node] = current_time
+
+
+class MetricsServer(object):
+    """HTTP server reporting the metrics collected by a PipelineMetrics
+    object as JSON, for every GET request; the server is run in a daemon
+    thread until 'close' is called. Raises socket.error if the server could
+    not be started."""
+
+    def __init__(self, address, metrics):
+        self._logger = logging.getLogger(__name__)
+        self._address = parse_address(address)
+        if isinstance(self._address, tuple):
+            self._server = _TCPServer(self._address, _RequestHandler)
+        else:
+            _remove_socket(self._address)
+            self._server = _UnixServer(self._address, _RequestHandler)
+        self._server.metrics = metrics
+
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={"poll_interval": 0.5})
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def address(self):
+        """The address of the server; for TCP servers, this includes the
+        actual port used, if port 0 was requested."""
+        return self._server.server_address
+
+    def close(self):
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+        if not isinstance(self._address, tuple):
+            _remove_socket(self._address)
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.metrics.snapshot())
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return str(self.client_address or "localhost")
+
+    def log_message(self, fmt, *args):
+        logging.getLogger(__name__).debug(fmt, *args)
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def _remove_socket(filename):
+    try:
+        os.remove(filename)
+    except OSError, error:
+        if error.errno != errno.ENOENT:
+            raise socket.error(error)
+
+
+def _read_process_table():
+    """Returns a dictionary of PID -> (parent PID, CPU time, RSS) for every
+    process, read from /proc; returns an empty dictionary if /proc is not
+    available. CPU time includes the CPU time of terminated children."""
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return {}
+
+    clock_ticks = float(os.sysconf("SC_CLK_TCK"))
+    page_size = resource.getpagesize()
+
+    table = {}
+    for pid in pids:
+        try:
+            with open("/proc/%i/stat" % (pid,)) as handle:
+                stat = handle.read()
+        except IOError:
+            continue  # Process terminated
+
+        # The command name (field 2) is in parentheses, and may contain spaces
+        fields = stat[stat.rindex(")") + 2:].split()
+        cpu_time = sum(int(value) for value in fields[11:15]) / clock_ticks
+        table[pid] = (int(fields[1]), cpu_time, int(fields[21]) * page_size)
+    return table
+
+
+def _process_tree_usage(table, pid):
+    """Returns a tuple of (processes, CPU time, RSS) for the tree of
+    processes rooted at 'pid', or (None, None, None) if 'pid' is not found
+    in the process table (see '_read_process_table')."""
+    if pid not in table:
+        return (None, None, None)
+
+    children = collections.defaultdict(list)
+    for (child_pid, (parent_pid, _, _)) in table.iteritems():
+        children[parent_pid].append(child_pid)
+
+    processes, cpu_time, rss = 0, 0.0, 0
+    queue = [pid]
+    while queue:
+        current_pid = queue.pop()
+        _, current_cpu_time, current_rss = table[current_pid]
+        processes += 1
+        cpu_time += current_cpu_time
+        rss += current_rss
+        queue.extend(children.get(current_pid, ()))
+
+    return (processes, cpu_time, rss)
@@ -26,6 +26,7 @@ import types
 import traceback
 import collections
 
+import pypeline.checksums as checksums
 import pypeline.common.fileutils as fileutils
 from pypeline.common.utilities import \
      safe_coerce_to_frozenset
@@ -55,7 +56,12 @@ class Node(object):
     def __init__(self, description = None, threads = 1,
                  input_files = (), output_files = (),
                  executables = (), auxiliary_files = (),
-                 requirements = (), subnodes = (), dependencies = ()):
+                 requirements = (), subnodes = (), dependencies = (),
+                 memory = 0):
+        """'threads' is the number of threads used by the node, and 'memory'
+        the (estimated) peak memory usage of the node in MB; both are used
+        when scheduling nodes for running. A 'memory' of 0 signifies that
+        the memory usage is unknown or negligible."""
 
         if not isinstance(description, _DESC_TYPES):
             raise TypeError("'description' must be None or a string, not %r" \
@@ -69,6 +75,7 @@ class Node(object):
         self.requirements    = self._validate_requirements(requirements)
 
         self.threads         = self._validate_nthreads(threads)
+        self.memory          = self._validate_memory(memory)
         self.subnodes        = self._collect_nodes(subnodes, "Subnode")
         self.dependencies    = self._collect_nodes(dependencies, "Dependency")
 
@@ -89,15 +96,26 @@ class Node(object):
 
         Any non-NodeError exception raised in this function is wrapped in a
         NodeUnhandledException, which includes a full backtrace. This is needed
-        to allow showing these in the main process."""
+        to allow showing these in the main process.
+
+        If 'config' has a true property .content_checksums, a manifest of the
+        checksums of input / output files is written once the node is done
+        (see pypeline.checksums)."""
+        use_checksums = getattr(config, "content_checksums", False)
 
         try:
             temp = None
             temp = self._create_temp_dir(config)
 
+            if use_checksums:
+                # Recorded checksums are re-used for unchanged files
+                known_checksums = checksums.known_checksums(self)
+                checksums.remove_manifest(self)
             self._setup(config, temp)
             self._run(config, temp)
             self._teardown(config, temp)
+            if use_checksums:
+                checksums.write_manifest(self, known_checksums)
             self._remove_temp_dir(temp)
         except NodeError, error:
             self._write_error_log(temp, error)
@@ -109,6 +127,42 @@ class Node(object):
                                          % (repr(temp), traceback.format_exc()))
 
 
+    @property
+    def resource_usage(self):
+        """Resources used by the commands run by the node, once the node has
+        been run (see AtomicCmd.resource_usage); None if unknown, or if the
+        node does not run any commands."""
+        return None
+
+
+    @property
+    def thread_range(self):
+        """Tuple of the minimum and maximum number of threads with which the
+        node may be run (see 'set_threads'), where the maximum is None if the
+        node may use any number of threads. By default, nodes are run using
+        a fixed number of threads."""
+        return (self.threads, self.threads)
+
+
+    def set_threads(self, threads):
+        """Changes the number of threads used by the node, which must be in
+        the range given by 'thread_range'. Nodes supporting a range of values
+        must implement '_set_threads', which is called to update the
+        command(s) run by the node."""
+        min_threads, max_threads = self.thread_range
+        if threads < min_threads or (max_threads is not None
+                                     and threads > max_threads):
+            raise NodeError("Node %s cannot be run using %i thread(s)"
+                            % (self, threads))
+        elif threads != self.threads:
+            self._set_threads(threads)
+            self.threads = threads
+
+
+    def _set_threads(self, threads):
+        raise NotImplementedError()
+
+
     def _create_temp_dir(self, config):
         """Called by 'run' in order to create a temporary folder.
 
@@ -153,8 +207,13 @@ class Node(object):
         """Called by pickle/cPickle to determine what to pickle; this is
         overridden to avoid pickling of requirements, dependencies and
         subnodes, which would otherwise greatly inflate the amount of
-        information that needs to be pickled."""
+        information that needs to be pickled. The manifests of dependencies
+        producing input files are recorded in place of these, for use when
+        writing checksums (see pypeline.checksums.known_checksums)."""
         obj_dict = self.__dict__.copy()
+        if self.dependencies is not None:
+            obj_dict["producer_manifests"] \
+                = checksums.producer_manifests(self)
         obj_dict["requirements"] = None
         obj_dict["dependencies"] = None
         obj_dict["subnodes"]     = None
@@ -170,6 +229,7 @@ class Node(object):
                    "CWD              = %s" % (os.getcwd(),),
                    "Node             = %s" % (str(self),),
                    "Threads          = %i" % (self.threads,),
+                   "Memory (MB)      = %i" % (self.memory,),
                    "Input files      = %s" % (prefix.join(sorted(self.input_files)),),
                    "Output files     = %s" % (prefix.join(sorted(self.output_files)),),
                    "Auxiliary files  = %s" % (prefix.join(sorted(self.auxiliary_files)),),
@@ -233,12 +293,25 @@ class Node(object):
             raise ValueError("'threads' must be a positive integer, not %i" % (threads,))
         return int(threads)
 
+    @classmethod
+    def _validate_memory(cls, memory):
+        if not isinstance(memory, (types.IntType, types.LongType)):
+            raise TypeError("'memory' must be a non-negative integer, not %s" % (type(memory),))
+        elif memory < 0:
+            raise ValueError("'memory' must be a non-negative integer, not %i" % (memory,))
+        return int(memory)
+
 
 
 
 class CommandNode(Node):
     def __init__(self, command, description = None, threads = 1,
-                 subnodes = (), dependencies = ()):
+                 subnodes = (), dependencies = (), memory = None):
+        """If 'memory' is not set, the memory usage of the node is that
+        estimated by the command (see AtomicCmd), if any."""
+        if memory is None:
+            memory = getattr(command, "memory", 0)
+
         Node.__init__(self,
                       description  = description,
                       input_files  = command.input_files,
@@ -247,11 +320,17 @@ class CommandNode(Node):
                       executables  = command.executables,
                       requirements = command.requirements,
                       threads      = threads,
+                      memory       = memory,
                       subnodes     = subnodes,
                       dependencies = dependencies)
 
         self._command = command
 
+    @property
+    def resource_usage(self):
+        """See Node.resource_usage."""
+        return self._command.resource_usage
+
     def _run(self, _config, temp):
         """Runs the command object provided in the constructor, and waits for it to
         terminate. If any errors during the running of the command, this function
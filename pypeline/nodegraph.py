@@ -21,9 +21,14 @@
 # SOFTWARE.
 #
 import os
+import array
+import errno
+import heapq
 import logging
 import collections
+import multiprocessing.pool
 
+import pypeline.profiling
 import pypeline.common.versions as versions
 
 from pypeline.node import MetaNode
@@ -36,6 +41,12 @@ from pypeline.common.utilities import \
 
 # Max number of error messages of each type
 _MAX_ERROR_MESSAGES = 10
+# Number of threads used to check the state of files in parallel
+_PREFETCH_THREADS = 16
+# Folders are listed, rather than checking for every file, if at least this
+# many files are requested from a single folder; this avoids having to check
+# the state of files that do not exist.
+_PREFETCH_LISTDIR_MIN = 4
 
 
 class FileStatusCache(object):
@@ -44,10 +55,36 @@ class FileStatusCache(object):
     operation (e.g. refreshing all states / manually setting the state of a
     node) to avoid relying on the filesystem staying consistant for long
     periods of time.
+
+    The states of many files may be determined up-front using 'prefetch',
+    which checks files in different folders in parallel; this greatly reduces
+    the time taken on (network) file-systems with a high latency.
     """
 
-    def __init__(self):
+    def __init__(self, threads=_PREFETCH_THREADS):
         self._stat_cache = {}
+        self._threads = threads
+
+    def prefetch(self, fpaths):
+        """Determines the state of the listed files, grouping these by folder.
+        Folders are processed in parallel, and folders from which a number of
+        files are requested are listed to avoid checking missing files."""
+        by_dirpath = collections.defaultdict(list)
+        for fpath in fpaths:
+            if fpath not in self._stat_cache:
+                by_dirpath[os.path.dirname(fpath)].append(fpath)
+
+        if len(by_dirpath) > 1 and self._threads > 1:
+            pool = multiprocessing.pool.ThreadPool(self._threads)
+            try:
+                results = pool.map(self._prefetch_dir, by_dirpath.iteritems())
+            finally:
+                pool.terminate()
+        else:
+            results = map(self._prefetch_dir, by_dirpath.iteritems())
+
+        for result in results:
+            self._stat_cache.update(result)
 
     def files_exist(self, fpaths):
         """Returns true if all paths listed in fpaths exist."""
@@ -68,14 +105,42 @@ class FileStatusCache(object):
     def _get_state(self, fpath):
         """Returns the mtime of a path, or None if the path does not exist."""
         if fpath not in self._stat_cache:
+            self._stat_cache[fpath] = self._get_mtime(fpath)
+        return self._stat_cache[fpath]
+
+    def _prefetch_dir(self, item):
+        """Returns a dictionary of the states of files in a folder, given a
+        tuple of (dirpath, fpaths); called by 'prefetch', possibly from a
+        different thread."""
+        dirpath, fpaths = item
+        filenames = None
+        if len(fpaths) >= _PREFETCH_LISTDIR_MIN:
             try:
-                mtime = os.path.getmtime(fpath)
+                filenames = frozenset(os.listdir(dirpath or "."))
             except OSError, error:
-                if error.errno != 2:
-                    raise
-                mtime = None
-            self._stat_cache[fpath] = mtime
-        return self._stat_cache[fpath]
+                if error.errno == errno.ENOENT:
+                    return dict.fromkeys(fpaths)
+                # Fall back to checking individual files
+
+        states = {}
+        for fpath in fpaths:
+            basename = os.path.basename(fpath)
+            if filenames is not None and basename \
+                    and basename not in filenames:
+                states[fpath] = None
+            else:
+                states[fpath] = self._get_mtime(fpath)
+        return states
+
+    @classmethod
+    def _get_mtime(cls, fpath):
+        """Returns the mtime of a path, or None if the path does not exist."""
+        try:
+            return os.path.getmtime(fpath)
+        except OSError, error:
+            if error.errno != errno.ENOENT:
+                raise
+            return None
 
 
 class NodeGraphError(RuntimeError):
@@ -90,87 +155,215 @@ class NodeGraph:
     def __init__(self, nodes, cache_factory=FileStatusCache):
         self._cache_factory = cache_factory
         self._state_observers = []
-        self._states = {}
 
         nodes = safe_coerce_to_frozenset(nodes)
 
         self._logger = logging.getLogger(__name__)
-        self._reverse_dependencies = collections.defaultdict(set)
-        self._collect_reverse_dependencies(nodes, self._reverse_dependencies, set())
-        self._intersections = {}
-        self._top_nodes = [node for (node, rev_deps) in self._reverse_dependencies.iteritems() if not rev_deps]
+        with pypeline.profiling.phase("Sorting nodes"):
+            # Nodes are identified by their index in this list, in which every
+            # node is preceded by its dependencies and subnodes.
+            self._nodes = []
+            self._node_ids = {}
+            # IDs of nodes depending on / having as subnode a given node
+            self._dependants = _IndexTable()
+            self._supernodes = _IndexTable()
+            self._top_nodes = []
+            self._extend_graph(self._sort_nodes(nodes))
+        # States of nodes, indexed by node ID
+        self._states = bytearray(len(self._nodes))
+        # Number of dependencies / subnodes in each state, for each node; the
+        # count for state S of node N is found at index N * NUMBER_OF_STATES + S
+        self._dependency_counts = None
+        self._subnode_counts = None
+        # Number of DONE nodes left in the graph by the last call to 'prune'
+        self._pruned_done = 0
 
         self._logger.info("  - Checking file dependencies ...")
-        self._check_file_dependencies(self._reverse_dependencies)
+        with pypeline.profiling.phase("Checking file dependencies"):
+            self._check_file_dependencies(self._nodes)
         self._logger.info("  - Checking for required executables ...")
-        self._check_required_executables(self._reverse_dependencies)
+        with pypeline.profiling.phase("Checking for required executables"):
+            self._check_required_executables(self._nodes)
         self._logger.info("  - Checking version requirements ...")
-        self._check_version_requirements(self._reverse_dependencies)
+        with pypeline.profiling.phase("Checking version requirements"):
+            self._check_version_requirements(self._nodes)
         self._logger.info("  - Determining states ...")
-        self.refresh_states()
+        with pypeline.profiling.phase("Determining states"):
+            self.refresh_states()
         self._logger.info("  - Ready ...\n")
 
     def get_node_state(self, node):
-        return self._states[node]
+        return self._states[self._node_ids[node]]
 
     def set_node_state(self, node, state):
         if state not in (NodeGraph.RUNNING, NodeGraph.ERROR, NodeGraph.DONE):
             raise ValueError("Invalid state: %r" % (state,))
-        old_state = self._states[node]
+        node_id = self._node_ids[node]
+        old_state = self._states[node_id]
         if state == old_state:
             return
 
-        self._states[node] = state
+        self._set_state(node_id, state)
         self._notify_state_observers(node, old_state, state, True)
 
-        intersections = self._calculate_intersections(node)
-
-        # Not all nodes may need to be updated, but we still need to
-        # traverse the "graph" (using the intersection counts) in order
-        # to ensure that all nodes that need to be updated are updated.
-        requires_update = dict.fromkeys(intersections, False)
-        for dependency in self._reverse_dependencies[node]:
-            requires_update[dependency] = True
+        # Nodes are updated in topological order (lowest ID first), which
+        # ensures that the states of all dependencies / subnodes of a node
+        # are final before the node itself is updated. Nodes that depend on
+        # a node are only updated if the state of that node changed.
+        queue = []
+        queued = set()
+        self._queue_dependants(node_id, queue, queued)
 
         cache = self._cache_factory()
-        while any(requires_update.itervalues()):
-            for (node, count) in intersections.items():
-                if not count:
-                    has_changed = False
-                    if requires_update[node]:
-                        old_state = self._states.pop(node)
-                        new_state = self._update_node_state(node, cache)
-                        if new_state != old_state:
-                            self._notify_state_observers(node, old_state,
-                                                         new_state, False)
-                            has_changed = True
-
-                    for dependency in self._reverse_dependencies[node]:
-                        intersections[dependency] -= 1
-                        requires_update[dependency] |= has_changed
-
-                    intersections.pop(node)
-                    requires_update.pop(node)
-
+        while queue:
+            node_id = heapq.heappop(queue)
+            old_state = self._states[node_id]
+            new_state = self._calculate_node_state(node_id, cache)
+            if new_state != old_state:
+                self._set_state(node_id, new_state)
+                self._notify_state_observers(self._nodes[node_id], old_state,
+                                             new_state, False)
+                self._queue_dependants(node_id, queue, queued)
+
+    def __contains__(self, node):
+        return node in self._node_ids
 
     def __iter__(self):
         """Returns a graph of nodes."""
         return iter(self._top_nodes)
 
     def iterflat(self):
-        return iter(self._reverse_dependencies)
+        return iter(self._nodes)
 
     def refresh_states(self):
-        states = {}
+        old_states = self._states
+        fixed_states = (self.ERROR, self.RUNNING)
         cache = self._cache_factory()
-        for (node, state) in self._states.iteritems():
-            if state in (self.ERROR, self.RUNNING):
-                states[node] = state
-        self._states = states
-        for node in self._reverse_dependencies:
-            self._update_node_state(node, cache)
+
+        fpaths = set()
+        for (node_id, node) in enumerate(self._nodes):
+            if old_states[node_id] not in fixed_states:
+                fpaths.update(node.input_files)
+                fpaths.update(node.output_files)
+        cache.prefetch(fpaths)
+
+        counts_size = len(self._nodes) * NodeGraph.NUMBER_OF_STATES
+        self._dependency_counts = array.array("i", (0,)) * counts_size
+        self._subnode_counts = array.array("i", (0,)) * counts_size
+        self._states = bytearray(len(self._nodes))
+        for node_id in xrange(len(self._nodes)):
+            state = old_states[node_id]
+            if state not in fixed_states:
+                state = self._calculate_node_state(node_id, cache)
+
+            # Nodes are processed in topological order, so the counts of
+            # dependants are complete by the time these are processed.
+            self._states[node_id] = state
+            self._update_counts(node_id, None, state)
+
         self._refresh_state_observers()
 
+    def add_nodes(self, nodes):
+        """Adds nodes, and any of their dependencies / subnodes not already
+        in the graph, to the graph, and returns a list of the new nodes. The
+        new nodes are checked as when building a graph, except that clashing
+        output files are only detected among nodes added together. The states
+        of nodes already in the graph are not changed, since these cannot
+        depend on the new nodes. Raises NodeGraphError if the checks fail, in
+        which case the graph is left unchanged."""
+        nodes = self._sort_nodes(safe_coerce_to_frozenset(nodes))
+        new_nodes = [node for node in nodes if node not in self._node_ids]
+        if not new_nodes:
+            return []
+
+        self._check_file_dependencies(nodes)
+        self._check_required_executables(new_nodes)
+        self._check_version_requirements(new_nodes)
+
+        first_id = len(self._nodes)
+        self._extend_graph(new_nodes)
+        self._states.extend(bytearray(len(new_nodes)))
+        counts_size = len(new_nodes) * NodeGraph.NUMBER_OF_STATES
+        self._dependency_counts.extend(array.array("i", (0,)) * counts_size)
+        self._subnode_counts.extend(array.array("i", (0,)) * counts_size)
+
+        cache = self._cache_factory()
+        fpaths = set()
+        for node in new_nodes:
+            fpaths.update(node.input_files)
+            fpaths.update(node.output_files)
+        cache.prefetch(fpaths)
+
+        tables = (("dependencies", self._dependency_counts),
+                  ("subnodes", self._subnode_counts))
+        for node_id in xrange(first_id, len(self._nodes)):
+            # Counts for new nodes are updated as these are processed below,
+            # but nodes already in the graph must be counted here
+            node = self._nodes[node_id]
+            offset = node_id * NodeGraph.NUMBER_OF_STATES
+            for (attr, counts) in tables:
+                for child in getattr(node, attr):
+                    child_id = self._node_ids[child]
+                    if child_id < first_id:
+                        counts[offset + self._states[child_id]] += 1
+
+            state = self._calculate_node_state(node_id, cache)
+            self._states[node_id] = state
+            self._update_counts(node_id, None, state)
+
+        for observer in self._state_observers:
+            observer.nodes_added(self, new_nodes)
+
+        return new_nodes
+
+    def prune(self, min_fraction=0.0):
+        """Removes nodes that are DONE, and which only DONE nodes depend upon
+        (directly or indirectly), from the graph, allowing these to be freed;
+        returns the number of nodes removed. Observers are not notified, and
+        removed nodes may be re-added using 'add_nodes'.
+
+        Since the graph is rebuilt when pruning, nothing is done unless the
+        number of DONE nodes has grown by at least 'min_fraction' of the size
+        of the graph since the last call, in order to amortize the cost of
+        calling this function frequently."""
+        done = self._states.count(chr(NodeGraph.DONE))
+        if min_fraction > 0 \
+                and done - self._pruned_done < min_fraction * len(self._nodes):
+            return 0
+
+        removed = set()
+        # Dependants always follow a node, so these are processed first
+        for node_id in xrange(len(self._nodes) - 1, -1, -1):
+            if self._states[node_id] == NodeGraph.DONE:
+                for table in (self._dependants, self._supernodes):
+                    if not removed.issuperset(table[node_id]):
+                        break
+                else:
+                    removed.add(node_id)
+
+        if removed:
+            kept = [node_id for node_id in xrange(len(self._nodes))
+                    if node_id not in removed]
+            nodes, states = self._nodes, self._states
+
+            self._nodes = []
+            self._node_ids = {}
+            self._dependants = _IndexTable()
+            self._supernodes = _IndexTable()
+            self._top_nodes = []
+            self._extend_graph([nodes[node_id] for node_id in kept])
+
+            counts_size = len(kept) * NodeGraph.NUMBER_OF_STATES
+            self._dependency_counts = array.array("i", (0,)) * counts_size
+            self._subnode_counts = array.array("i", (0,)) * counts_size
+            self._states = bytearray(states[node_id] for node_id in kept)
+            for node_id in xrange(len(kept)):
+                self._update_counts(node_id, None, self._states[node_id])
+
+        self._pruned_done = done - len(removed)
+
+        return len(removed)
+
     def add_state_observer(self, observer):
         """Add an observer of changes to the node-graph. The observer
         is expected to have the following functions:
@@ -186,7 +379,12 @@ class NodeGraph:
           and false for nodes the state of which changed as a consequence
           of the change to the node marked 'is_primary'. This includes
           ERROR propegating, MetaNodes being DONE when all their subnodes
-          are DONE and more."""
+          are DONE and more.
+
+        nodes_added(nodegraph, nodes):
+          Called when nodes have been added to the graph using 'add_nodes';
+          'nodes' is a list of the new nodes, in which every node is preceded
+          by its dependencies and subnodes."""
         self._state_observers.append(observer)
         observer.refresh(self)
 
@@ -198,36 +396,21 @@ class NodeGraph:
         for observer in self._state_observers:
             observer.refresh(self)
 
-    def _calculate_intersections(self, for_node):
-        def count_nodes(node, counts):
-            for node in self._reverse_dependencies[node]:
-                if node in counts:
-                    counts[node] += 1
-                else:
-                    counts[node] = 1
-                    count_nodes(node, counts)
-            return counts
-
-        if for_node not in self._intersections:
-            counts = count_nodes(for_node, {})
-            for dependency in self._reverse_dependencies[for_node]:
-                counts[dependency] -= 1
-            self._intersections[for_node] = counts
-
-        return dict(self._intersections[for_node])
-
-    def _update_node_state(self, node, cache):
-        if node in self._states:
-            return self._states[node]
+    def _calculate_node_state(self, node_id, cache):
+        """Returns the state of a node, based on the states of its subnodes
+        and dependencies, which are assumed to be final at this point."""
+        node = self._nodes[node_id]
+        offset = node_id * NodeGraph.NUMBER_OF_STATES
+        dependency_counts = self._dependency_counts
+        subnode_counts = self._subnode_counts
 
-        # Update sub-nodes before checking for fixed states
         dependency_states = set((NodeGraph.DONE,))
-        for dependency in node.dependencies:
-            dependency_states.add(self._update_node_state(dependency, cache))
-
         subnode_states = set()
-        for subnode in node.subnodes:
-            subnode_states.add(self._update_node_state(subnode, cache))
+        for state in xrange(NodeGraph.NUMBER_OF_STATES):
+            if dependency_counts[offset + state]:
+                dependency_states.add(state)
+            if subnode_counts[offset + state]:
+                subnode_states.add(state)
 
         state = max(subnode_states | dependency_states)
         if isinstance(node, MetaNode):
@@ -265,10 +448,67 @@ class NodeGraph:
                 state = NodeGraph.OUTDATED
             else:
                 state = NodeGraph.QUEUED
-        self._states[node] = state
 
         return state
 
+    def _set_state(self, node_id, state):
+        """Sets the state of a node, updating the counts of dependants."""
+        self._update_counts(node_id, self._states[node_id], state)
+        self._states[node_id] = state
+
+    def _update_counts(self, node_id, old_state, new_state):
+        """Updates the counts of states for nodes that have the specified node
+        as a dependency or a subnode; if 'old_state' is None, the node is
+        assumed to not have been counted previously."""
+        for (table, counts) in ((self._dependants, self._dependency_counts),
+                                (self._supernodes, self._subnode_counts)):
+            for dependant_id in table[node_id]:
+                offset = dependant_id * NodeGraph.NUMBER_OF_STATES
+                if old_state is not None:
+                    counts[offset + old_state] -= 1
+                counts[offset + new_state] += 1
+
+    def _queue_dependants(self, node_id, queue, queued):
+        """Adds nodes that have the specified node as a dependency or a
+        subnode to a heap of node IDs, if not already queued."""
+        for table in (self._dependants, self._supernodes):
+            for dependant_id in table[node_id]:
+                if dependant_id not in queued:
+                    queued.add(dependant_id)
+                    heapq.heappush(queue, dependant_id)
+
+    def _extend_graph(self, nodes):
+        """Appends a list of nodes to the graph, updating the tables of
+        dependants / supernodes; every node must be preceded by its
+        dependencies and subnodes, either in 'nodes' or in the graph."""
+        first_id = len(self._nodes)
+        for node in nodes:
+            self._node_ids[node] = len(self._nodes)
+            self._nodes.append(node)
+
+        gained_dependants = set()
+        for (attr, table) in (("dependencies", self._dependants),
+                              ("subnodes", self._supernodes)):
+            rows = [[] for _ in nodes]
+            for (node_id, node) in enumerate(nodes, first_id):
+                for child in getattr(node, attr):
+                    child_id = self._node_ids[child]
+                    if child_id >= first_id:
+                        rows[child_id - first_id].append(node_id)
+                    else:
+                        table.add(child_id, node_id)
+                        gained_dependants.add(child)
+
+            for row in rows:
+                table.append(row)
+
+        if gained_dependants:
+            self._top_nodes = [node for node in self._top_nodes
+                               if node not in gained_dependants]
+        for (node_id, node) in enumerate(nodes, first_id):
+            if not (self._dependants[node_id] or self._supernodes[node_id]):
+                self._top_nodes.append(node)
+
     @classmethod
     def _is_done(cls, node, cache):
         """Returns true if the node itself is done; this only implies that the
@@ -312,6 +552,7 @@ class NodeGraph:
         exec_requirements = list(sorted(exec_requirements, key=_key_func))
 
         try:
+            versions.prefetch(exec_requirements)
             for requirement in exec_requirements:
                 requirement()
         except versions.VersionRequirementError, error:
@@ -378,14 +619,21 @@ class NodeGraph:
 
     @classmethod
     def _check_input_dependencies(cls, input_files, output_files, nodes):
-        dependencies = cls._collect_dependencies(nodes, {})
+        # Nodes creating (dynamic) input files required by each node
+        required = collections.defaultdict(set)
+        for (filename, consumers) in input_files.iteritems():
+            producers = output_files.get(filename)
+            if producers:
+                for consumer in consumers:
+                    required[consumer].update(producers)
+        reachable = cls._find_reachable_nodes(nodes, required)
 
         for (filename, nodes) in sorted(input_files.items(), key = lambda v: v[0]):
             if (filename in output_files):
                 producers = output_files[filename]
                 bad_nodes = set()
                 for consumer in nodes:
-                    if not (producers & dependencies[consumer]):
+                    if not (producers & reachable[consumer]):
                         bad_nodes.add(consumer)
 
                 if bad_nodes:
@@ -402,38 +650,117 @@ class NodeGraph:
 
 
     @classmethod
-    def _collect_dependencies(cls, nodes, dependencies):
+    def _find_reachable_nodes(cls, nodes, required):
+        """Takes a dictionary of node -> set of nodes, and returns a dictionary
+        of node -> the subset of these nodes that are (direct or indirect)
+        dependencies / subnodes of the node. 'nodes' is expected to be in
+        topological order (see _sort_nodes).
+
+        Rather than collecting the full set of dependencies for every node,
+        which requires quadratic time and memory, a breadth-first search is
+        carried out for each node, ending once every required node has been
+        found. Since dependencies precede a node in topological order, nodes
+        preceding every required node need not be searched, and nodes found
+        by earlier searches (from dependencies) need not be searched for.
+
+        The worst case is O(N * E), since each search may visit every edge
+        between a node and the earliest node that it requires. In practice,
+        nodes require files created by their (direct) dependencies, or files
+        also required by their dependencies, in which case searches end after
+        a single step; a chain of N nodes, each reading the output of a node
+        D steps earlier, takes O(N * D) time, as measured by the script
+        'misc/benchmark_nodegraph.py'."""
+        order = dict((node, index) for (index, node) in enumerate(nodes))
+
+        reachable = {}
         for node in nodes:
-            if node not in dependencies:
-                subnodes = node.subnodes | node.dependencies
-                if not subnodes:
-                    dependencies[node] = frozenset()
-                    continue
-
-                cls._collect_dependencies(subnodes, dependencies)
-
-                collected = set(subnodes)
-                for subnode in subnodes:
-                    collected.update(dependencies[subnode])
-                dependencies[node] = frozenset(collected)
-
-        return dependencies
-
+            targets = required.get(node)
+            if not targets:
+                continue
+
+            min_index = min(order[target] for target in targets)
+            remaining = set(targets)
+            visited = set((node,))
+            queue = collections.deque((node,))
+            while queue and remaining:
+                current = queue.popleft()
+                for child in current.subnodes | current.dependencies:
+                    if child not in visited and order[child] >= min_index:
+                        visited.add(child)
+                        remaining.discard(child)
+                        if child in reachable:
+                            remaining.difference_update(reachable[child])
+                        queue.append(child)
+            reachable[node] = targets - remaining
+
+        return reachable
 
     @classmethod
-    def _collect_reverse_dependencies(cls, lst, rev_dependencies, processed):
-        for node in lst:
-            if node not in processed:
-                processed.add(node)
-
-                # Initialize default-dict
-                rev_dependencies[node] # pylint: disable=W0104
-
-                subnodes = node.dependencies | node.subnodes
-                for dependency in subnodes:
-                    rev_dependencies[dependency].add(node)
-                cls._collect_reverse_dependencies(subnodes, rev_dependencies, processed)
-
+    def _sort_nodes(cls, nodes):
+        """Returns a list of every node in the graph, in which every node is
+        preceded by its dependencies and subnodes (post-order traversal).
+        Traversal is carried out without recursion, to allow very deep
+        graphs."""
+        sorted_nodes = []
+        visited = set()
+        in_progress = set()
+        for root in nodes:
+            if root in visited:
+                continue
+
+            visited.add(root)
+            in_progress.add(root)
+            stack = [(root, iter(root.dependencies | root.subnodes))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child in in_progress:
+                        raise NodeGraphError("Cycle detected in graph for "
+                                             "node %s" % (child,))
+                    elif child not in visited:
+                        visited.add(child)
+                        in_progress.add(child)
+                        stack.append((child, iter(child.dependencies |
+                                                  child.subnodes)))
+                        break
+                else:
+                    stack.pop()
+                    in_progress.remove(node)
+                    sorted_nodes.append(node)
+
+        return sorted_nodes
+
+
+class _IndexTable(object):
+    """Compact table mapping node IDs (0 .. N - 1) to lists of node IDs,
+    stored as two arrays of offsets and values. Rows may be appended, and
+    values added to existing rows; the latter are stored separately, since
+    these are expected to be rare (e.g. new nodes depending on shared
+    nodes already in a graph)."""
+
+    def __init__(self, rows=()):
+        self._offsets = array.array("l", (0,))
+        self._values = array.array("l")
+        self._extra = {}
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        self._values.extend(row)
+        self._offsets.append(len(self._values))
+
+    def add(self, index, value):
+        self._extra.setdefault(index, []).append(value)
+
+    def __getitem__(self, index):
+        row = self._values[self._offsets[index]:self._offsets[index + 1]]
+        extra = self._extra.get(index)
+        if extra:
+            row.extend(extra)
+        return row
+
+    def __len__(self):
+        return len(self._offsets) - 1
 
 
 def _summarize_nodes(nodes):
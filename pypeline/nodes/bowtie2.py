@@ -93,20 +93,25 @@ class Bowtie2Node(CommandNode):
         else:
             raise NodeError("Input 1, OR both input 1 and input 2 must be specified for Bowtie2 node")
 
-        max_threads = _get_max_threads(reference, threads)
-        aln.set_option("--threads", max_threads)
+        threads = _get_max_threads(reference, threads)
+        aln.set_option("--threads", threads)
 
         order, commands = _process_output(aln, output_file, reference, run_fixmate = (input_file_1 and input_file_2))
         commands["aln"] = aln
 
         return {"commands"     : commands,
                 "order"        : ["aln"] + order,
-                "threads"      : max_threads,
+                "threads"      : threads,
                 "dependencies" : dependencies}
 
 
     @use_customizable_cli_parameters
     def __init__(self, parameters):
+        # Command builders, used by '_set_threads'; not pickled
+        self._builders = parameters.commands
+        self._order = parameters.order
+        self._max_threads = parameters.threads
+
         command = ParallelCmds([parameters.commands[key].finalize() for key in parameters.order])
 
         algorithm    = "PE" if parameters.input_file_2 else "SE"
@@ -124,6 +129,31 @@ class Bowtie2Node(CommandNode):
                              dependencies = parameters.dependencies)
 
 
+    @property
+    def thread_range(self):
+        """See Node.thread_range; the node may use from 1 up to the number of
+        threads it was created with (see '_get_max_threads'). The number of
+        threads is fixed for unpickled nodes."""
+        if self._builders is None:
+            return (self.threads, self.threads)
+        return (1, self._max_threads)
+
+
+    def _set_threads(self, threads):
+        for builder in self._builders.itervalues():
+            builder.unfinalize()
+        self._builders["aln"].replace_option("--threads", threads)
+        self._command = ParallelCmds([self._builders[key].finalize() for key in self._order])
+
+
+    def __getstate__(self):
+        """See Node.__getstate__; the command builders are only needed to
+        change the number of threads before the node is run."""
+        obj_dict = CommandNode.__getstate__(self)
+        obj_dict["_builders"] = None
+        return obj_dict
+
+
 def _bowtie2_template(call, prefix, iotype = "IN", **kwargs):
     params = AtomicCmdBuilder(call, **kwargs)
     for postfix in ("1.bt2", "2.bt2", "3.bt2", "4.bt2", "rev.1.bt2", "rev.2.bt2"):
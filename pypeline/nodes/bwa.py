@@ -302,6 +302,10 @@ class BWAAlgorithmNode(CommandNode):
                                             input_files_2=parameters.input_file_2,
                                             prefix=parameters.prefix)
 
+        # Command builders, used by '_set_threads'; not pickled
+        self._builders = parameters.commands
+        self._max_threads = parameters.threads
+
         command = ParallelCmds([cmd.finalize()
                                 for cmd in parameters.commands.itervalues()])
         CommandNode.__init__(self,
@@ -310,6 +314,29 @@ class BWAAlgorithmNode(CommandNode):
                              threads=parameters.threads,
                              dependencies=parameters.dependencies)
 
+    @property
+    def thread_range(self):
+        """See Node.thread_range; the node may use from 1 up to the number of
+        threads it was created with (see '_get_max_threads'). The number of
+        threads is fixed for unpickled nodes."""
+        if self._builders is None:
+            return (self.threads, self.threads)
+        return (1, self._max_threads)
+
+    def _set_threads(self, threads):
+        for builder in self._builders.itervalues():
+            builder.unfinalize()
+        self._builders["aln"].replace_option("-t", threads)
+        self._command = ParallelCmds([cmd.finalize()
+                                      for cmd in self._builders.itervalues()])
+
+    def __getstate__(self):
+        """See Node.__getstate__; the command builders are only needed to
+        change the number of threads before the node is run."""
+        obj_dict = CommandNode.__getstate__(self)
+        obj_dict["_builders"] = None
+        return obj_dict
+
     def _setup(self, _config, temp):
         os.mkfifo(os.path.join(temp, "uncompressed_input_1"))
         os.mkfifo(os.path.join(temp, "uncompressed_input_2"))
@@ -354,7 +381,8 @@ def _get_max_threads(reference, threads):
     given reference sequence. This is done since very little gain is obtained
     when using multiple threads for a small genome (e.g. < 1MB). If the
     reference falls below this size, only 1 thread is used (returned),
-    otherwise the requested number of threads is returned.
+    otherwise the requested number of threads is returned (which may be None,
+    signifying no limit).
     """
     if reference not in _PREFIX_SIZE_CACHE:
         if not os.path.exists(reference):
@@ -36,7 +36,8 @@ from pypeline.atomiccmd.command import \
 from pypeline.atomiccmd.sets import \
     ParallelCmds
 from pypeline.common.fileutils import \
-    describe_files
+    describe_files, \
+    swap_ext
 from pypeline.nodes.picard import \
     MultiBAMInput, \
     MultiBAMInputNode
@@ -53,6 +54,7 @@ from pypeline.nodes.samtools import \
     BCFTOOLS_VERSION
 
 import pypeline.tools.bam_stats.coverage as coverage
+import pypeline.tools.bam_stats.rawcounts as rawcounts
 import pypeline.tools.factory as factory
 
 
@@ -84,41 +86,58 @@ class DuplicateHistogramNode(MultiBAMInputNode):
 
 
 class CoverageNode(CommandNode):
+    """Node for calling the 'paleomix coverage' command. Raw counts, which
+    may be merged using MergeCoverageNode, are written alongside the table
+    (see 'rawcounts.sidecar_filename')."""
+
     def __init__(self, config, target_name, input_file, output_file,
-                 regions_file=None, dependencies=()):
+                 regions_file=None, threads=1, dependencies=()):
         builder = factory.new("coverage")
         builder.add_value("%(IN_BAM)s")
         builder.add_value("%(OUT_FILE)s")
         builder.set_option("--target-name", target_name)
+        builder.set_option("--raw-counts", "%(OUT_COUNTS)s")
         builder.set_kwargs(IN_BAM=input_file,
-                           OUT_FILE=output_file)
+                           OUT_FILE=output_file,
+                           OUT_COUNTS=rawcounts.sidecar_filename(output_file))
 
         if regions_file:
             builder.set_option('--regions-file', '%(IN_REGIONS)s')
             builder.set_kwargs(IN_REGIONS=regions_file)
 
+        if threads > 1:
+            # Regions are processed in parallel using the BAM index
+            builder.set_option("--threads", threads)
+            builder.set_kwargs(IN_INDEX=swap_ext(input_file, ".bai"))
+
         description = "<Coverage: %s -> '%s'>" % (input_file, output_file)
         CommandNode.__init__(self,
                              command=builder.finalize(),
                              description=description,
+                             threads=threads,
                              dependencies=dependencies)
 
 
 class MergeCoverageNode(Node):
+    """Merges tables produced by CoverageNode, by summing the raw counts
+    written alongside each table, rather than parsing the tables."""
+
     def __init__(self, input_files, output_file, dependencies=()):
         self._output_file = output_file
+        counts_files = [rawcounts.sidecar_filename(filename)
+                        for filename in input_files]
 
         Node.__init__(self,
                       description="<MergeCoverage: '%s' -> '%s'>"
                       % (describe_files(input_files), self._output_file),
-                      input_files=input_files,
+                      input_files=counts_files,
                       output_files=self._output_file,
                       dependencies=dependencies)
 
     def _run(self, _config, temp):
         table = {}
         for filename in self.input_files:
-            coverage.read_table(table, filename)
+            coverage.read_counts(table, filename)
 
         coverage.write_table(table, reroot_path(temp, self._output_file))
         move_file(reroot_path(temp, self._output_file), self._output_file)
@@ -126,11 +145,14 @@ class MergeCoverageNode(Node):
 
 class DepthHistogramNode(MultiBAMInputNode):
     def __init__(self, config, target_name, input_files, output_file,
-                 regions_file=None, dependencies=()):
+                 regions_file=None, threads=1, dependencies=()):
         bam_input = MultiBAMInput(config, input_files)
         if len(bam_input.files) > 1 and regions_file:
             raise ValueError("DepthHistogram for regions require single, "
                              "indexed input BAM file.")
+        elif len(bam_input.files) > 1:
+            # Merged BAMs are streamed, and cannot be processed in parallel
+            threads = 1
 
         builder = factory.new("depths")
         builder.add_value("%(TEMP_IN_BAM)s")
@@ -143,6 +165,9 @@ class DepthHistogramNode(MultiBAMInputNode):
             builder.set_option('--regions-file', '%(IN_REGIONS)s')
             builder.set_kwargs(IN_REGIONS=regions_file)
 
+        if threads > 1:
+            builder.set_option("--threads", threads)
+
         command = ParallelCmds(bam_input.commands + [builder.finalize()])
         description = "<DepthHistogram: %s -> '%s'>" \
             % (describe_files(bam_input.files), output_file)
@@ -150,6 +175,65 @@ class DepthHistogramNode(MultiBAMInputNode):
                                    bam_input=bam_input,
                                    command=command,
                                    description=description,
+                                   threads=threads,
+                                   dependencies=dependencies)
+
+
+class BAMStatisticsNode(MultiBAMInputNode):
+    """Node for calling the 'paleomix bam_stats' command.
+
+    Collects any combination of coverage, depth histograms, PCR duplicate
+    histograms, and insert sizes, while only reading the input BAM(s) once;
+    the output files correspond to those of the CoverageNode,
+    DepthHistogramNode, and DuplicateHistogramNode classes.
+    """
+
+    def __init__(self, config, target_name, input_files, coverage_file=None,
+                 depths_file=None, duphist_file=None, insert_sizes_file=None,
+                 regions_file=None, threads=1, dependencies=()):
+        output_files = (("--coverage", "OUT_COVERAGE", coverage_file),
+                        ("--depths", "OUT_DEPTHS", depths_file),
+                        ("--duphist", "OUT_DUPHIST", duphist_file),
+                        ("--insert-sizes", "OUT_INSERT_SIZES",
+                         insert_sizes_file))
+        if not any(filename for (_, _, filename) in output_files):
+            raise ValueError("No output files specified for BAMStatistics")
+
+        bam_input = MultiBAMInput(config, input_files)
+        if len(bam_input.files) > 1 and regions_file:
+            raise ValueError("BAMStatistics for regions require single, "
+                             "indexed input BAM file.")
+        elif len(bam_input.files) > 1:
+            # Merged BAMs are streamed, and cannot be processed in parallel
+            threads = 1
+
+        builder = factory.new("bam_stats")
+        builder.add_value("%(TEMP_IN_BAM)s")
+        builder.set_option("--target-name", target_name)
+        bam_input.setup(builder)
+
+        for (option, key, filename) in output_files:
+            if filename:
+                builder.set_option(option, "%%(%s)s" % (key,))
+                builder.set_kwargs(**{key: filename})
+
+        if regions_file:
+            builder.set_option('--regions-file', '%(IN_REGIONS)s')
+            builder.set_kwargs(IN_REGIONS=regions_file)
+
+        if threads > 1:
+            builder.set_option("--threads", threads)
+
+        command = ParallelCmds(bam_input.commands + [builder.finalize()])
+        description = "<BAMStatistics: %s -> %s>" \
+            % (describe_files(bam_input.files),
+               describe_files([filename for (_, _, filename) in output_files
+                               if filename]))
+        MultiBAMInputNode.__init__(self,
+                                   bam_input=bam_input,
+                                   command=command,
+                                   description=description,
+                                   threads=threads,
                                    dependencies=dependencies)
 
 
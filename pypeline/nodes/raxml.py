@@ -253,6 +253,11 @@ class RAxMLRapidBSNode(CommandNode):
         self._symlinks = [parameters.input_alignment,
                           parameters.input_partition]
         self._template = os.path.basename(parameters.output_template)
+        # Command builder, used by '_set_threads'; not pickled
+        self._builder = None
+        if parameters.threads > 1:
+            self._builder = parameters.command
+        self._max_threads = parameters.threads
 
 
         CommandNode.__init__(self,
@@ -263,6 +268,30 @@ class RAxMLRapidBSNode(CommandNode):
                              dependencies = parameters.dependencies)
 
 
+    @property
+    def thread_range(self):
+        """See Node.thread_range; nodes using 'raxmlHPC-PTHREADS' may use from
+        2 up to the number of threads they were created with, while 'raxmlHPC'
+        is single-threaded. The number of threads is fixed for unpickled nodes."""
+        if self._builder is None:
+            return (self.threads, self.threads)
+        return (2, self._max_threads)
+
+
+    def _set_threads(self, threads):
+        self._builder.unfinalize()
+        self._builder.replace_option("-T", threads)
+        self._command = self._builder.finalize()
+
+
+    def __getstate__(self):
+        """See Node.__getstate__; the command builder is only needed to
+        change the number of threads before the node is run."""
+        obj_dict = CommandNode.__getstate__(self)
+        obj_dict["_builder"] = None
+        return obj_dict
+
+
     def _setup(self, config, temp):
         CommandNode._setup(self, config, temp)
 
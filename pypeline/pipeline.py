@@ -23,28 +23,44 @@
 from __future__ import print_function
 
 import os
-import errno
-import Queue
 import pickle
 import signal
+import socket
+import sqlite3
 import logging
-import multiprocessing
 
 import pypeline.ui
 import pypeline.logger
-
-from pypeline.node import Node, MetaNode
+import pypeline.checksums
+import pypeline.runtimes
+import pypeline.metrics
+import pypeline.profiling
+import pypeline.nodegraph
+import pypeline.statecache
+import pypeline.common.versions as versions
+
+from pypeline.node import Node, MetaNode, NodeError
 from pypeline.nodegraph import NodeGraph, NodeGraphError
+from pypeline.scheduler import RunableQueue
+from pypeline.executors.local import LocalExecutor
+from pypeline.executors.base import \
+    make_task, \
+    serialize_node
 from pypeline.common.utilities import \
-    safe_coerce_to_tuple, \
-    fast_pickle_test
+    safe_coerce_to_tuple
 from pypeline.common.versions import \
     VersionRequirementError
 
 
+# Completed nodes are only removed from the graph once the number of completed
+# nodes has grown by this fraction of the graph (see NodeGraph.prune)
+_PRUNE_MIN_FRACTION = 0.25
+
+
 class Pypeline(object):
     def __init__(self, config):
         self._nodes = []
+        self._lazy_nodes = []
         self._config = config
         self._logger = logging.getLogger(__name__)
         # Set if a keyboard-interrupt (SIGINT) has been caught
@@ -58,13 +74,102 @@ class Pypeline(object):
                                     % repr(node))
                 self._nodes.append(node)
 
-    def run(self, max_running=1, dry_run=False, progress_ui="verbose"):
+    def add_lazy_nodes(self, nodes):
+        """Adds an iterable of lists of nodes, which is only consumed once
+        the pipeline runs out of other nodes to run, at which point completed
+        nodes are periodically removed from memory (see NodeGraph.prune). This allows a
+        pipeline made up of many independent parts to be started without
+        first building every node. Nodes added this way are not included by
+        the functions listing nodes, output files, or executables."""
+        self._lazy_nodes.append(nodes)
+
+    def run(self, max_running=1, dry_run=False, progress_ui="verbose",
+            state_cache=None, trust_state_cache=False,
+            content_checksums=False, max_memory=None, runtime_db=None,
+            executor=None, version_cache=None, metrics_address=None,
+            adaptive_threads=False):
+        """Runs the pipeline. If 'executor' is set (see pypeline.executors),
+        nodes are run using that executor, in which case 'max_running' is
+        ignored in favor of the number of threads of the executor, and
+        otherwise nodes are run using a local pool of processes. The
+        executor is closed once the run is done. If 'version_cache' is set,
+        the output of version checks are cached in that file (see
+        pypeline.common.versions.VersionCache). If 'metrics_address' is set,
+        live metrics are served at that address while nodes are running (see
+        pypeline.metrics). If 'adaptive_threads' is set, the number of
+        threads used by nodes supporting it is chosen when nodes are started,
+        based on the number of idle threads (see RunableQueue.select_threads)
+        rather than fixed."""
+        if executor is not None:
+            max_running = executor.max_threads
+
+        nodes = self._nodes
+        cache_factory = pypeline.nodegraph.FileStatusCache
+        if state_cache is not None:
+            with pypeline.profiling.phase("Loading state cache"):
+                state_cache = pypeline.statecache.StateCache(state_cache,
+                                                             trust_state_cache)
+                nodes = state_cache.remove_completed(nodes)
+                state_cache.validate(nodes)
+            cache_factory = state_cache
+
+            if len(nodes) != len(self._nodes):
+                self._logger.info("Skipping %i completed node(s) recorded "
+                                  "in the state cache ...",
+                                  len(self._nodes) - len(nodes))
+
+        if content_checksums:
+            base_factory = cache_factory
+            cache_factory = lambda: \
+                pypeline.checksums.ChecksumStatusCache(base_factory())
+
+        if version_cache is not None:
+            versions.set_version_cache(versions.VersionCache(version_cache))
+
         try:
-            nodegraph = NodeGraph(self._nodes)
-        except NodeGraphError, error:
-            self._logger.error(error)
-            return False
+            try:
+                with pypeline.profiling.phase("Building dependency graph"):
+                    nodegraph = NodeGraph(nodes, cache_factory)
+            except NodeGraphError, error:
+                pypeline.profiling.finish()
+                self._logger.error(error)
+                if executor is not None:
+                    executor.close()
+                return False
+
+            if state_cache is not None:
+                nodegraph.add_state_observer(state_cache)
+
+            runtimes = None
+            if runtime_db is not None:
+                try:
+                    with pypeline.profiling.phase("Loading runtime database"):
+                        runtimes = pypeline.runtimes.RuntimeDB(runtime_db)
+                except sqlite3.Error, error:
+                    self._logger.warning("Could not open runtime database "
+                                         "%r; runtimes will not be recorded: "
+                                         "%s", runtime_db, error)
 
+            try:
+                return self._do_run(nodegraph, max_running, max_memory,
+                                    dry_run, progress_ui, runtimes, executor,
+                                    metrics_address, adaptive_threads,
+                                    state_cache)
+            finally:
+                if state_cache is not None:
+                    state_cache.record_completed(nodegraph, nodes)
+                    state_cache.save()
+                if runtimes is not None:
+                    runtimes.close()
+        finally:
+            # Version checks may be carried out until the last (lazy) nodes
+            # have been added to the graph
+            if version_cache is not None:
+                versions.set_version_cache(None).save()
+
+    def _do_run(self, nodegraph, max_running, max_memory, dry_run,
+                progress_ui, runtimes, executor, metrics_address,
+                adaptive_threads, state_cache):
         for node in nodegraph.iterflat():
             if (node.threads > max_running) and not isinstance(node, MetaNode):
                 message = "Node(s) use more threads than the max allowed; " \
@@ -73,105 +178,241 @@ class Pypeline(object):
                 self._logger.warning(message)
                 break
 
+        if max_memory is not None:
+            for node in nodegraph.iterflat():
+                if node.memory > max_memory:
+                    message = "Node(s) use more memory than the max " \
+                              "allowed; such nodes are only run when no " \
+                              "other nodes are running."
+                    self._logger.warning(message)
+                    break
+
+        # List of iterators of lists of nodes, see 'add_lazy_nodes'
+        lazy_nodes = [iter(nodes) for nodes in self._lazy_nodes]
+
         if dry_run:
+            while lazy_nodes:
+                if self._add_lazy_nodes(nodegraph, lazy_nodes, state_cache,
+                                        False) is None:
+                    if executor is not None:
+                        executor.close()
+                    return False
+
+            pypeline.profiling.finish()
             progress_printer = pypeline.ui.VerboseUI()
             nodegraph.add_state_observer(progress_printer)
             progress_printer.flush()
             self._logger.info("Dry run done ...")
+            if executor is not None:
+                executor.close()
             return True
 
+        pypeline.profiling.finish()
+        if executor is None:
+            executor = LocalExecutor(max_running)
+
+        interrupted = False
         old_handler = signal.signal(signal.SIGINT, self._sigint_handler)
         try:
-            return self._run(nodegraph, max_running, progress_ui)
+            return self._run(nodegraph, lazy_nodes, max_running,
+                             max_memory, progress_ui, runtimes, executor,
+                             metrics_address, adaptive_threads, state_cache)
+        except KeyboardInterrupt:
+            interrupted = True
+            raise
         finally:
             signal.signal(signal.SIGINT, old_handler)
-
-        return False
-
-    def _run(self, nodegraph, max_running, progress_ui):
-        # Dictionary of nodes -> async-results
+            if interrupted:
+                # CTRL-C pressed twice; running nodes are killed
+                executor.terminate()
+            else:
+                executor.close()
+
+    def _run(self, nodegraph, lazy_nodes, max_running, max_memory,
+             progress_ui, runtimes, executor, metrics_address,
+             adaptive_threads, state_cache):
+        estimate_runtime = None
+        if runtimes is not None:
+            estimate_runtime = runtimes.estimate_runtime
+            executor.set_runtime_estimates(estimate_runtime)
+
+        # Dictionary of keys -> running nodes
         running = {}
-        # Set of remaining nodes to be run
-        remaining = set(nodegraph.iterflat())
-        queue = multiprocessing.Queue()
-        pool = multiprocessing.Pool(max_running, _init_worker, (queue,))
+        # Queue of nodes that may be started, updated as states change
+        runable = RunableQueue(estimate_runtime)
+        nodegraph.add_state_observer(runable)
 
         errors_occured = False
 
         progress_printer = pypeline.ui.get_ui(progress_ui)
+        if estimate_runtime is not None:
+            progress_printer.set_runtime_estimates(estimate_runtime,
+                                                   max_running)
         nodegraph.add_state_observer(progress_printer)
-        while running or (remaining and not self._interrupted):
-            errors_occured |= not self._poll_running_nodes(running,
-                                                           nodegraph,
-                                                           queue)
-
-            if not self._interrupted:  # Prevent starting of new nodes
-                self._start_new_tasks(remaining, running, nodegraph,
-                                      max_running, pool)
-
-            if running:
-                progress_printer.flush()
-
-        pool.close()
-        pool.join()
+        metrics_server = self._start_metrics_server(nodegraph, runable,
+                                                    running, executor,
+                                                    metrics_address)
+        try:
+            while running or ((runable or lazy_nodes)
+                              and not self._interrupted):
+                errors_occured |= not self._poll_running_nodes(running,
+                                                               nodegraph,
+                                                               executor,
+                                                               runtimes)
+
+                if not self._interrupted:  # Prevent starting of new nodes
+                    self._start_new_tasks(runable, running, nodegraph,
+                                          max_running, max_memory, executor,
+                                          adaptive_threads, not lazy_nodes)
+
+                    # Nodes are only added once there is nothing left to start
+                    while lazy_nodes and not runable and max_running > \
+                            sum(node.threads for node in running.itervalues()):
+                        nodes = self._add_lazy_nodes(nodegraph, lazy_nodes,
+                                                     state_cache)
+                        if nodes is None:
+                            errors_occured = True
+                            break
+
+                        num_running = len(running)
+                        self._start_new_tasks(runable, running, nodegraph,
+                                              max_running, max_memory,
+                                              executor, adaptive_threads,
+                                              not lazy_nodes)
+
+                        # Stop if the new nodes are waiting for running
+                        # nodes, rather than building every node while these
+                        # run.
+                        if running and len(running) == num_running \
+                                and any(nodegraph.get_node_state(node)
+                                        != nodegraph.DONE for node in nodes):
+                            break
+
+                if running:
+                    progress_printer.flush()
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
 
         progress_printer.flush()
         progress_printer.finalize()
 
         return not errors_occured
 
-    def _start_new_tasks(self, remaining, running, nodegraph, max_threads,
-                         pool):
-        started_nodes = []
+    def _start_metrics_server(self, nodegraph, runable, running, executor,
+                              address):
+        """Starts serving live metrics at 'address', if set; returns None if
+        no address was given, or if the server could not be started."""
+        if address is None:
+            return None
+
+        def _process_ids():
+            return dict((running.get(key), pid)
+                        for (key, pid) in executor.process_ids().iteritems())
+
+        metrics = pypeline.metrics.PipelineMetrics(runable, _process_ids)
+        nodegraph.add_state_observer(metrics)
+        try:
+            server = pypeline.metrics.MetricsServer(address, metrics)
+        except (socket.error, ValueError), error:
+            self._logger.warning("Could not serve metrics at %r; metrics "
+                                 "will not be available: %s", address, error)
+            return None
+
+        self._logger.info("Serving live metrics at %r ...", address)
+        return server
+
+    def _add_lazy_nodes(self, nodegraph, lazy_nodes, state_cache=None,
+                        prune=True):
+        """Adds the next list of nodes from the first iterator in 'lazy_nodes'
+        to the graph, after (optionally) removing completed nodes from the
+        graph, and returns the list of nodes added to the graph. Exhausted
+        iterators are removed from 'lazy_nodes', which is cleared if nodes
+        could not be built or added to the graph, in which case None is
+        returned. If 'state_cache' is set, nodes recorded as completed are
+        skipped, and the nodes are recorded once completed (see
+        StateCache.record_on_completion)."""
+        try:
+            for nodes in lazy_nodes[0]:
+                if state_cache is not None:
+                    nodes = state_cache.remove_completed(
+                        safe_coerce_to_tuple(nodes))
+                if prune:
+                    nodegraph.prune(_PRUNE_MIN_FRACTION)
+
+                new_nodes = nodegraph.add_nodes(nodes)
+                if state_cache is not None:
+                    state_cache.record_on_completion(nodegraph, nodes)
+                return new_nodes
+        except (NodeError, NodeGraphError), error:
+            self._logger.error("Error while adding nodes to pipeline:\n%s",
+                               error)
+            del lazy_nodes[:]
+            return None
+
+        lazy_nodes.pop(0)
+        return []
+
+    def _start_new_tasks(self, runable, running, nodegraph, max_threads,
+                         max_memory, executor, adaptive_threads=False,
+                         spread_idle=False):
+        """Starts runable nodes using the idle threads / memory. If
+        'adaptive_threads' is set, the number of threads used by each node
+        is selected using RunableQueue.select_threads, with idle threads
+        being divided between the started nodes if 'spread_idle' is set.
+        Nodes are serialized as they are started, and nodes that cannot be
+        serialized are marked as failed."""
         idle_processes = max_threads \
-            - sum(node.threads for (node, _) in running.itervalues())
-
-        for node in remaining:
-            if not running or (idle_processes >= node.threads):
-                state = nodegraph.get_node_state(node)
-                if state == nodegraph.RUNABLE:
-                    try:
-                        # The multi-processing module relies on pickling
-                        fast_pickle_test(node)
-                    except pickle.PicklingError, error:
-                        self._logger.error("Node cannot be pickled; please "
-                                           "file a bug-report:\n"
-                                           "\tNode: %s\n\tError: %s"
-                                           % (self, error))
-                        nodegraph.set_node_state(node, nodegraph.ERROR)
-                        started_nodes.append(node)
-                        continue
-
-                    key = id(node)
-                    proc_args = (key, node, self._config)
-                    running[key] = (node, pool.apply_async(_call_run,
-                                                           args=proc_args))
-                    started_nodes.append(node)
-
-                    nodegraph.set_node_state(node, nodegraph.RUNNING)
-                    idle_processes -= node.threads
-                elif state in (nodegraph.DONE, nodegraph.ERROR):
-                    started_nodes.append(node)
-            elif idle_processes <= 0:
-                break
+            - sum(node.threads for node in running.itervalues())
+        idle_memory = None
+        if max_memory is not None:
+            idle_memory = max_memory \
+                - sum(node.memory for node in running.itervalues())
+
+        if adaptive_threads:
+            selection = runable.select_threads(idle_processes, not running,
+                                               idle_memory, spread_idle)
+        else:
+            selection = [(node, node.threads) for node
+                         in runable.select(idle_processes, not running,
+                                           idle_memory)]
 
-        for node in started_nodes:
-            remaining.remove(node)
+        for (node, threads) in selection:
+            if threads != node.threads:
+                node.set_threads(threads)
 
-    def _poll_running_nodes(self, running, nodegraph, queue):
+            payload = self._serialize_node(node)
+            if payload is None:
+                nodegraph.set_node_state(node, nodegraph.ERROR)
+                continue
+
+            key = id(node)
+            running[key] = node
+            executor.start(key, node, make_task(payload, self._config))
+            nodegraph.set_node_state(node, nodegraph.RUNNING)
+
+    def _serialize_node(self, node):
+        try:
+            # Executors rely on pickling to pass nodes to workers
+            return serialize_node(node)
+        except pickle.PicklingError, error:
+            self._logger.error("Node cannot be pickled; please "
+                               "file a bug-report:\n"
+                               "\tNode: %s\n\tError: %s"
+                               % (node, error))
+            return None
+
+    def _poll_running_nodes(self, running, nodegraph, executor, runtimes):
         errors, blocking = None, True
         while running:
-            node, proc = self._get_finished_node(queue, running, blocking)
+            finished = executor.wait(blocking)
             blocking = False  # only block first cycle
-            if not node:
+            if finished is None:
                 break
 
-            try:
-                # Re-raise exceptions from the node-process
-                proc.get()
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception, errors:
+            key, errors, stats = finished
+            node = running.pop(key)
+            if errors is not None:
                 nodegraph.set_node_state(node, nodegraph.ERROR)
 
                 errors = "\n".join(("\t" + line)
@@ -179,6 +420,9 @@ class Pypeline(object):
                 self._logger.error("%s: Error occurred running command:\n%s\n",
                                    node, errors)
                 continue
+
+            if runtimes is not None:
+                runtimes.record(node, stats)
             nodegraph.set_node_state(node, nodegraph.DONE)
 
         return not errors
@@ -354,47 +598,3 @@ class Pypeline(object):
             out.write("}\n")
 
         return True
-
-    @classmethod
-    def _get_finished_node(cls, queue, running, blocking=True):
-        """Returns a tuple containing a node that has finished running
-        and it's async-result, or None for both if no such node could
-        be found (and blocking is False), or if an interrupt occured
-        while waiting for a node to finish.
-
-        If blocking is True, the function will only return once a
-        result becomes available, or if an interrupt occurs."""
-        try:
-            key = queue.get(blocking)
-            return running.pop(key)
-        except IOError, error:
-            # User pressed ctrl-c (SIGINT), or similar event ...
-            if error.errno != errno.EINTR:
-                raise
-        except Queue.Empty:
-            pass
-        return None, None
-
-
-def _init_worker(queue):
-    """Init function for subprocesses created by multiprocessing.Pool: Ensures
-    that KeyboardInterrupts only occur in the main process, allowing us to do
-    proper cleanup.
-    """
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    # This is a workaround to avoid having to use multiprocessing.Manager
-    # to create the Queue objects; this is needed because the Manager class
-    # creates it own process, which inherits the signal-handlers of the main
-    # process, causing some rather odd behavior when the user causes a SIGINT.
-    _call_run.queue = queue
-
-
-def _call_run(key, node, config):
-    """Wrapper function, required in order to call Node.run()
-    in subprocesses, since it is not possible to pickle
-    bound functions (e.g. self.run)"""
-    try:
-        return node.run(config)
-    finally:
-        # See comment in _init_worker
-        _call_run.queue.put(key)
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Profiling of the startup of pipelines (see --profile-startup).
+
+When enabled, the wall-clock time spent in each phase of the startup (e.g.
+reading makefiles, building nodes, and the checks carried out by NodeGraph)
+is recorded, along with the number of file-system calls (stat, open, listdir,
+etc.) and subprocesses started during each phase. A report is printed once
+the startup has finished, i.e. before the first node is run.
+
+File-system calls and subprocesses are counted by wrapping the corresponding
+functions in the 'os', '__builtin__', and 'subprocess' modules; calls made by
+other threads (e.g. when checking files in parallel) are included in the
+counts of the current phase. Optionally, the startup may also be profiled
+using cProfile, writing the statistics to a file (see pstats).
+
+Phases are recorded using 'phase', which does nothing if profiling has not
+been enabled:
+  with pypeline.profiling.phase("Reading makefiles"):
+     ...
+"""
+import os
+import sys
+import time
+import cProfile
+import optparse
+import threading
+import subprocess
+import collections
+import __builtin__
+
+
+# Functions in the 'os' module counted as file-system calls
+_FS_FUNCTIONS = ("stat", "lstat", "listdir", "access", "open", "mkdir",
+                 "rmdir", "remove", "unlink", "rename", "readlink", "chmod",
+                 "utime")
+
+# Active profile, if profiling is enabled (see 'enable')
+_PROFILE = None
+
+
+def add_optiongroup(parser):
+    """Adds an option-group to an OptionParser object, with options
+    pertaining to profiling of the pipeline."""
+    group = optparse.OptionGroup(parser, "Profiling")
+    group.add_option("--profile-startup", default=False, action="store_true",
+                     help="Report the wall-clock time, and the number of "
+                          "file-system calls and subprocesses used by each "
+                          "phase of the startup of the pipeline. May be "
+                          "combined with --dry-run.")
+    group.add_option("--profile-startup-dump", default=None,
+                     metavar="FILENAME",
+                     help="Profile the startup of the pipeline using "
+                          "cProfile, and write the statistics to FILENAME; "
+                          "implies --profile-startup.")
+    parser.add_option_group(group)
+
+
+def enable_from_options(options):
+    """Enables profiling if requested by the options added by
+    'add_optiongroup'."""
+    if options.profile_startup or options.profile_startup_dump:
+        enable(options.profile_startup_dump)
+
+
+def enable(dump_file=None):
+    """Starts profiling the startup; if 'dump_file' is set, the startup is
+    also profiled using cProfile, and the statistics written to this file.
+    Has no effect if profiling is already enabled."""
+    global _PROFILE
+    if _PROFILE is None:
+        _PROFILE = _Profile(dump_file)
+
+
+def is_enabled():
+    return _PROFILE is not None
+
+
+def phase(name):
+    """Returns a context manager recording the time, file-system calls, and
+    subprocesses used by the code in the with-block. Phases may be nested,
+    and the statistics of phases with the same name (and parent) are added
+    together."""
+    if _PROFILE is None:
+        return _NULL_PHASE
+    return _Phase(_PROFILE, name)
+
+
+def finish(handle=sys.stderr):
+    """Stops profiling, writes the cProfile statistics (if enabled), and
+    prints a report of each phase to 'handle'. Has no effect if profiling
+    has not been enabled."""
+    global _PROFILE
+    profile, _PROFILE = _PROFILE, None
+    if profile is not None:
+        profile.stop()
+        handle.write(profile.report())
+        handle.flush()
+
+
+class _Profile(object):
+    def __init__(self, dump_file):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        # Counts of file-system calls and subprocesses
+        self.counts = [0, 0]
+        # (parent, name) -> [depth, calls, wall-time, fs-calls, subprocesses]
+        self.phases = collections.OrderedDict()
+        self.stack = []
+        self._originals = []
+        self._dump_file = dump_file
+        self._cprofile = None
+
+        for name in _FS_FUNCTIONS:
+            if hasattr(os, name):
+                self._wrap(os, name, 0)
+        self._wrap(__builtin__, "open", 0)
+        self._wrap(subprocess.Popen, "_execute_child", 1)
+
+        if dump_file is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+        for (obj, name, func) in reversed(self._originals):
+            setattr(obj, name, func)
+        self._originals = []
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(self._dump_file)
+
+    def report(self):
+        counts = [time.time() - self._start] + self.counts
+        lines = ["Startup profile:",
+                 "  %-40s %6s %10s %10s %8s"
+                 % ("Phase", "Calls", "Wall (s)", "FS calls", "Procs")]
+        for ((_, name), (depth, calls, wall_time, fs_calls, procs)) \
+                in self.phases.iteritems():
+            name = ("  " * depth + name)[:40]
+            lines.append("  %-40s %6i %10.2f %10i %8i"
+                         % (name, calls, wall_time, fs_calls, procs))
+        lines.append("  %-40s %6s %10.2f %10i %8i"
+                     % tuple(["Total", ""] + counts))
+        if self._dump_file is not None:
+            lines.append("  cProfile statistics written to %r"
+                         % (self._dump_file,))
+        return "\n".join(lines) + "\n\n"
+
+    def _wrap(self, obj, name, counter):
+        # Use the raw function, as unbound methods cannot be restored as is
+        func = vars(obj)[name]
+        counts, lock = self.counts, self._lock
+
+        def _wrapper(*args, **kwargs):
+            with lock:
+                counts[counter] += 1
+            return func(*args, **kwargs)
+
+        self._originals.append((obj, name, func))
+        setattr(obj, name, _wrapper)
+
+
+class _Phase(object):
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+        self._key = None
+        self._start = None
+
+    def __enter__(self):
+        profile = self._profile
+        parent = profile.stack[-1] if profile.stack else None
+        self._key = (parent, self._name)
+        if self._key not in profile.phases:
+            profile.phases[self._key] = [len(profile.stack), 0, 0.0, 0, 0]
+        profile.stack.append(self._key)
+        self._start = [time.time()] + profile.counts
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        profile = self._profile
+        profile.stack.pop()
+        record = profile.phases[self._key]
+        record[1] += 1
+        record[2] += time.time() - self._start[0]
+        record[3] += profile.counts[0] - self._start[1]
+        record[4] += profile.counts[1] - self._start[2]
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Database of historical runtimes of nodes.
+
+For every node that is run successfully, the class, description, total size
+of input files, number of threads, wall-clock time, CPU time, and peak
+memory usage (RSS) is recorded in a SQLite database (see --runtime-db), along
+with the user / system CPU time and storage I/O of the commands run by the
+node (see AtomicCmd.resource_usage), if any. These
+records are used to estimate the runtime of nodes in subsequent runs, e.g.
+when prioritizing nodes (see pypeline.scheduler), or when estimating the
+time left for a run.
+
+Runtimes are measured in the worker processes (see 'measure'), and recorded
+in the main process. Since the database is frequently placed on network
+file-systems, where every commit is expensive, records are written in
+batches; at most every '_COMMIT_INTERVAL' seconds, and when the database is
+closed.
+"""
+import os
+import sys
+import time
+import socket
+import sqlite3
+import logging
+import resource
+
+from pypeline.node import MetaNode
+from pypeline.common.fileutils import make_dirs
+
+
+# Incremented if the database schema changes
+_SCHEMA_VERSION = 2
+# Seconds to wait for other processes holding a lock on the database
+_LOCK_TIMEOUT = 30.0
+# Minimum number of seconds between commits of new records
+_COMMIT_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runtimes (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    host TEXT NOT NULL,
+    node_class TEXT NOT NULL,
+    description TEXT NOT NULL,
+    input_size INTEGER,
+    threads INTEGER NOT NULL,
+    wall_time REAL NOT NULL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    user_time REAL,
+    system_time REAL,
+    read_bytes INTEGER,
+    write_bytes INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS runtimes_by_node
+    ON runtimes (node_class, description);
+"""
+
+# Columns added in version 2 of the schema
+_SCHEMA_V2_COLUMNS = (("user_time", "REAL"),
+                      ("system_time", "REAL"),
+                      ("read_bytes", "INTEGER"),
+                      ("write_bytes", "INTEGER"))
+
+
+def measure(func, node, *args, **kwargs):
+    """Calls func(*args, **kwargs), and returns a dictionary containing the
+    runtime statistics of the call, for use with 'RuntimeDB.record'. CPU
+    time and memory usage includes both the current process and any child
+    processes (e.g. commands run by the node) that were waited on.
+
+    The peak memory usage (in KB) is only known if it exceeded that of any
+    previous child process of the current process, or if it was recorded for
+    the commands run by the node, and is None otherwise. The resource usage
+    of these commands (see Node.resource_usage) is included as 'commands'."""
+    start_self = resource.getrusage(resource.RUSAGE_SELF)
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_time = time.time()
+
+    func(*args, **kwargs)
+
+    wall_time = time.time() - start_time
+    end_self = resource.getrusage(resource.RUSAGE_SELF)
+    end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = 0.0
+    for (start, end) in ((start_self, end_self),
+                         (start_children, end_children)):
+        cpu_time += (end.ru_utime - start.ru_utime) \
+            + (end.ru_stime - start.ru_stime)
+
+    max_rss = None
+    if end_children.ru_maxrss > start_children.ru_maxrss:
+        max_rss = end_children.ru_maxrss
+    if end_self.ru_maxrss > start_self.ru_maxrss:
+        max_rss = max(max_rss, end_self.ru_maxrss)
+    if max_rss is not None and sys.platform == "darwin":
+        max_rss //= 1024  # Reported in bytes on OSX
+
+    commands = node.resource_usage
+    if max_rss is None and commands is not None:
+        max_rss = commands["max_rss"]
+
+    return {"input_size": _input_size(node),
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "max_rss": max_rss,
+            "commands": commands}
+
+
+class RuntimeDB(object):
+    """SQLite database of runtimes of nodes; see module documentation.
+
+    Estimates are based on the most recent runtime of nodes with the same
+    class and description, if any, and otherwise on the mean runtime of
+    nodes of the same class. Estimates are calculated when the database is
+    opened, and are not affected by subsequent calls to 'record'. Records
+    are written in batches, and 'close' must be called to ensure that every
+    record is written."""
+
+    def __init__(self, filename):
+        self._logger = logging.getLogger(__name__)
+        self._host = socket.gethostname()
+        dirname = os.path.dirname(filename)
+        try:
+            if dirname:
+                make_dirs(dirname)
+        except OSError, error:
+            raise sqlite3.OperationalError(str(error))
+
+        # Records not yet written to the database
+        self._pending = []
+        self._last_commit = time.time()
+        self._conn = sqlite3.connect(filename, timeout=_LOCK_TIMEOUT)
+        try:
+            self._initialize()
+            self._by_node, self._by_class = self._load_estimates()
+        except:
+            self._conn.close()
+            raise
+
+    def record(self, node, stats):
+        """Records the runtime statistics of a node, as returned by the
+        'measure' function. Records are written once '_COMMIT_INTERVAL'
+        seconds have passed since the last commit, or when the database is
+        closed. Failure to write to the database is logged, but otherwise
+        ignored."""
+        commands = stats.get("commands") or {}
+        values = (time.time(), self._host,
+                  node.__class__.__name__, str(node),
+                  stats.get("input_size"), node.threads, stats["wall_time"],
+                  stats.get("cpu_time"), stats.get("max_rss"),
+                  commands.get("user_time"), commands.get("system_time"),
+                  commands.get("read_bytes"), commands.get("write_bytes"))
+
+        self._pending.append(values)
+        if time.time() - self._last_commit >= _COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Writes any pending records to the database in a single commit."""
+        pending, self._pending = self._pending, []
+        self._last_commit = time.time()
+        if not pending:
+            return
+
+        try:
+            with self._conn:
+                self._conn.executemany("INSERT INTO runtimes (timestamp, "
+                                       "host, node_class, description, "
+                                       "input_size, threads, wall_time, "
+                                       "cpu_time, max_rss, user_time, "
+                                       "system_time, read_bytes, write_bytes)"
+                                       " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                                       "?, ?, ?, ?)", pending)
+        except sqlite3.Error, error:
+            self._logger.warning("Could not record runtimes of %i node(s): "
+                                 "%s", len(pending), error)
+
+    def estimate_runtime(self, node):
+        """Returns the estimated runtime of a node in seconds, or None if no
+        nodes of the same class have been recorded. MetaNodes take no time."""
+        if isinstance(node, MetaNode):
+            return 0.0
+
+        key = (node.__class__.__name__, str(node))
+        runtime = self._by_node.get(key)
+        if runtime is None:
+            runtime = self._by_class.get(key[0])
+        return runtime
+
+    def estimate_total(self, nodes):
+        """Returns a tuple of the estimated combined runtime (in seconds) of
+        the nodes for which an estimate is available, and the number of nodes
+        for which no estimate is available."""
+        total, unknown = 0.0, 0
+        for node in nodes:
+            runtime = self.estimate_runtime(node)
+            if runtime is None:
+                unknown += 1
+            else:
+                total += runtime
+        return total, unknown
+
+    def close(self):
+        """Writes any pending records, and closes the database."""
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+    def _initialize(self):
+        with self._conn:
+            version, = self._conn.execute("PRAGMA user_version").fetchone()
+            if version not in (0, 1, _SCHEMA_VERSION):
+                raise sqlite3.DatabaseError("Runtime database was created by "
+                                            "a different version of the "
+                                            "pipeline")
+
+            self._conn.executescript(_SCHEMA)
+            if version == 1:
+                for (column, column_type) in _SCHEMA_V2_COLUMNS:
+                    self._conn.execute("ALTER TABLE runtimes ADD COLUMN %s %s"
+                                       % (column, column_type))
+            self._conn.execute("PRAGMA user_version = %i" % _SCHEMA_VERSION)
+
+    def _load_estimates(self):
+        by_node = {}
+        query = "SELECT node_class, description, wall_time FROM runtimes " \
+                "WHERE id IN (SELECT MAX(id) FROM runtimes " \
+                "             GROUP BY node_class, description)"
+        for (node_class, description, wall_time) in self._conn.execute(query):
+            by_node[(str(node_class), description)] = wall_time
+
+        query = "SELECT node_class, AVG(wall_time) FROM runtimes " \
+                "GROUP BY node_class"
+        by_class = dict((str(node_class), wall_time)
+                        for (node_class, wall_time)
+                        in self._conn.execute(query))
+
+        return by_node, by_class
+
+
+def _input_size(node):
+    """Returns the combined size of the input files of a node in bytes, or
+    None if any of the input files could not be accessed."""
+    try:
+        return sum(os.path.getsize(fpath) for fpath in node.input_files)
+    except OSError:
+        return None
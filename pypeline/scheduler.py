@@ -0,0 +1,307 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Scheduling of nodes in a NodeGraph.
+
+The RunableQueue class is a NodeGraph observer (see 'add_state_observer'),
+which keeps track of the nodes that may be started at any given time. This
+allows the pipeline to select nodes for running without having to check the
+state of every node in the graph, every time a node finishes.
+
+Runable nodes are prioritized by the length of the longest (critical) path
+from the node to the end of the pipeline, weighted by the (expected) runtime
+of each node on the path, so that long chains of nodes are started as early
+as possible. Runtimes are estimated using a user-supplied function (e.g. based
+on historical runtimes), falling back to a per-class heuristic (see
+'estimate_cost').
+"""
+import heapq
+import itertools
+
+from pypeline.node import MetaNode
+from pypeline.nodegraph import NodeGraph
+
+
+# Rough estimates of the relative runtimes of (expensive) nodes, by class
+# name, used to prioritize nodes when no better estimate is available.
+_CLASS_COSTS = {
+    # BAM pipeline
+    "SE_AdapterRemovalNode": 1800,
+    "PE_AdapterRemovalNode": 1800,
+    "SEBWANode": 3600,
+    "PEBWANode": 3600,
+    "BWAAlgorithmNode": 3600,
+    "Bowtie2Node": 3600,
+    "MarkDuplicatesNode": 1800,
+    "FilterCollapsedBAMNode": 1200,
+    "MergeSamFilesNode": 900,
+    "_IndelTrainerNode": 1800,
+    "_IndelRealignerNode": 3600,
+    "MapDamageModelNode": 600,
+    "MapDamagePlotNode": 900,
+    "MapDamageRescaleNode": 1800,
+    "CoverageNode": 900,
+    "DepthHistogramNode": 900,
+    # Phylogeny pipeline
+    "GenotypeRegionsNode": 1800,
+    "VCFPileupNode": 1800,
+    "ExaMLNode": 7200,
+    "ExaMLParserNode": 300,
+    "RAxMLRapidBSNode": 7200,
+    "RAxMLBootstrapNode": 3600,
+    "ParsimonatorNode": 600,
+    "MAFFTNode": 300,
+    # Cheap nodes (bundled into shared jobs by the BatchExecutor)
+    "BAMIndexNode": 30,
+    "FastaIndexNode": 30,
+    "TabixIndexNode": 30,
+    "MergeCoverageNode": 10,
+    "SummaryTableNode": 10,
+    "SlopBedNode": 10,
+    "NewickRerootNode": 10,
+    "NewickSupportNode": 10,
+}
+# Estimated cost of nodes not listed above
+DEFAULT_COST = 60
+
+
+def estimate_cost(node):
+    """Returns a rough, heuristic estimate of the runtime of a node, based on
+    the class of the node; MetaNodes are assumed to take no time."""
+    if isinstance(node, MetaNode):
+        return 0
+    return _CLASS_COSTS.get(node.__class__.__name__, DEFAULT_COST)
+
+
+class RunableQueue(object):
+    """Queue of nodes in the RUNABLE state, kept up to date by observing
+    changes to the states of nodes in a NodeGraph. Nodes are returned in
+    order of priority (the length of the critical path starting with the
+    node), and otherwise in the order in which they became runable.
+
+    If 'estimate_runtime' is set, it is expected to be a function taking a
+    node, and returning the expected runtime of the node in seconds, or None
+    if no estimate is available, in which case 'estimate_cost' is used."""
+
+    def __init__(self, estimate_runtime=None):
+        self._estimate_runtime = estimate_runtime
+        # Dictionary of node -> length of the critical path
+        self._priorities = None
+        # Heap of (-priority, sequence, node); entries for nodes that are no
+        # longer runable are removed lazily (see '_entries').
+        self._heap = []
+        # Dictionary of runable node -> sequence of the current heap entry
+        self._nodes = {}
+        self._counter = itertools.count()
+
+    def refresh(self, nodegraph):
+        """See NodeGraph.add_state_observer."""
+        if self._priorities is None:
+            self._priorities = self._calculate_priorities(nodegraph.iterflat())
+
+        self._heap = []
+        self._nodes = {}
+        for node in nodegraph.iterflat():
+            state = nodegraph.get_node_state(node)
+            if state == NodeGraph.RUNABLE:
+                self._push(node)
+            elif state == NodeGraph.DONE:
+                self._priorities.pop(node, None)
+
+    def state_changed(self, node, old_state, new_state, _is_primary):
+        """See NodeGraph.add_state_observer."""
+        if new_state == NodeGraph.RUNABLE:
+            self._push(node)
+        elif old_state == NodeGraph.RUNABLE:
+            self._nodes.pop(node, None)
+
+        # Priorities of completed nodes are no longer needed, and are dropped
+        # to allow nodes removed from the graph to be freed (see
+        # NodeGraph.prune)
+        if new_state == NodeGraph.DONE:
+            self._priorities.pop(node, None)
+
+    def nodes_added(self, nodegraph, nodes):
+        """See NodeGraph.add_state_observer."""
+        priorities = self._priorities
+        new_priorities = self._calculate_priorities(nodes)
+
+        # Nodes already in the graph cannot depend on the new nodes, so only
+        # the priorities of (unfinished) nodes that the new nodes depend upon
+        # may change; increases are propagated to their requirements in turn.
+        queue = []
+        for node in nodes:
+            if nodegraph.get_node_state(node) == NodeGraph.DONE:
+                continue
+
+            priorities[node] = new_priorities[node]
+            for requirement in node.subnodes | node.dependencies:
+                if requirement not in new_priorities:
+                    queue.append((requirement, new_priorities[node]))
+
+        while queue:
+            node, downstream = queue.pop()
+            if node in priorities:
+                priority = self._estimate(node) + downstream
+                if priority > priorities[node]:
+                    priorities[node] = priority
+                    if node in self._nodes:
+                        # The previous heap entry is discarded as stale
+                        self._push(node)
+
+                    for requirement in node.subnodes | node.dependencies:
+                        queue.append((requirement, priority))
+
+        for node in nodes:
+            if nodegraph.get_node_state(node) == NodeGraph.RUNABLE:
+                self._push(node)
+
+    def priority(self, node):
+        """Returns the length of the critical path starting with 'node'."""
+        return self._priorities[node]
+
+    def select(self, idle_threads, is_idle=False, idle_memory=None):
+        """Returns a list of runable nodes, the combined number of threads of
+        which does not exceed 'idle_threads', and the combined memory usage of
+        which does not exceed 'idle_memory' (in MB; not limited if None). If
+        'is_idle' is true (no nodes are running), the first node is always
+        selected, even if it requires more resources than are available, in
+        order to ensure progress.
+
+        Nodes are selected in order of priority, and are not removed from the
+        queue until their state changes."""
+        return [node for (node, _) in self._select(idle_threads, is_idle,
+                                                   idle_memory, False)]
+
+    def select_threads(self, idle_threads, is_idle=False, idle_memory=None,
+                       spread_idle=True):
+        """As 'select', but returns a list of (node, threads) tuples, where
+        'threads' is the number of threads with which to run the node, within
+        the range supported by the node (see Node.thread_range). Nodes that
+        do not fit in the idle threads are run with fewer threads (down to
+        their minimum), rather than waiting for threads to become idle. If
+        'spread_idle' is true and every runable node is selected, threads
+        left idle are divided between the selected nodes (up to their
+        maximum), in order of priority."""
+        selection = self._select(idle_threads, is_idle, idle_memory, True)
+        idle_threads -= sum(threads for (_, threads) in selection)
+
+        if spread_idle and len(selection) == len(self._nodes):
+            growable = [item for item in selection
+                        if _can_add_thread(item[0], item[1])]
+            while idle_threads > 0 and growable:
+                for item in list(growable):
+                    if idle_threads <= 0:
+                        break
+
+                    item[1] += 1
+                    idle_threads -= 1
+                    if not _can_add_thread(item[0], item[1]):
+                        growable.remove(item)
+
+        return [tuple(item) for item in selection]
+
+    def _select(self, idle_threads, is_idle, idle_memory, adaptive):
+        """Returns a list of [node, threads] lists; see 'select' and
+        'select_threads'."""
+        selection, popped = [], []
+        while self._heap and (idle_threads > 0 or is_idle):
+            entry = heapq.heappop(self._heap)
+            if self._nodes.get(entry[2]) != entry[1]:
+                continue  # Stale entry
+
+            popped.append(entry)
+            node = entry[2]
+            threads = node.threads
+            if adaptive:
+                threads = max(node.thread_range[0],
+                              min(threads, idle_threads))
+
+            if is_idle or (idle_threads >= threads
+                           and (idle_memory is None
+                                or idle_memory >= node.memory)):
+                selection.append([node, threads])
+                idle_threads -= threads
+                if idle_memory is not None:
+                    idle_memory -= node.memory
+                is_idle = False
+
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+
+        return selection
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        """Iterates over runable nodes in order of priority."""
+        return (entry[2] for entry in sorted(self._entries()))
+
+    def _entries(self):
+        """Returns the current heap entries, discarding stale entries."""
+        nodes = self._nodes
+        entries = [entry for entry in self._heap
+                   if nodes.get(entry[2]) == entry[1]]
+        if len(entries) != len(self._heap):
+            heapq.heapify(entries)
+            self._heap = entries
+        return entries
+
+    def _push(self, node):
+        sequence = self._counter.next()
+        self._nodes[node] = sequence
+        heapq.heappush(self._heap, (-self._priorities[node], sequence, node))
+
+        # Prevent unbounded growth of the heap due to stale entries
+        if len(self._heap) > 2 * len(self._nodes) + 64:
+            self._entries()
+
+    def _estimate(self, node):
+        runtime = None
+        if self._estimate_runtime is not None and not isinstance(node,
+                                                                 MetaNode):
+            runtime = self._estimate_runtime(node)
+        if runtime is None:
+            runtime = estimate_cost(node)
+        return runtime
+
+    def _calculate_priorities(self, nodes):
+        """Calculates the length of the longest path from each node to the
+        end of the pipeline, by processing nodes in reverse topological
+        order; MetaNodes are transparent, but their cost is zero."""
+        priorities = {}
+        # Longest path among the (processed) dependants of each node
+        downstream = {}
+        for node in reversed(list(nodes)):
+            priority = self._estimate(node) + downstream.pop(node, 0)
+            priorities[node] = priority
+            for requirement in node.subnodes | node.dependencies:
+                if downstream.get(requirement, -1) < priority:
+                    downstream[requirement] = priority
+        return priorities
+
+
+def _can_add_thread(node, threads):
+    """Returns true if 'node' may be run using more than 'threads' threads."""
+    max_threads = node.thread_range[1]
+    return max_threads is None or threads < max_threads
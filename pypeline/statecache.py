@@ -0,0 +1,418 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Persistent cache of file states, used to speed up the construction of
+NodeGraphs on (network) file-systems where calls to 'stat' are expensive.
+
+File states (mtime and size) are recorded per directory, along with the mtime
+of the directory itself. Since the pipeline only ever creates, removes, or
+moves files (which updates the mtime of the containing directory), file states
+recorded for a directory whose mtime is unchanged are re-used without having
+to stat the files themselves. Note that changes made to files in-place (e.g.
+manually editing a file) is not detected in this manner.
+
+In addition, the cache records which nodes were DONE, identified by a
+signature derived from their input / output files. If the cache is trusted
+(see --trust-state-cache), files belonging to nodes recorded as being DONE
+are not checked at all, which allows for (almost) instant resumes of runs.
+
+Finally, the cache records the states of the final output files (e.g. BAMs
+and summary tables) of top-level nodes (e.g. targets) that were DONE. If the
+cache is trusted, such nodes are removed before the NodeGraph is built, along
+with every node that they depend on, provided that the nodes making up their
+graphs and the final output files are unchanged.
+"""
+import os
+import time
+import errno
+import hashlib
+import cPickle
+import logging
+import optparse
+
+from pypeline.node import MetaNode
+from pypeline.nodegraph import \
+    NodeGraph, \
+    FileStatusCache
+
+
+# Incremented if the structure of the cache changes
+_CACHE_VERSION = 1
+# Directories modified less than this many seconds before their state was
+# recorded are not trusted, as files may have been created / removed in the
+# same time-stamp interval (e.g. on file-systems with a resolution of 1s).
+_RACY_INTERVAL = 2.0
+
+
+def add_optiongroup(parser):
+    """Adds an option-group to an OptionParser object, with options
+    pertaining to how the states of files are determined; this includes
+    the persistent state cache and content checksums."""
+    group = optparse.OptionGroup(parser, "File states")
+    group.add_option("--state-cache", default=None,
+                     help="Record the state of files in the specified file, "
+                          "and use this to avoid re-checking files in "
+                          "folders that have not changed since the last run. "
+                          "Files changed in-place are not detected!")
+    group.add_option("--trust-state-cache", default=False,
+                     action="store_true",
+                     help="Do not check files belonging to nodes that were "
+                          "recorded as completed in the --state-cache, and "
+                          "skip completed targets entirely if their final "
+                          "output files are unchanged. This allows fast "
+                          "resumes of runs, but changes to the these files "
+                          "will not be detected!")
+    group.add_option("--content-checksums", default=False,
+                     action="store_true",
+                     help="Record checksums of input / output files once a "
+                          "task has finished, and use these rather than "
+                          "time-stamps to determine if tasks are outdated. "
+                          "Useful if time-stamps are unreliable, e.g. after "
+                          "restoring files from backups.")
+    parser.add_option_group(group)
+
+
+def node_signature(node):
+    """Returns a signature identifying a node based on its class and its
+    input / output files; the signature changes if any of these do."""
+    hasher = hashlib.md5(node.__class__.__name__)
+    for filenames in (node.input_files, node.output_files):
+        hasher.update("\0".join(sorted(filenames)))
+        hasher.update("\1")
+    return hasher.hexdigest()
+
+
+def graph_signature(node):
+    """Returns a signature identifying the graph of nodes made up by a node
+    and its (direct and indirect) dependencies / subnodes; the signature
+    changes if the signature of any (non-Meta) node changes."""
+    signatures = [node_signature(child) for child in _iter_nodes((node,))
+                  if not isinstance(child, MetaNode)]
+
+    hasher = hashlib.md5()
+    for signature in sorted(signatures):
+        hasher.update(signature)
+    return hasher.hexdigest()
+
+
+class StateCache(object):
+    """Persistent cache of file states and completed nodes.
+
+    The object acts as a 'cache_factory' for NodeGraph, and must be registered
+    as a state observer (see NodeGraph.add_state_observer) in order to keep
+    track of nodes that are DONE, or which are about to change their output
+    files (RUNNING). Call 'save' to write the cache to disk."""
+
+    def __init__(self, filename, trusted=False):
+        self._filename = filename
+        self._trusted = trusted
+        self._logger = logging.getLogger(__name__)
+        # Dict of dirpath -> [dir_mtime, check_time, {basename -> state}]
+        self._dirs = {}
+        # Set of signatures of nodes that were DONE
+        self._done = set()
+        # Dict of graph signatures of top-level nodes that were DONE ->
+        # {final output file -> state}
+        self._completed = {}
+        # Set of files that may be looked up without validation
+        self._trusted_files = frozenset()
+        # Dict of top-level nodes not yet DONE -> (top-level nodes, set of
+        # these not yet DONE); see 'record_on_completion'
+        self._pending = {}
+
+        self._load()
+
+    def validate(self, nodes):
+        """Determines which files may be trusted, based on the nodes recorded
+        as DONE; files belonging to nodes for which the signature has changed
+        are never trusted. Nodes is a list of top-level nodes."""
+        trusted_files = set()
+        if self._trusted:
+            for node in _iter_nodes(nodes):
+                if node_signature(node) in self._done:
+                    trusted_files.update(node.input_files)
+                    trusted_files.update(node.output_files)
+        self._trusted_files = frozenset(trusted_files)
+
+    def remove_completed(self, nodes):
+        """Returns a list of the top-level nodes in 'nodes', excluding nodes
+        recorded as DONE (see 'record_completed') for which the final output
+        files are unchanged; such nodes, and the nodes they depend on, need
+        not be checked at all. Nodes are only removed if the cache is
+        trusted."""
+        if not (self._trusted and self._completed):
+            return list(nodes)
+
+        remaining = []
+        for node in nodes:
+            states = self._completed.get(graph_signature(node))
+            if states is None or any(_stat(fpath) != state
+                                     for (fpath, state) in states.iteritems()):
+                remaining.append(node)
+        return remaining
+
+    def record_completed(self, nodegraph, nodes):
+        """Records which of the top-level nodes in 'nodes' are DONE, along with
+        the states of their final output files, allowing these nodes to be
+        removed by 'remove_completed' in subsequent runs. Nodes no longer in
+        the graph are assumed to have been removed (pruned) once DONE."""
+        for node in nodes:
+            if node not in nodegraph \
+                    or nodegraph.get_node_state(node) == NodeGraph.DONE:
+                self._record_completed(node)
+            else:
+                self._completed.pop(graph_signature(node), None)
+
+    def record_on_completion(self, nodegraph, nodes):
+        """As 'record_completed', except that the top-level nodes in 'nodes'
+        are recorded once every one of these is DONE, as observed by the
+        cache. This is used for nodes added to the graph while the pipeline
+        is running (see Pypeline.add_lazy_nodes)."""
+        nodes = tuple(nodes)
+        remaining = set(node for node in nodes
+                        if node in nodegraph
+                        and nodegraph.get_node_state(node) != NodeGraph.DONE)
+
+        if remaining:
+            batch = (nodes, remaining)
+            for node in remaining:
+                self._pending[node] = batch
+                # Not (or no longer) completed
+                self._completed.pop(graph_signature(node), None)
+        else:
+            self.record_completed(nodegraph, nodes)
+
+    def save(self):
+        """Writes the cache to disk, replacing any existing cache."""
+        cache = {"version": _CACHE_VERSION,
+                 "dirs": self._dirs,
+                 "done": self._done,
+                 "completed": self._completed}
+
+        temp_filename = "%s.%i.tmp" % (self._filename, os.getpid())
+        try:
+            with open(temp_filename, "wb") as handle:
+                cPickle.dump(cache, handle, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_filename, self._filename)
+        except (OSError, IOError), error:
+            self._logger.warning("Could not write state cache %r: %s",
+                                 self._filename, error)
+            return False
+        return True
+
+    def __call__(self):
+        """Returns a new FileStatusCache backed by the persistent cache."""
+        return _CachedFileStatusCache(self)
+
+    def refresh(self, nodegraph):
+        """See NodeGraph.add_state_observer."""
+        self.nodes_added(nodegraph, nodegraph.iterflat())
+
+    def nodes_added(self, nodegraph, nodes):
+        """See NodeGraph.add_state_observer."""
+        for node in nodes:
+            if not isinstance(node, MetaNode):
+                signature = node_signature(node)
+                if nodegraph.get_node_state(node) == NodeGraph.DONE:
+                    self._done.add(signature)
+                else:
+                    self._done.discard(signature)
+
+    def state_changed(self, node, _old_state, new_state, _is_primary):
+        """See NodeGraph.add_state_observer."""
+        if new_state == NodeGraph.DONE and node in self._pending:
+            batch = self._pending.pop(node)
+            batch[1].discard(node)
+            if not batch[1]:
+                for top_node in batch[0]:
+                    self._record_completed(top_node)
+
+        if isinstance(node, MetaNode):
+            return
+
+        signature = node_signature(node)
+        if new_state == NodeGraph.DONE:
+            self._done.add(signature)
+        elif new_state == NodeGraph.RUNNING:
+            # Output files are about to change; forget everything about them
+            self._done.discard(signature)
+            if node.output_files & self._trusted_files:
+                self._trusted_files = self._trusted_files - node.output_files
+            for fpath in node.output_files:
+                self._forget(fpath)
+
+    def lookup(self, fpath, checked_dirs):
+        """Returns the (cached) state of a file; 'checked_dirs' is the set of
+        directories that have been validated by the calling cache."""
+        dirpath, basename = os.path.split(fpath)
+        record = self._dirs.get(dirpath)
+        if record is not None and fpath in self._trusted_files:
+            if basename in record[2]:
+                return record[2][basename]
+
+        if dirpath not in checked_dirs:
+            checked_dirs.add(dirpath)
+            record = self._check_dir(dirpath, record)
+
+        files = record[2]
+        if basename not in files:
+            files[basename] = _stat(fpath)
+        return files[basename]
+
+    def _check_dir(self, dirpath, record):
+        """Stats a directory, and resets the recorded file states for that
+        directory if it has changed since these were recorded."""
+        check_time = time.time()
+        dir_state = _stat(dirpath or ".")
+        dir_mtime = dir_state[0] if dir_state else None
+
+        if record is not None and record[0] == dir_mtime \
+                and dir_mtime is not None \
+                and (record[1] - dir_mtime) >= _RACY_INTERVAL:
+            return record
+
+        record = [dir_mtime, check_time, {}]
+        self._dirs[dirpath] = record
+        return record
+
+    def _record_completed(self, node):
+        """Records the states of the final output files of a DONE node."""
+        signature = graph_signature(node)
+        states = dict((fpath, _stat(fpath))
+                      for fpath in _final_output_files(node))
+        if all(states.itervalues()):
+            self._completed[signature] = states
+        else:
+            self._completed.pop(signature, None)
+
+    def _forget(self, fpath):
+        dirpath, basename = os.path.split(fpath)
+        record = self._dirs.get(dirpath)
+        if record is not None:
+            record[2].pop(basename, None)
+
+    def _load(self):
+        try:
+            with open(self._filename, "rb") as handle:
+                cache = cPickle.load(handle)
+        except IOError, error:
+            if error.errno != errno.ENOENT:
+                self._logger.warning("Could not read state cache %r: %s",
+                                     self._filename, error)
+            return
+        except (cPickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, IndexError), error:
+            self._logger.warning("State cache %r is corrupt, ignoring: %s",
+                                 self._filename, error)
+            return
+
+        if not isinstance(cache, dict) \
+                or cache.get("version") != _CACHE_VERSION:
+            self._logger.warning("State cache %r was written by a different "
+                                 "version of the pipeline, ignoring ...",
+                                 self._filename)
+            return
+
+        self._dirs = cache["dirs"]
+        self._done = cache["done"]
+        # Not recorded by earlier versions of the pipeline
+        self._completed = cache.get("completed", {})
+
+
+class _CachedFileStatusCache(FileStatusCache):
+    """FileStatusCache using a StateCache to look up file states. As with the
+    FileStatusCache, directories are only validated once per instance."""
+
+    def __init__(self, state_cache):
+        FileStatusCache.__init__(self)
+        self._state_cache = state_cache
+        self._checked_dirs = set()
+
+    def _get_state(self, fpath):
+        """See FileStatusCache._get_state."""
+        if fpath not in self._stat_cache:
+            self._stat_cache[fpath] = self._lookup(fpath)
+        return self._stat_cache[fpath]
+
+    def _prefetch_dir(self, item):
+        """See FileStatusCache._prefetch_dir."""
+        _, fpaths = item
+        return dict((fpath, self._lookup(fpath)) for fpath in fpaths)
+
+    def _lookup(self, fpath):
+        state = self._state_cache.lookup(fpath, self._checked_dirs)
+        return state[0] if state else None
+
+
+def _stat(fpath):
+    """Returns a tuple of (mtime, size) for a path, or None if the path does
+    not exist."""
+    try:
+        stat = os.stat(fpath)
+    except OSError, error:
+        if error.errno != errno.ENOENT:
+            raise
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _iter_nodes(nodes):
+    """Yields every node in a graph exactly once, without recursion."""
+    observed = set(nodes)
+    queue = list(observed)
+    while queue:
+        node = queue.pop()
+        yield node
+        for child in node.subnodes | node.dependencies:
+            if child not in observed:
+                observed.add(child)
+                queue.append(child)
+
+
+def _final_output_files(node):
+    """Returns the output files of the (non-Meta) nodes in the graph of a
+    node, which no other (non-Meta) nodes in the graph depend upon."""
+    nodes = [child for child in _iter_nodes((node,))
+             if not isinstance(child, MetaNode)]
+
+    required = set()
+    for child in nodes:
+        # MetaNodes are transparent; nodes depending on a MetaNode depend
+        # on the subnodes / dependencies of the MetaNode.
+        queue = list(child.subnodes | child.dependencies)
+        observed = set(queue)
+        while queue:
+            requirement = queue.pop()
+            if isinstance(requirement, MetaNode):
+                for grandchild in requirement.subnodes | \
+                        requirement.dependencies:
+                    if grandchild not in observed:
+                        observed.add(grandchild)
+                        queue.append(grandchild)
+            else:
+                required.add(requirement)
+
+    output_files = set()
+    for child in nodes:
+        if child not in required:
+            output_files.update(child.output_files)
+    return output_files
@@ -24,11 +24,17 @@ import optparse
 
 import pypeline
 import pypeline.ui
+import pypeline.metrics
+import pypeline.profiling
+import pypeline.statecache
+import pypeline.executors.batch
+import pypeline.executors.remote
 
 from pypeline.config import \
      ConfigError, \
      PerHostValue, \
-     PerHostConfig
+     PerHostConfig, \
+     parse_memory_limit
 
 
 _TARGETS_BY_NAME = ("targets", "prefixes", "samples", "libraries",
@@ -50,14 +56,46 @@ def _run_config_parser(argv):
                                 ui_default=PerHostValue("quiet"),
                                 color_default=PerHostValue("on"))
     pypeline.logger.add_optiongroup(parser, default = PerHostValue("warning"))
+    pypeline.statecache.add_optiongroup(parser)
+    pypeline.profiling.add_optiongroup(parser)
+    pypeline.executors.remote.add_optiongroup(parser, per_host_cfg.remote_secret)
+    pypeline.executors.batch.add_optiongroup(parser)
+    pypeline.metrics.add_optiongroup(parser)
 
     group  = optparse.OptionGroup(parser, "Scheduling")
     group.add_option("--bowtie2-max-threads", type = int, default = PerHostValue(1),
                      help = "Maximum number of threads to use per BWA instance [%default]")
     group.add_option("--bwa-max-threads", type = int, default = PerHostValue(1),
                      help = "Maximum number of threads to use per BWA instance [%default]")
+    group.add_option("--statistics-max-threads", type = int, default = PerHostValue(1),
+                     help = "Maximum number of threads to use per coverage / depth "
+                            "histogram instance; indexed BAMs are split into regions "
+                            "processed in parallel [%default]")
     group.add_option("--max-threads", type = int, default = per_host_cfg.max_threads,
                      help = "Maximum number of threads to use in total [%default]")
+    group.add_option("--max-memory", default = per_host_cfg.max_memory,
+                     help = "Maximum amount of memory to be used by running tasks, "
+                            "e.g. '64g'; 'auto' uses the amount of physical memory, "
+                            "while 'none' disables this limit [%default]")
+    group.add_option("--runtime-db", default = per_host_cfg.runtime_db,
+                     help = "SQLite database in which the runtimes of tasks are "
+                            "recorded, and which is used to estimate runtimes; "
+                            "'none' disables this database [%default]")
+    group.add_option("--version-cache", default = per_host_cfg.version_cache,
+                     help = "File in which the results of version checks are "
+                            "cached, until the programs in question change; "
+                            "'none' disables this cache [%default]")
+    group.add_option("--adaptive-threads", action = "store_true", default = False,
+                     help = "Choose the number of threads used by each BWA (mem / bwasw) "
+                            "or Bowtie2 instance when it is started, rather than using "
+                            "--bwa-max-threads / --bowtie2-max-threads: fewer threads "
+                            "are used if not enough threads are idle, and idle "
+                            "threads are used once no other tasks are waiting.")
+    group.add_option("--lazy-targets", action = "store_true", default = False,
+                     help = "Build the tasks for each target only once the pipeline "
+                            "runs out of other tasks to run, and discard completed "
+                            "tasks from memory; this greatly reduces the startup "
+                            "time and memory usage for makefiles with many targets.")
     group.add_option("--dry-run", action = "store_true", default = False,
                      help = "If passed, only a dry-run in performed, the dependency "
                             "tree is printed, and no tasks are executed.")
@@ -115,6 +153,14 @@ def parse_config(argv):
 
     if config.list_output_files and config.list_orphan_files:
         raise ConfigError("ERROR: Both --list-output-files and --list-orphan-files set!")
+    elif config.trust_state_cache and not config.state_cache:
+        raise ConfigError("ERROR: --trust-state-cache requires --state-cache!")
+
+    config.max_memory = parse_memory_limit(config.max_memory)
+    if config.runtime_db.lower() == "none":
+        config.runtime_db = None
+    if config.version_cache.lower() == "none":
+        config.version_cache = None
 
     return config, args
 
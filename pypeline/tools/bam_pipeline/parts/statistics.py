@@ -31,7 +31,8 @@ from pypeline.node import \
 from pypeline.nodes.paleomix import \
     CoverageNode, \
     MergeCoverageNode, \
-    DepthHistogramNode
+    DepthHistogramNode, \
+    BAMStatisticsNode
 from pypeline.tools.bam_pipeline.parts.summary import \
     SummaryTableNode
 
@@ -41,13 +42,21 @@ def add_statistics_nodes(config, makefile, target):
     if not features & set(("Coverage", "Depths", "Summary")):
         return
 
+    # Coverage and depths for entire prefixes are collected in a single pass
+    # over the library BAMs, unless per-lane / per-library coverage is needed
+    # (Summary, enabled by default). Duplicate histograms are not included,
+    # since these are collected from the lane BAMs (see parts/library.py).
+    combined = features.issuperset(("Coverage", "Depths")) \
+        and "Summary" not in features
+
     nodes = []
     if "Depths" in features:
-        nodes.append(_build_depth(config, target))
+        nodes.append(_build_depth(config, target, with_coverage=combined))
 
     if "Summary" in features or "Coverage" in features:
         make_summary = ("Summary" in features)
-        coverage = _build_coverage(config, target, make_summary)
+        coverage = _build_coverage(config, target, make_summary,
+                                   include_genome=not combined)
         if make_summary:
             summary_node = _build_summary_node(config, makefile,
                                                target, coverage)
@@ -69,7 +78,7 @@ def _build_summary_node(config, makefile, target, coverage):
                             dependencies=coverage["Node"])
 
 
-def _build_depth(config, target):
+def _build_depth(config, target, with_coverage=False):
     nodes = []
     for prefix in target.prefixes:
         for (roi_name, roi_filename) in _get_roi(prefix, name_prefix="."):
@@ -90,12 +99,27 @@ def _build_depth(config, target):
                                                   roi_name)
             output_fpath = os.path.join(config.destination, output_filename)
 
-            node = DepthHistogramNode(config=config,
-                                      target_name=target.name,
-                                      input_files=input_files,
-                                      regions_file=roi_filename,
-                                      output_file=output_fpath,
-                                      dependencies=dependencies)
+            threads = config.statistics_max_threads
+            if with_coverage and roi_filename is None:
+                coverage_fpath = os.path.join(config.destination,
+                                              "%s.%s.coverage"
+                                              % (target.name, prefix.name))
+
+                node = BAMStatisticsNode(config=config,
+                                         target_name=target.name,
+                                         input_files=input_files,
+                                         coverage_file=coverage_fpath,
+                                         depths_file=output_fpath,
+                                         threads=threads,
+                                         dependencies=dependencies)
+            else:
+                node = DepthHistogramNode(config=config,
+                                          target_name=target.name,
+                                          input_files=input_files,
+                                          regions_file=roi_filename,
+                                          output_file=output_fpath,
+                                          threads=threads,
+                                          dependencies=dependencies)
             nodes.append(node)
 
     return MetaNode(description="DepthHistograms",
@@ -111,11 +135,12 @@ def _aggregate_for_prefix(cov, prefix, roi_name=None, into=None):
     return results
 
 
-def _build_coverage(config, target, make_summary):
+def _build_coverage(config, target, make_summary, include_genome=True):
     merged_nodes = []
-    coverage = _build_coverage_nodes(config, target)
+    coverage = _build_coverage_nodes(config, target,
+                                     include_genome=include_genome)
     for prefix in target.prefixes:
-        for (roi_name, _) in _get_roi(prefix):
+        for (roi_name, _) in _get_roi(prefix, include_genome=include_genome):
             label = _get_prefix_label(prefix.name, roi_name)
             if not roi_name:
                 postfix = prefix.name
@@ -151,13 +176,15 @@ def _build_coverage(config, target, make_summary):
     return coverage
 
 
-def _build_coverage_nodes(config, target, use_label=False):
+def _build_coverage_nodes(config, target, use_label=False,
+                          include_genome=True):
     coverage = {"Lanes": collections.defaultdict(dict),
                 "Libraries": collections.defaultdict(dict)}
 
     cache = {}
     for prefix in target.prefixes:
-        for (roi_name, roi_filename) in _get_roi(prefix):
+        rois = _get_roi(prefix, include_genome=include_genome)
+        for (roi_name, roi_filename) in rois:
             prefix_label = prefix.label if use_label else prefix.name
             prefix_label = _get_prefix_label(prefix_label, roi_name)
 
@@ -189,6 +216,8 @@ def _build_coverage_nodes_cached(config, files_and_nodes, target_name,
     if roi_name:
         output_ext = ".%s.coverage" % roi_name
 
+    threads = config.statistics_max_threads
+
     coverages = {}
     for (input_filename, node) in files_and_nodes.iteritems():
         output_filename = swap_ext(input_filename, output_ext)
@@ -200,14 +229,15 @@ def _build_coverage_nodes_cached(config, files_and_nodes, target_name,
                                             output_file=output_filename,
                                             target_name=target_name,
                                             regions_file=roi_filename,
+                                            threads=threads,
                                             dependencies=node)
 
         coverages[output_filename] = cache[cache_key]
     return coverages
 
 
-def _get_roi(prefix, name_prefix=""):
-    roi = [("", None)]
+def _get_roi(prefix, name_prefix="", include_genome=True):
+    roi = [("", None)] if include_genome else []
     for (name, path) in prefix.roi.iteritems():
         roi.append((name_prefix + name, path))
     return roi
@@ -34,7 +34,9 @@ from pypeline.node import Node
 from pypeline.common.utilities import safe_coerce_to_tuple, set_in, get_in
 from pypeline.common.fileutils import move_file, reroot_path
 from pypeline.tools.bam_stats.coverage import \
-    read_table as read_coverage_table
+    read_counts as read_coverage_counts
+from pypeline.tools.bam_stats.rawcounts import \
+    sidecar_filename
 
 import pypeline.common.text as text
 
@@ -56,6 +58,8 @@ class SummaryTableNode(Node):
         input_files = set()
         input_files.update(sum(map(list, self._in_raw_bams.values()), []))
         input_files.update(sum(map(list, self._in_lib_bams.values()), []))
+        # Coverage is read from the raw counts written alongside each table
+        input_files = set(map(sidecar_filename, input_files))
 
         self._in_raw_read = collections.defaultdict(list)
         for prefix in target.prefixes:
@@ -271,7 +275,7 @@ class SummaryTableNode(Node):
         hits = nts = 0
         for filename in filenames:
             subtable = {}
-            read_coverage_table(subtable, filename)
+            read_coverage_counts(subtable, sidecar_filename(filename))
             for contigtable in get_in(subtable, key).itervalues():
                 hits += contigtable["Hits"]
                 nts += contigtable["M"]
@@ -29,13 +29,18 @@ import logging
 import pypeline
 import pypeline.yaml
 import pypeline.logger
+import pypeline.profiling
+import pypeline.executors
 
 from pypeline.common.console import \
     print_err, \
     print_info
 
+from pypeline.executors.base import ExecutorError
 from pypeline.pipeline import \
     Pypeline
+from pypeline.checksums import \
+    is_manifest
 from pypeline.node import \
     MetaNode
 from pypeline.nodes.picard import \
@@ -82,39 +87,69 @@ def build_pipeline_trimming(config, makefile):
     return nodes
 
 
-def build_pipeline_full(config, makefile, return_nodes = True):
-    targets = []
+def _build_target(config, makefile, target_name, sample_records):
     features = makefile["Options"]["Features"]
-    for (target_name, sample_records) in makefile["Targets"].iteritems():
-        prefixes = []
-        for (_, prefix) in makefile["Prefixes"].iteritems():
-            samples = []
-            for (sample_name, library_records) in sample_records.iteritems():
-                libraries = []
-                for (library_name, barcode_records) in library_records.iteritems():
-                    lanes = []
-                    for (barcode, record) in barcode_records.iteritems():
-                        lanes.append(parts.Lane(config, prefix, record, barcode))
+    prefixes = []
+    for (_, prefix) in makefile["Prefixes"].iteritems():
+        samples = []
+        for (sample_name, library_records) in sample_records.iteritems():
+            libraries = []
+            for (library_name, barcode_records) in library_records.iteritems():
+                lanes = []
+                for (barcode, record) in barcode_records.iteritems():
+                    lanes.append(parts.Lane(config, prefix, record, barcode))
+
+                if any(lane.bams for lane in lanes):
+                    libraries.append(parts.Library(config, target_name, prefix, lanes, library_name))
+
+            if libraries:
+                samples.append(parts.Sample(config, prefix, libraries, sample_name))
+
+        if samples:
+            prefixes.append(parts.Prefix(config, prefix, samples, features, target_name))
 
-                    if any(lane.bams for lane in lanes):
-                        libraries.append(parts.Library(config, target_name, prefix, lanes, library_name))
+    if not prefixes:
+        return None
 
-                if libraries:
-                    samples.append(parts.Sample(config, prefix, libraries, sample_name))
+    target = parts.Target(config, prefixes, target_name)
+    _add_extra_nodes(config, makefile, [target])
 
-            if samples:
-                prefixes.append(parts.Prefix(config, prefix, samples, features, target_name))
+    return target
 
-        if prefixes:
-            targets.append(parts.Target(config, prefixes, target_name))
 
-    targets = _add_extra_nodes(config, makefile, targets)
+def build_pipeline_full(config, makefile, return_nodes = True):
+    targets = []
+    for (target_name, sample_records) in makefile["Targets"].iteritems():
+        target = _build_target(config, makefile, target_name, sample_records)
+        if target is not None:
+            targets.append(target)
+
     if not return_nodes:
         return targets
 
     return [target.node for target in targets]
 
 
+def build_pipeline_lazy(config, makefile):
+    """Returns an iterator yielding the nodes of one target at a time, which
+    are only built once requested (see Pypeline.add_lazy_nodes); the current
+    destination is used for every target."""
+    return _iter_target_nodes(config, makefile, config.destination)
+
+
+def _iter_target_nodes(config, makefile, destination):
+    for (target_name, sample_records) in makefile["Targets"].iteritems():
+        old_destination = config.destination
+        config.destination = destination
+        try:
+            target = _build_target(config, makefile, target_name, sample_records)
+        finally:
+            config.destination = old_destination
+
+        if target is not None:
+            yield [target.node]
+
+
 def _make_target_list(config, makefiles):
     target_list = {}
     for target in build_pipeline_full(config, makefiles, return_nodes = False):
@@ -229,13 +264,15 @@ def list_orphan_files(config, makefiles, pipeline):
                     for (dirpath, _, filenames) in os.walk(root_filename):
                         for filename in filenames:
                             fpath = os.path.join(dirpath, filename)
-                            files.add(os.path.abspath(fpath))
+                            if not is_manifest(fpath):
+                                files.add(os.path.abspath(fpath))
                 else:
                     files.add(os.path.abspath(root_filename))
     return (files - mkfiles) - pipeline.list_output_files()
 
 
 def run(config, args):
+    pypeline.profiling.enable_from_options(config)
     if not os.path.exists(config.temp_root):
         try:
             os.makedirs(config.temp_root)
@@ -250,7 +287,8 @@ def run(config, args):
 
     try:
         print_info("Building BAM pipeline ...", file=sys.stderr)
-        makefiles = read_makefiles(config, args)
+        with pypeline.profiling.phase("Reading makefiles"):
+            makefiles = read_makefiles(config, args)
     except (MakefileError, pypeline.yaml.YAMLError, IOError), error:
         print_err("Error reading makefiles:",
                   "\n  %s:\n   " % (error.__class__.__name__,),
@@ -263,7 +301,8 @@ def run(config, args):
     logger = logging.getLogger(__name__)
 
     # Build .fai files for reference .fasta files
-    index_references(config, makefiles)
+    with pypeline.profiling.phase("Indexing references"):
+        index_references(config, makefiles)
 
     if config.list_targets:
         logger.info("Listing targets for %s ...", config.list_targets)
@@ -284,6 +323,12 @@ def run(config, args):
         pipeline_func = build_pipeline_targets
     elif os.path.basename(sys.argv[0]) != "trim_pipeline":
         pipeline_func = build_pipeline_full
+        # Listing files / executables requires every node to be built
+        if config.lazy_targets and not (config.list_output_files
+                                        or config.list_orphan_files
+                                        or config.list_executables
+                                        or config.dot_file):
+            pipeline_func = build_pipeline_lazy
 
     pipeline = Pypeline(config)
     for makefile in makefiles:
@@ -295,7 +340,8 @@ def run(config, args):
             config.destination = os.path.dirname(filename)
 
         try:
-            nodes = pipeline_func(config, makefile)
+            with pypeline.profiling.phase("Building nodes"):
+                nodes = pipeline_func(config, makefile)
         except pypeline.node.NodeError, error:
             logger.error("Error while building pipeline for '%s':\n%s",
                          filename, error)
@@ -303,7 +349,10 @@ def run(config, args):
 
         config.destination = old_destination
 
-        pipeline.add_nodes(nodes)
+        if pipeline_func is build_pipeline_lazy:
+            pipeline.add_lazy_nodes(nodes)
+        else:
+            pipeline.add_nodes(nodes)
 
     if config.targets:
         logger.error("ERROR: Could not find --target(s): '%s'", "', '".join(config.targets))
@@ -328,10 +377,25 @@ def run(config, args):
             return 1
         return 0
 
+    try:
+        executor = pypeline.executors.executor_from_options(config)
+    except ExecutorError, error:
+        logger.error("ERROR: Could not set up executor: %s", error)
+        return 1
+
     logger.info("Running BAM pipeline ...")
     if not pipeline.run(dry_run=config.dry_run,
                         max_running=config.max_threads,
-                        progress_ui=config.progress_ui):
+                        progress_ui=config.progress_ui,
+                        state_cache=config.state_cache,
+                        trust_state_cache=config.trust_state_cache,
+                        content_checksums=config.content_checksums,
+                        max_memory=config.max_memory,
+                        runtime_db=config.runtime_db,
+                        executor=executor,
+                        version_cache=config.version_cache,
+                        metrics_address=config.metrics_address,
+                        adaptive_threads=config.adaptive_threads):
         return 1
 
     return 0
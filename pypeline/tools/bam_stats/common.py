@@ -22,13 +22,17 @@
 #
 import os
 import sys
+import signal
 import argparse
 import collections
+import multiprocessing
 
 import pysam
 
 import pypeline.common.system
 
+from pypeline.common.timer import \
+    BAMTimer
 from pypeline.common.fileutils import \
     swap_ext
 from pypeline.common.bedtools import \
@@ -36,6 +40,16 @@ from pypeline.common.bedtools import \
     read_bed_file
 
 
+# Minimum and maximum number of bases covered by each set of regions processed
+# by a worker process, when using --threads; see 'split_regions'
+_MIN_CHUNK_SIZE = 2 ** 16
+_MAX_CHUNK_SIZE = 2 ** 23
+
+
+# A region in a BAM file; either a record in a BED file or (part of) a contig
+Region = collections.namedtuple("Region", ("contig", "start", "end", "name"))
+
+
 class BAMStatsError(RuntimeError):
     pass
 
@@ -73,13 +87,83 @@ def collect_bed_regions(filename):
     regions = []
     for record in read_bed_file(filename):
         if len(record) < 4:
-            record.name = "%s*" % (record.contig,)
+            name = "%s*" % (record.contig,)
+        else:
+            name = record.name
 
-        regions.append(record)
+        regions.append(Region(record.contig, record.start, record.end, name))
 
     return regions
 
 
+def split_regions(args, handle):
+    """Splits the BAM file into lists of regions, each of which is processed
+    by a worker process when using --threads. If a regions file was given, the
+    regions in this file are distributed between lists. Otherwise, contigs are
+    split into chunks, which are named after the contig."""
+    if args.regions:
+        regions = args.regions
+    else:
+        regions = [Region(name, 0, length, name)
+                   for (name, length) in zip(handle.references,
+                                             handle.lengths)]
+
+    # Aim for several tasks per worker, to even out differences in runtime
+    chunk_size = sum((region.end - region.start) for region in regions)
+    chunk_size //= args.threads * 4
+    chunk_size = min(_MAX_CHUNK_SIZE, max(_MIN_CHUNK_SIZE, chunk_size))
+
+    chunks = []
+    chunk, chunk_length = [], 0
+    for region in regions:
+        if args.regions:
+            parts = [region]
+        else:
+            parts = [Region(region.contig, start,
+                            min(start + chunk_size, region.end),
+                            region.name)
+                     for start in xrange(region.start, region.end,
+                                         chunk_size)]
+
+        for part in parts:
+            chunk.append(part)
+            chunk_length += part.end - part.start
+            if chunk_length >= chunk_size:
+                chunks.append(chunk)
+                chunk, chunk_length = [], 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def process_regions(handle, args, process_func, merge_func):
+    """Calls 'process_func(handle, args, regions, timer)' for the regions of
+    the BAM file. If --threads is greater than 1, and the BAM file is indexed,
+    the BAM is split into sets of regions (see 'split_regions'), which are
+    processed by a pool of worker processes; the partial results are then
+    combined using 'merge_func(result, partial_result)'. Otherwise,
+    'process_func' is called once for 'args.regions' (None if not set).
+    """
+    timer = BAMTimer(handle, step=1000000)
+    if args.threads > 1:
+        if _is_indexed(args.infile):
+            result = _process_regions_in_parallel(handle, args, timer,
+                                                  process_func, merge_func)
+            timer.finalize()
+
+            return result
+
+        sys.stderr.write("WARNING: BAM file is not indexed; processing "
+                         "using a single thread.\n")
+
+    result = process_func(handle, args, args.regions, timer)
+    timer.finalize()
+
+    return result
+
+
 def parse_arguments(argv, ext):
     parser = argparse.ArgumentParser(prog="paleomix %s" % (ext.strip("."),))
 
@@ -90,6 +174,27 @@ def parse_arguments(argv, ext):
                         help="Filename of output table; defaults to name of "
                              "the input BAM with a '.depths' extension. If "
                              "set to '-' the table is printed to STDOUT.")
+    parser.add_argument("--raw-counts", default=None, metavar="FILE",
+                        help="Also write the counts from which the table is "
+                             "built to FILE, as a NumPy (.npz) archive. "
+                             "Unlike the text table, these may be summed to "
+                             "build tables for combined data.")
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if not args.outfile:
+        args.outfile = swap_ext(args.infile, ext)
+
+    outfiles = [args.outfile]
+    if args.raw_counts:
+        outfiles.append(args.raw_counts)
+
+    return process_arguments(parser, args, outfiles)
+
+
+def add_arguments(parser):
+    """Adds the options shared by BAM statistics tools to an argparse
+    parser; see 'process_arguments'."""
     parser.add_argument("--target-name", default=None,
                         help="Name used for 'Target' column; defaults to the "
                              "filename of the BAM file.")
@@ -110,15 +215,25 @@ def parse_arguments(argv, ext):
                              "provide aggreaged statistics; this is required "
                              "if readgroup information is missing or partial "
                              "[default: %(default)s]")
+    parser.add_argument('--threads', default=1, type=int,
+                        help="Number of processes used to process the BAM; "
+                             "if greater than 1, the BAM is split into "
+                             "regions that are processed in parallel. This "
+                             "requires that the BAM file is indexed "
+                             "[default: %(default)s]")
     parser.add_argument('--overwrite-output',
                         default=False, action="store_true",
                         help="Overwrite output file if it it exists; by "
                              "default, the script will terminate if the file "
                              "already exists.")
 
-    args = parser.parse_args(argv)
-    if not args.outfile:
-        args.outfile = swap_ext(args.infile, ext)
+
+def process_arguments(parser, args, outfiles):
+    """Validates and sets up the options added by 'add_arguments'; errors are
+    reported using 'parser.error'. Returns the arguments."""
+    if args.threads < 1:
+        parser.error("--threads must be 1 or greater, not %i"
+                     % (args.threads,))
 
     if args.ignore_readgroups:
         args.get_readgroup_func = _get_readgroup_ignored
@@ -131,24 +246,99 @@ def parse_arguments(argv, ext):
         else:
             args.target_name = os.path.basename(args.infile)
 
-    if os.path.exists(args.outfile) and not args.overwrite_output:
-        parser.error("Destination filename already exists (%r); use option "
-                     "--overwrite-output to allow overwriting of this file."
-                     % (args.outfile,))
+    for outfile in outfiles:
+        if os.path.exists(outfile) and not args.overwrite_output:
+            parser.error("Destination filename already exists (%r); use "
+                         "option --overwrite-output to allow overwriting of "
+                         "this file." % (outfile,))
 
     return args
 
 
 def main_wrapper(process_func, argv, ext):
-    args = parse_arguments(argv, ext)
+    return run_wrapper(process_func, parse_arguments(argv, ext))
+
+
+def run_wrapper(process_func, args):
+    """Opens the BAM file specified in 'args', and calls 'process_func' with
+    the handle and the arguments. Errors (BAMStatsError) are reported to
+    STDERR, in which case 1 is returned."""
     args.regions = None
     if args.regions_fpath:
         args.regions = collect_bed_regions(args.regions_fpath)
 
     sys.stderr.write("Opening %r\n" % (args.infile,))
+    try:
+        with pysam.Samfile(args.infile) as handle:
+            sort_bed_by_bamfile(handle, args.regions)
+            return process_func(handle, args)
+    except BAMStatsError, error:
+        sys.stderr.write("ERROR: %s\n" % (error,))
+        return 1
+
+
+def _is_indexed(filename):
+    """Returns true if a BAM index (.bam.bai or .bai) exists for the file."""
+    if filename == "-":
+        return False
+
+    return os.path.exists(filename + ".bai") \
+        or os.path.exists(swap_ext(filename, ".bai"))
+
+
+def _process_regions_in_parallel(handle, args, timer, process_func,
+                                 merge_func):
+    tasks = [(process_func, args, regions)
+             for regions in split_regions(args, handle)]
+
+    result = None
+    pool = multiprocessing.Pool(min(args.threads, len(tasks)), _init_worker)
+    try:
+        for (count, partial) in pool.imap_unordered(_call_process_func,
+                                                    tasks):
+            timer.increment(count)
+            if result is None:
+                result = partial
+            else:
+                result = merge_func(result, partial)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return result
+
+
+def _init_worker():
+    """Ensures that KeyboardInterrupts only occur in the main process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call_process_func(task):
+    """Calls 'process_func' for a set of regions in a worker process; returns
+    a tuple of the number of records processed, and the (partial) result."""
+    process_func, args, regions = task
+    counter = _RecordCounter()
     with pysam.Samfile(args.infile) as handle:
-        sort_bed_by_bamfile(handle, args.regions)
-        return process_func(handle, args)
+        result = process_func(handle, args, regions, counter)
+
+    return counter.count, result
+
+
+class _RecordCounter(object):
+    """Counts the records processed by a worker process; progress is
+    reported by the main process (see '_process_regions_in_parallel')."""
+
+    def __init__(self):
+        self.count = 0
+
+    def increment(self, count=1, read=None):
+        self.count += count
+        return self
+
+    def finalize(self):
+        pass
 
 
 def _get_readgroup(record):
@@ -34,6 +34,8 @@ from pypeline.common.text import \
 from pypeline.tools.bam_stats.common import \
     BAMStatsError
 
+import pypeline.tools.bam_stats.rawcounts as rawcounts
+
 
 ##############################################################################
 ##############################################################################
@@ -42,6 +44,11 @@ from pypeline.tools.bam_stats.common import \
 READGROUP_TEMPLATE = {"SE": 0, "PE_1": 0, "PE_2": 0, "Collapsed": 0,
                       "Hits": 0, "M": 0, "I": 0, "D": 0, "Size": 0}
 
+# Columns of raw counts files (see 'rawcounts'); the number of hits is not
+# stored, but calculated from the number of SE, PE, and collapsed reads
+_KEY_FIELDS = ("Name", "Sample", "Library", "Contig")
+_COUNT_FIELDS = ("Size", "SE", "PE_1", "PE_2", "Collapsed", "M", "I", "D")
+
 
 # Header prepended to output tables
 TABLE_HEADER = """# Timestamp: %s
@@ -129,22 +136,42 @@ def read_table(table, filename):
         for record in parse_padded_table(table_file):
             key = (record["Name"], record["Sample"],
                    record["Library"], record["Contig"])
-            if "*" in key:
-                continue
+            _add_record(table, key, record)
 
-            subtable = get_in(table, key)
-            if subtable is None:
-                subtable = dict(READGROUP_TEMPLATE)
-                subtable["Size"] = int(record["Size"])
-                set_in(table, key, subtable)
 
-            assert int(subtable["Size"]) == int(record["Size"])
-            for key in READGROUP_TEMPLATE:
-                if key != "Size":
-                    subtable[key] += int(record.get(key, 0))
+def read_counts(table, filename):
+    """Adds the raw counts in 'filename' (see 'write_table') to 'table'; the
+    result is the same as when using 'read_table' on the text table."""
+    count_fields, rows = rawcounts.read_counts(filename, _KEY_FIELDS)
+    for (key, counts) in rows:
+        record = dict(zip(count_fields, counts))
+        record["Hits"] = record["SE"] + record["PE_1"] \
+            + record["PE_2"] + record["Collapsed"]
+
+        _add_record(table, key, record)
 
 
-def write_table(table, filename):
+def write_counts(table, filename):
+    """Writes the raw counts in 'table', excluding totals, to 'filename'."""
+    rows = []
+    for (name, samples) in sorted(table.items()):
+        for (sample, libraries) in sorted(samples.items()):
+            for (library, contigs) in sorted(libraries.items()):
+                for (contig, subtable) in sorted(contigs.items()):
+                    key = (name, sample, library, contig)
+                    if "*" not in key:
+                        counts = [subtable[field] for field in _COUNT_FIELDS]
+                        rows.append((key, counts))
+
+    rawcounts.write_counts(filename, _KEY_FIELDS, _COUNT_FIELDS, rows)
+
+
+def write_table(table, filename, counts_filename=None):
+    """Writes 'table' to 'filename' as a text table, and the raw counts to
+    'counts_filename' if set (see 'write_counts')."""
+    if counts_filename is not None:
+        write_counts(table, counts_filename)
+
     table = calculate_totals(table)
     rows = build_rows(table)
 
@@ -163,6 +190,22 @@ def write_table(table, filename):
             output_handle.close()
 
 
+def _add_record(table, key, record):
+    if "*" in key:
+        return
+
+    subtable = get_in(table, key)
+    if subtable is None:
+        subtable = dict(READGROUP_TEMPLATE)
+        subtable["Size"] = int(record["Size"])
+        set_in(table, key, subtable)
+
+    assert int(subtable["Size"]) == int(record["Size"])
+    for key in READGROUP_TEMPLATE:
+        if key != "Size":
+            subtable[key] += int(record.get(key, 0))
+
+
 def _calculate_totals_in(tables, lengths):
     def _defaults():
         return dict(READGROUP_TEMPLATE)
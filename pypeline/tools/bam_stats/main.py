@@ -0,0 +1,152 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Collects several statistics from a BAM file in a single pass.
+
+'paleomix bam_stats' produces the same tables as 'paleomix coverage',
+'paleomix depths', and 'paleomix duphist', as well as a histogram of insert
+sizes, for any combination of these, while only reading the BAM file once.
+"""
+import sys
+import argparse
+import collections
+
+from pypeline.tools.bam_stats.common import \
+    add_arguments, \
+    process_arguments, \
+    run_wrapper
+from pypeline.tools.bam_stats.scanner import \
+    Accumulator, \
+    scan_file
+
+import pypeline.tools.coverage as coverage
+import pypeline.tools.depths as depths
+import pypeline.tools.duphist as duphist
+
+
+class InsertSizeAccumulator(Accumulator):
+    """Collects a histogram of insert sizes, using the template length of
+    proper pairs (counted once per pair), and the alignment length of
+    collapsed reads; the result is a dict of {insert size: count}."""
+
+    def __init__(self, args, handle):
+        Accumulator.__init__(self, args, handle)
+        self._counts = collections.defaultdict(int)
+
+    def process_records(self, position, records):
+        counts = self._counts
+        for record in records:
+            if record.is_paired:
+                if record.is_proper_pair and record.is_read1:
+                    counts[abs(record.tlen)] += 1
+            elif record.qname.startswith("M_"):
+                counts[record.alen] += 1
+
+    def finalize(self):
+        return self._counts
+
+    @classmethod
+    def merge(cls, result, partial):
+        for (key, count) in partial.iteritems():
+            result[key] += count
+        return result
+
+
+def _write_coverage(args, handle, counts, filename):
+    coverage.print_table(args, handle, counts, filename)
+
+
+def _write_depths(args, handle, totals, filename):
+    depths.print_table(handle, args, totals, filename)
+
+
+def _write_histogram(_args, _handle, counts, filename):
+    if filename == "-":
+        duphist.write_histogram(counts, sys.stdout)
+    else:
+        with open(filename, "w") as output_handle:
+            duphist.write_histogram(counts, output_handle)
+
+
+# Statistics that may be collected, as tuples of (option name, accumulator,
+# function used to write the results to a file)
+_STATISTICS = (
+    ("coverage", coverage.CoverageAccumulator, _write_coverage),
+    ("depths", depths.DepthHistogramAccumulator, _write_depths),
+    ("duphist", duphist.DuplicateHistogramAccumulator, _write_histogram),
+    ("insert_sizes", InsertSizeAccumulator, _write_histogram),
+)
+
+
+def process_file(handle, args):
+    statistics = [(accumulator, write_func, getattr(args, key))
+                  for (key, accumulator, write_func) in _STATISTICS
+                  if getattr(args, key)]
+
+    args.accumulators = tuple(accumulator for (accumulator, _, _)
+                              in statistics)
+    results = scan_file(handle, args)
+
+    for ((_, write_func, filename), result) in zip(statistics, results):
+        write_func(args, handle, result, filename)
+
+    return 0
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="paleomix bam_stats")
+    parser.add_argument("infile", metavar="BAM",
+                        help="Filename of a sorted BAM file. If set to '-' "
+                             "the file is read from STDIN.")
+    parser.add_argument("--coverage", default=None, metavar="FILE",
+                        help="Write table of hits and coverage (as produced "
+                             "by 'paleomix coverage') to FILE.")
+    parser.add_argument("--depths", default=None, metavar="FILE",
+                        help="Write depth histograms (as produced by "
+                             "'paleomix depths') to FILE.")
+    parser.add_argument("--duphist", default=None, metavar="FILE",
+                        help="Write histogram of PCR duplicates (as produced "
+                             "by 'paleomix duphist') to FILE.")
+    parser.add_argument("--insert-sizes", default=None, metavar="FILE",
+                        help="Write histogram of insert sizes of proper "
+                             "pairs and collapsed reads to FILE.")
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    outfiles = [getattr(args, key) for (key, _, _) in _STATISTICS
+                if getattr(args, key)]
+    if not outfiles:
+        parser.error("No output files specified; at least one of --coverage, "
+                     "--depths, --duphist, or --insert-sizes is required.")
+    elif args.regions_fpath and (args.duphist or args.insert_sizes):
+        parser.error("--duphist and --insert-sizes cannot be used with "
+                     "--regions-file.")
+
+    return process_arguments(parser, args, outfiles)
+
+
+def main(argv):
+    return run_wrapper(process_file, parse_arguments(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Raw counts underlying the coverage and depth-histogram tables.
+
+The text tables written by 'paleomix coverage' and 'paleomix depths' contain
+derived and rounded values, and are costly to re-parse. The counts from which
+these tables are built are therefore (optionally) also written as compressed
+NumPy archives, containing the following arrays:
+
+  key_fields   -- Names of the columns identifying each row,
+                  e.g. ("Name", "Sample", "Library", "Contig").
+  keys         -- Array of strings with shape (rows, len(key_fields)).
+  count_fields -- Names of the columns containing counts.
+  counts       -- Array of int64 with shape (rows, len(count_fields)).
+
+Tables for combined data may be built by summing the counts in such files,
+without re-reading BAM files (see e.g. MergeCoverageNode).
+"""
+import numpy
+
+
+def sidecar_filename(filename):
+    """Returns the filename of the raw counts written alongside a table."""
+    return filename + ".npz"
+
+
+def write_counts(filename, key_fields, count_fields, rows):
+    """Writes a list of rows (key, counts) to 'filename', where 'key' is a
+    tuple of strings and counts is a sequence of integers, corresponding to
+    'key_fields' and 'count_fields' respectively."""
+    keys = numpy.array([key for (key, _) in rows], dtype=str)
+    counts = numpy.array([counts for (_, counts) in rows], dtype=numpy.int64)
+
+    with open(filename, "wb") as handle:
+        numpy.savez_compressed(handle,
+                               key_fields=numpy.array(key_fields, dtype=str),
+                               keys=keys.reshape(len(rows), len(key_fields)),
+                               count_fields=numpy.array(count_fields,
+                                                        dtype=str),
+                               counts=counts.reshape(len(rows),
+                                                     len(count_fields)))
+
+
+def read_counts(filename, key_fields):
+    """Reads counts written using 'write_counts', returning a tuple of
+    (count_fields, rows), where rows is a list of (key, counts). Raises
+    ValueError if the key fields do not match 'key_fields'."""
+    data = numpy.load(filename)
+    try:
+        if tuple(data["key_fields"]) != tuple(key_fields):
+            raise ValueError("Unexpected key fields in %r: %r"
+                             % (filename, tuple(data["key_fields"])))
+
+        count_fields = tuple(str(field) for field in data["count_fields"])
+        rows = [(tuple(str(value) for value in key), counts)
+                for (key, counts) in zip(data["keys"], data["counts"])]
+    finally:
+        data.close()
+
+    return count_fields, rows
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Single-pass collection of statistics from BAM files.
+
+Statistics are collected by accumulators (see 'Accumulator'), which are fed
+the records at each position of the BAM file in turn. This allows any number
+of statistics to be collected while only reading the BAM file once:
+
+    args.accumulators = (CoverageAccumulator, DepthHistogramAccumulator)
+    coverage, depths = scan_file(handle, args)
+"""
+from pypeline.common.bamfiles import \
+    BAMRegionsIter, \
+    EXCLUDED_FLAGS
+
+from pypeline.tools.bam_stats.common import \
+    process_regions
+
+
+class Accumulator(object):
+    """Base class for statistics collected by 'scan_file'. Each accumulator is
+    created for a single BAM file (or a subset of the regions in a BAM file,
+    when using --threads), and the results of accumulators created for
+    different regions are combined using 'merge'.
+
+    For each region, 'begin_region' is called, followed by 'process_records'
+    for each position at which reads are aligned, and finally 'end_region'.
+    """
+
+    # Records with any of these flags set are not passed to the accumulator
+    excluded_flags = EXCLUDED_FLAGS
+    # If true, records that start before (but overlap) a chunk of a contig
+    # are passed to the accumulator when processing a chunk (see
+    # common.split_regions); otherwise records are only processed for the
+    # chunk in which they start.
+    include_overlapping = False
+
+    def __init__(self, args, handle):
+        self._args = args
+
+    def begin_region(self, region, is_chunk):
+        """Called before processing the records of a region. If 'is_chunk' is
+        true, the region is a part of a contig, rather than a region specified
+        by the user or an entire contig."""
+
+    def process_records(self, position, records):
+        """Called with the list of records aligned at 'position'."""
+        raise NotImplementedError
+
+    def end_region(self):
+        """Called once all records in a region have been processed."""
+
+    def finalize(self):
+        """Returns the (picklable) statistics collected by the accumulator."""
+        raise NotImplementedError
+
+    @classmethod
+    def merge(cls, result, partial):
+        """Combines the results of two accumulators, returning the result."""
+        raise NotImplementedError
+
+
+def scan_file(handle, args):
+    """Collects statistics for a BAM file using the accumulator classes listed
+    in 'args.accumulators', processing the file in parallel if --threads is
+    greater than 1 (see 'common.process_regions'). Returns a list of results
+    (see 'Accumulator.finalize') corresponding to 'args.accumulators'."""
+    def _merge_results(results, partials):
+        return [cls.merge(result, partial)
+                for (cls, result, partial)
+                in zip(args.accumulators, results, partials)]
+
+    return process_regions(handle, args, scan_regions, _merge_results)
+
+
+def scan_regions(handle, args, regions, timer):
+    """Runs the accumulators in 'args.accumulators' for the given regions, or
+    for the entire BAM file if 'regions' is None. Returns a list of results
+    corresponding to 'args.accumulators'."""
+    accumulators = [cls(args, handle) for cls in args.accumulators]
+
+    # Records are filtered by each accumulator, if not excluded by all
+    excluded_flags = EXCLUDED_FLAGS
+    for accumulator in accumulators:
+        excluded_flags &= accumulator.excluded_flags
+
+    # Regions are chunks of contigs (see 'common.split_regions')
+    is_chunk = bool(regions) and not args.regions
+    for region in BAMRegionsIter(handle, regions, excluded_flags):
+        if region.name is None:
+            # Trailing unmapped reads
+            continue
+        elif not args.regions and (handle.nreferences > args.max_contigs):
+            region.name = '<Genome>'
+
+        for accumulator in accumulators:
+            accumulator.begin_region(region, is_chunk)
+
+        for (position, records) in region:
+            records = list(records)
+            timer.increment(len(records), read=records[-1])
+
+            is_overlapping = is_chunk and position < region.start
+            for accumulator in accumulators:
+                if is_overlapping and not accumulator.include_overlapping:
+                    continue
+
+                filtered_records = records
+                if accumulator.excluded_flags != excluded_flags:
+                    mask = accumulator.excluded_flags
+                    filtered_records = [record for record in records
+                                        if not record.flag & mask]
+
+                if filtered_records:
+                    accumulator.process_records(position, filtered_records)
+
+        for accumulator in accumulators:
+            accumulator.end_region()
+
+    return [accumulator.finalize() for accumulator in accumulators]
@@ -26,10 +26,6 @@ import copy
 from pypeline.common.utilities import \
     get_in, \
     set_in
-from pypeline.common.timer import \
-    BAMTimer
-from pypeline.common.bamfiles import \
-    BAMRegionsIter
 
 from pypeline.tools.bam_stats.common import \
     collect_readgroups, \
@@ -38,6 +34,9 @@ from pypeline.tools.bam_stats.common import \
 from pypeline.tools.bam_stats.coverage import \
     READGROUP_TEMPLATE, \
     write_table
+from pypeline.tools.bam_stats.scanner import \
+    Accumulator, \
+    scan_file
 
 
 ##############################################################################
@@ -90,70 +89,164 @@ def build_table(args, handle, counts):
     return table
 
 
-def print_table(args, handle, counts):
+def print_table(args, handle, counts, filename, counts_filename=None):
     table = build_table(args, handle, counts)
-    write_table(table, args.outfile)
+    write_table(table, filename, counts_filename)
 
 
 ##############################################################################
 ##############################################################################
 
-def process_record(subtable, record, flags, region):
-    qname = record.qname
-    if qname.startswith("M_") or qname.startswith("MT_"):
-        subtable["Collapsed"] += 1
-    elif flags & 0x40:  # first of pair
-        subtable["PE_1"] += 1
-    elif flags & 0x80:  # second of pair
-        subtable["PE_2"] += 1
-    else:  # Singleton
-        subtable["SE"] += 1
-
-    position = record.pos
-    start = region.start
-    end = region.end
-
-    for (cigar, num) in record.cigar:
+# Statistics counted for each record; these are summed in lists (in this
+# order) for each readgroup, before being added to the region tables
+_STATISTICS = ("SE", "PE_1", "PE_2", "Collapsed", "M", "I", "D")
+# Index of the statistic counted for CIGAR ops 'MIDNSHP=X', if any
+_CIGAR_STATISTICS = (4, 5, 6, None, None, None, None, 4, 4)
+# Maximum number of CIGARs for which totals are cached
+_MAX_CIGAR_CACHE_SIZE = 2 ** 16
+
+
+def count_bases_in_region(counts, cigar, position, start, end):
+    """Adds the number of bases aligned within 'start' and 'end' to the
+    list 'counts' (see '_STATISTICS'), for an alignment starting at
+    'position'."""
+    for (op, num) in cigar:
         left = min(max(position, start), end)
         right = min(max(position + num, start), end)
         bases_in_region = right - left
         assert 0 <= bases_in_region <= num
 
         # 0 = 'M', 1 = 'I', 2 = 'D', 7 = '=', 8 = 'X'
-        if cigar in (0, 1, 2, 7, 8):
+        if op in (0, 1, 2, 7, 8):
             if bases_in_region:
-                subtable["MID    MM"[cigar]] += bases_in_region
+                counts[_CIGAR_STATISTICS[op]] += bases_in_region
 
-            if cigar != 1:  # Everything but insertions
+            if op != 1:  # Everything but insertions
                 position += num
-        elif cigar == 3:  # N
+        elif op == 3:  # N
             position += num
 
 
-def process_file(handle, args):
-    timer = BAMTimer(handle, step=1000000)
+def get_cigar_totals(cigar):
+    """Returns a tuple of (M, I, D, extent) for a CIGAR, where M, I, and D are
+    the number of bases counted for an alignment lying within a region (see
+    'count_bases_in_region'), and extent is the distance from the start of the
+    alignment to the end of the right-most of these (including insertions)."""
+    totals = [0, 0, 0, 0, 0, 0, 0]
+    position = extent = 0
+    for (op, num) in cigar:
+        if op in (0, 1, 2, 7, 8):
+            totals[_CIGAR_STATISTICS[op]] += num
+            extent = max(extent, position + num)
 
-    counts = {}
-    region_template = build_region_template(args, handle)
-    for region in BAMRegionsIter(handle, args.regions):
-        if region.name is None:
-            # Trailing unmapped reads
+            if op != 1:  # Everything but insertions
+                position += num
+        elif op == 3:  # N
+            position += num
+
+    return (totals[4], totals[5], totals[6], extent)
+
+
+class CoverageAccumulator(Accumulator):
+    """Collects the number of hits and aligned bases for each readgroup and
+    contig / region; the result is a dict of {name: {readgroup: counts}}."""
+
+    def __init__(self, args, handle):
+        Accumulator.__init__(self, args, handle)
+        self._counts = {}
+        self._lengths = handle.lengths
+        self._template = build_region_template(args, handle)
+        self._cigar_cache = {}
+
+        self._region_table = None
+        # Statistics for the current region, by readgroup (see '_STATISTICS')
+        self._region_counts = {}
+        self._start = self._end = None
+
+    def begin_region(self, region, is_chunk):
+        self._region_table = get_region_table(self._counts, region.name,
+                                              self._template)
+
+        self._start, self._end = region.start, region.end
+        if is_chunk:
+            # Hits are counted in the chunk in which they start, including
+            # bases aligned outside the chunk
+            self._start, self._end = 0, self._lengths[region.tid]
+
+    def process_records(self, position, records):
+        get_readgroup = self._args.get_readgroup_func
+        region_counts = self._region_counts
+        cigar_cache = self._cigar_cache
+        start, end = self._start, self._end
+
+        for record in records:
+            readgroup = get_readgroup(record)
+            counts = region_counts.get(readgroup)
+            if counts is None:
+                counts = region_counts[readgroup] = [0] * len(_STATISTICS)
+
+            flags = record.flag
+            if record.qname.startswith(("M_", "MT_")):
+                counts[3] += 1  # Collapsed
+            elif flags & 0x40:  # first of pair
+                counts[1] += 1
+            elif flags & 0x80:  # second of pair
+                counts[2] += 1
+            else:  # Singleton
+                counts[0] += 1
+
+            # Identical CIGARs are common, so totals are computed only once
+            cigar = tuple(record.cigar)
+            totals = cigar_cache.get(cigar)
+            if totals is None:
+                if len(cigar_cache) >= _MAX_CIGAR_CACHE_SIZE:
+                    cigar_cache.clear()
+                totals = cigar_cache[cigar] = get_cigar_totals(cigar)
+
+            position = record.pos
+            if start <= position and position + totals[3] <= end:
+                counts[4] += totals[0]
+                counts[5] += totals[1]
+                counts[6] += totals[2]
+            else:
+                count_bases_in_region(counts, cigar, position, start, end)
+
+    def end_region(self):
+        for (readgroup, counts) in self._region_counts.iteritems():
+            readgroup_table = self._region_table[readgroup]
+            for (key, value) in zip(_STATISTICS, counts):
+                readgroup_table[key] += value
+
+        self._region_counts = {}
+
+    def finalize(self):
+        return self._counts
+
+    @classmethod
+    def merge(cls, result, partial):
+        return merge_counts(result, partial)
+
+
+def merge_counts(counts, partial):
+    """Adds the per-readgroup statistics in 'partial' to those in 'counts'."""
+    for (name, region_table) in partial.iteritems():
+        if name not in counts:
+            counts[name] = region_table
             continue
 
-        name = region.name
-        if not args.regions and (handle.nreferences > args.max_contigs):
-            name = '<Genome>'
+        for (readgroup, statistics) in region_table.iteritems():
+            readgroup_table = counts[name][readgroup]
+            for (key, value) in statistics.iteritems():
+                readgroup_table[key] += value
+
+    return counts
 
-        region_table = get_region_table(counts, name, region_template)
-        for (_, records) in region:
-            for record in records:
-                readgroup = args.get_readgroup_func(record)
-                readgroup_table = region_table[readgroup]
-                process_record(readgroup_table, record, record.flag, region)
-                timer.increment(read=record)
-    timer.finalize()
 
-    print_table(args, handle, counts)
+def process_file(handle, args):
+    args.accumulators = (CoverageAccumulator,)
+    counts, = scan_file(handle, args)
+
+    print_table(args, handle, counts, args.outfile, args.raw_counts)
 
     return 0
 
@@ -22,20 +22,23 @@
 #
 import sys
 import datetime
-import itertools
 import collections
 
-from pypeline.common.timer import \
-    BAMTimer
+import numpy
+
 from pypeline.common.text import \
     padded_table
-from pypeline.common.bamfiles import \
-    BAMRegionsIter
 
 from pypeline.tools.bam_stats.common import \
+    BAMStatsError, \
     collect_references, \
     collect_readgroups, \
     main_wrapper
+from pypeline.tools.bam_stats.scanner import \
+    Accumulator, \
+    scan_file
+
+import pypeline.tools.bam_stats.rawcounts as rawcounts
 
 
 ##############################################################################
@@ -44,9 +47,12 @@ from pypeline.tools.bam_stats.common import \
 
 # Maximum depth to record, and hence the number of columns in output table
 _MAX_DEPTH = 200
-# Maximum number of count patterns (numbers of bases per library for a given
-# site) to cache for bulk processing; see MappingsToTotals for implementation
-_MAX_CACHE_SIZE = 10000
+# Number of positions for which aligned blocks are collected, before depths
+# are calculated for these in bulk; see DepthWindow for implementation
+_WINDOW_SIZE = 2 ** 16
+# Key columns of raw counts files (see 'rawcounts'); the count columns are
+# the size of the region, followed by the full depth histogram ('Depth_N')
+_KEY_FIELDS = ("Name", "Sample", "Library", "Contig")
 
 
 # Header prepended to output tables
@@ -72,63 +78,124 @@ _HEADER = """# Timestamp: %s
 ##############################################################################
 ##############################################################################
 
+class DepthWindow(object):
+    """Collects the aligned blocks of reads (per sample / library), and
+    calculates the per-position depths for a stretch of positions in bulk.
+
+    Each block is recorded as a +1 at the start and a -1 at the (past-the-end)
+    position, for the sample / library of the read. The depths are then the
+    cumulative sum of these differences across positions, with the sum for
+    the positions preceding the current window carried over between calls.
+    """
+
+    def __init__(self, nsmlbids):
+        self._nsmlbids = nsmlbids
+        # First position not yet processed, or None if no blocks are pending
+        self.start = None
+        # Past-the-end position of reads added so far
+        self.end = 0
+        # Depths at the position preceding 'start'
+        self._carry = numpy.zeros(nsmlbids, dtype=numpy.int32)
+        # Block starts / ends, encoded as (position * nsmlbids + smlbid)
+        self._starts = []
+        self._ends = []
+        # Block starts / ends past the end of previously processed windows
+        self._pending_starts = numpy.zeros(0, dtype=numpy.int64)
+        self._pending_ends = numpy.zeros(0, dtype=numpy.int64)
+
+    def add(self, smlbid, start, end):
+        """Adds a block of aligned bases covering positions [start, end)."""
+        if self.start is None or start < self.start:
+            self.start = start
+
+        self._starts.append(start * self._nsmlbids + smlbid)
+        self._ends.append(end * self._nsmlbids + smlbid)
+
+    def flush(self, position):
+        """Returns the depths for positions up to (but not including) the
+        given position, as a tuple of the offset of the first position and
+        an array with a row per sample / library. Returns None if no bases
+        have been aligned to these positions. No blocks may be added at
+        positions before 'position' after this function has been called.
+        """
+        if self.start is None or position <= self.start:
+            return None
+
+        start = self.start
+        end = min(position, self.end)
+        nsmlbids = self._nsmlbids
+        size = (end - start) * nsmlbids
+
+        starts, self._pending_starts \
+            = self._collect(self._pending_starts, self._starts, end)
+        ends, self._pending_ends \
+            = self._collect(self._pending_ends, self._ends, end)
+        self._starts = []
+        self._ends = []
+
+        offset = start * nsmlbids
+        diffs = numpy.bincount(starts - offset, minlength=size) \
+            - numpy.bincount(ends - offset, minlength=size)
+
+        depths = numpy.cumsum(diffs.reshape(end - start, nsmlbids),
+                              axis=0, dtype=numpy.int32)
+        depths += self._carry
+        self._carry = depths[-1].copy()
+
+        if end < self.end:
+            self.start = end
+        else:
+            # No bases are aligned past this point, so the only blocks left
+            # are those ending here, which cancel out the carried depths
+            self.start = None
+            self._carry[:] = 0
+            self._pending_ends = self._pending_ends[:0]
+
+        return start, depths.T
+
+    def _collect(self, pending, values, end):
+        """Returns the encoded values located before the position 'end', and
+        the remaining values (to be processed in a later window)."""
+        values = numpy.array(values, dtype=numpy.int64)
+        if len(pending):
+            values = numpy.concatenate((pending, values))
+
+        selection = values < end * self._nsmlbids
+        return values[selection], values[~selection]
+
+
 class MappingToTotals(object):
     def __init__(self, totals, region, smlbid_to_smlb):
         self._region = region
         self._totals = totals
-        self._map_by_smlbid, self._totals_src_and_dst \
+        self._totals_and_smlbids \
             = self._build_mappings(totals, region.name, smlbid_to_smlb)
-        self._cache = collections.defaultdict(int)
-
-    def process_counts(self, counts, last_pos, cur_pos):
-        start = self._region.start
-        end = self._region.end
-
-        # Pileups tends to contain identical stretches, so
-        # try to avoid repeated lookups by aggregating these
-        repeats = 1
-        last_count = None
-        while counts and (last_pos < cur_pos):
-            count = counts.popleft()
-            if start <= last_pos < end:
-                if count == last_count:
-                    repeats += 1
-                else:
-                    if last_count is not None:
-                        self._cache[tuple(last_count)] += repeats
-                    last_count = count
-                    repeats = 1
-            last_pos += 1
-
-        if last_count is not None:
-            self._cache[tuple(last_count)] += repeats
-
-        if len(self._cache) > _MAX_CACHE_SIZE:
-            self.finalize()
-
-    def finalize(self):
-        """Process cached counts."""
-        for (count, multiplier) in self._cache.iteritems():
-            self._update_totals(count, multiplier)
-        self._cache.clear()
 
-    def _update_totals(self, count, multiplier=1):
-        for (smlbid, count) in enumerate(count):
-            if count:
-                for lst in self._map_by_smlbid[smlbid]:
-                    lst[0] += count
+    def process_depths(self, offset, depths):
+        """Adds the depths for the positions starting at 'offset' to the
+        histograms of every table key. Positions outside the region are
+        ignored, as are positions with a depth of 0."""
+        start = max(0, self._region.start - offset)
+        end = max(0, min(depths.shape[1], self._region.end - offset))
+        if start >= end:
+            return
+
+        depths = depths[:, start:end]
+        for (dst_counts, smlbids) in self._totals_and_smlbids:
+            if len(smlbids) == 1:
+                key_depths = depths[smlbids[0]]
+            else:
+                key_depths = depths[smlbids].sum(axis=0)
 
-        for (dst_counts, src_count) in self._totals_src_and_dst:
-            if src_count[0]:
-                dst_counts[src_count[0]] += multiplier
-                src_count[0] = 0
+            histogram = numpy.bincount(key_depths)
+            histogram[0] = 0
+            for depth in histogram.nonzero()[0]:
+                dst_counts[int(depth)] += int(histogram[depth])
 
     @classmethod
     def _build_mappings(cls, totals, name, smlbid_to_smlb):
-        # Accumulators mapped by sample+library IDs
-        totals_by_smlbid = [None] * len(smlbid_to_smlb)
-        # Accumulators mapped by the corresponding table keys
-        totals_by_table_key = {}
+        # Sample+library IDs mapped by the corresponding table keys
+        smlbids_by_table_key = {}
 
         for (smlbid, (sm_key, lb_key)) in enumerate(smlbid_to_smlb):
             keys = [('*', '*', '*'),
@@ -137,32 +204,30 @@ class MappingToTotals(object):
                     (sm_key, lb_key, '*'),
                     (sm_key, lb_key, name)]
 
-            mappings = cls._nonoverlapping_mappings(keys, totals,
-                                                    totals_by_table_key)
-            totals_by_smlbid[smlbid] = mappings
+            for key in cls._nonoverlapping_keys(keys, totals):
+                smlbids_by_table_key.setdefault(key, []).append(smlbid)
 
-        totals_src_and_dst = []
-        for (key, dst) in totals_by_table_key.iteritems():
-            totals_src_and_dst.append((totals[key], dst))
+        totals_and_smlbids = []
+        for (key, smlbids) in smlbids_by_table_key.iteritems():
+            totals_and_smlbids.append((totals[key], smlbids))
 
-        return totals_by_smlbid, totals_src_and_dst
+        return totals_and_smlbids
 
     @classmethod
-    def _nonoverlapping_mappings(cls, keys, totals, totals_by_table_key):
-        """Returns a tuple of accumulators for a given set of table keys. As
-        multiple table keys may share the same accumulator (e.g. if there is
-        only one sample, then sample "*" and that sample will be identical),
-        the tuple of accumulators may contain fewer items than keys."""
+    def _nonoverlapping_keys(cls, keys, totals):
+        """Returns a tuple of table keys with distinct totals. As multiple
+        table keys may share the same totals (e.g. if there is only one
+        sample, then sample "*" and that sample will be identical), the
+        tuple of keys may contain fewer items than the input."""
 
         mapping = []
         totals_used = set()
         for key in keys:
-            # Check that accumulator is not already included
+            # Check that totals are not already included
             totals_id = id(totals[key])
             if totals_id not in totals_used:
                 totals_used.add(totals_id)
-                accumulator = totals_by_table_key.setdefault(key, [0])
-                mapping.append(accumulator)
+                mapping.append(key)
         return tuple(mapping)
 
 
@@ -188,16 +253,24 @@ def calc_max_depth(counts):
     return "NA"
 
 
-def print_table(handle, args, totals):
+def print_table(handle, args, totals, filename, counts_filename=None):
     lengths = collect_references(args, handle)
+    if counts_filename is not None:
+        write_counts(args.target_name, totals, lengths, counts_filename)
+
+    write_table(args.target_name, totals, lengths, filename)
+
 
-    if args.outfile == "-":
+def write_table(name, totals, lengths, filename):
+    """Writes a table of depths for the histograms in 'totals' (see
+    'build_totals_dict'), given a dict of contig / region sizes."""
+    if filename == "-":
         output_handle = sys.stdout
     else:
-        output_handle = open(args.outfile, "w")
+        output_handle = open(filename, "w")
 
     with output_handle:
-        rows = build_table(args.target_name, totals, lengths)
+        rows = build_table(name, totals, lengths)
         output_handle.write(_HEADER % datetime.datetime.now().isoformat())
         output_handle.write("\n")
         for line in padded_table(rows):
@@ -231,11 +304,7 @@ def build_table(name, totals, lengths):
             rows.append("#")
         last_sm, last_lb = sm_key, lb_key
 
-        if ct_key == "*":
-            length = sum(lengths.itervalues())
-        else:
-            length = lengths[ct_key]
-
+        length = _get_length(lengths, ct_key)
         row = [name, sm_key, lb_key, ct_key, str(length),
                str(calc_max_depth(counts))]
         row.extend(calculate_depth_pc(counts, length))
@@ -245,6 +314,57 @@ def build_table(name, totals, lengths):
     return rows
 
 
+def write_counts(name, totals, lengths, filename):
+    """Writes the full (uncapped) depth histograms in 'totals', and the size
+    of each contig / region, to 'filename'; see 'read_counts'."""
+    max_depth = 0
+    for counts in totals.itervalues():
+        max_depth = max([max_depth] + list(counts))
+
+    count_fields = ["Size"]
+    count_fields.extend("Depth_%i" % (depth,)
+                        for depth in xrange(max_depth + 1))
+
+    rows = []
+    for ((sm_key, lb_key, ct_key), counts) in sorted(totals.items()):
+        row = [0] * len(count_fields)
+        row[0] = _get_length(lengths, ct_key)
+        for (depth, count) in counts.iteritems():
+            row[depth + 1] += count
+
+        rows.append(((name, sm_key, lb_key, ct_key), row))
+
+    rawcounts.write_counts(filename, _KEY_FIELDS, count_fields, rows)
+
+
+def read_counts(filename):
+    """Reads depth histograms written using 'write_counts', returning a tuple
+    of (name, totals, lengths), which may be passed to 'write_table'. Note
+    that histograms from different files may only be summed if these cover
+    different positions, since depths are not additive."""
+    _, rows = rawcounts.read_counts(filename, _KEY_FIELDS)
+
+    name = None
+    totals, lengths = {}, {}
+    for ((name, sm_key, lb_key, ct_key), row) in rows:
+        counts = collections.defaultdict(int)
+        for (depth, count) in enumerate(row[1:]):
+            if count:
+                counts[depth] = int(count)
+
+        totals[(sm_key, lb_key, ct_key)] = counts
+        if ct_key != "*":
+            lengths[ct_key] = int(row[0])
+
+    return name, totals, lengths
+
+
+def _get_length(lengths, contig):
+    if contig == "*":
+        return sum(lengths.itervalues())
+    return lengths[contig]
+
+
 ##############################################################################
 ##############################################################################
 
@@ -300,19 +420,19 @@ def build_totals_dict(args, handle):
     return totals
 
 
-def count_bases(args, counts, record, rg_to_smlbid, template):
-    for _ in xrange(record.alen - len(counts)):
-        counts.append(list(template))
-
+def count_bases(args, window, record, rg_to_smlbid):
     key = rg_to_smlbid[args.get_readgroup_func(record)]
-    index = 0
+    position = record.pos
+    # Blocks shifted past the end of the alignment by padding are truncated
+    window.end = max(window.end, position + record.alen)
     for (cigar, count) in record.cigar:
         if cigar in (0, 7, 8):
-            for counter in itertools.islice(counts, index, index + count):
-                counter[key] += 1
-            index += count
+            end = min(position + count, window.end)
+            if position < end:
+                window.add(key, position, end)
+            position += count
         elif cigar in (2, 3, 6):
-            index += count
+            position += count
 
 
 def build_rg_to_smlbid_keys(args, handle):
@@ -338,44 +458,85 @@ def build_rg_to_smlbid_keys(args, handle):
     return rg_to_lbsmid, lbsmid_to_smlb
 
 
-def process_file(handle, args):
-    timer = BAMTimer(handle, step=1000000)
+def _process_window(mapping, window, position):
+    result = window.flush(position)
+    if result is not None:
+        mapping.process_depths(*result)
+
+
+class DepthHistogramAccumulator(Accumulator):
+    """Collects depth histograms for each sample / library and contig; the
+    result is a totals dict as returned by 'build_totals_dict'."""
+
+    # Reads overlapping a chunk must be counted to calculate depths
+    include_overlapping = True
 
-    last_tid = 0
-    totals = build_totals_dict(args, handle)
-    rg_to_smlbid, smlbid_to_smlb = build_rg_to_smlbid_keys(args, handle)
-    template = [0] * len(smlbid_to_smlb)
+    def __init__(self, args, handle):
+        Accumulator.__init__(self, args, handle)
+        self._totals = build_totals_dict(args, handle)
+        self._rg_to_smlbid, self._smlbid_to_smlb \
+            = build_rg_to_smlbid_keys(args, handle)
 
-    for region in BAMRegionsIter(handle, args.regions):
-        if region.name is None:
-            # Trailing unmapped reads
-            continue
-        elif not args.regions and (handle.nreferences > args.max_contigs):
-            region.name = '<Genome>'
+        self._tid = self._last_tid = 0
+        self._last_pos = 0
+        self._window = None
+        self._mapping = None
 
-        last_pos = 0
-        counts = collections.deque()
-        mapping = MappingToTotals(totals, region, smlbid_to_smlb)
-        for (position, records) in region:
-            mapping.process_counts(counts, last_pos, position)
+    def begin_region(self, region, is_chunk):
+        self._tid = region.tid
+        self._last_pos = 0
+        self._window = DepthWindow(len(self._smlbid_to_smlb))
+        self._mapping = MappingToTotals(self._totals, region,
+                                        self._smlbid_to_smlb)
 
-            for record in records:
-                timer.increment(read=record)
-                count_bases(args, counts, record, rg_to_smlbid, template)
+    def process_records(self, position, records):
+        if (self._tid, position) < (self._last_tid, self._last_pos):
+            raise BAMStatsError("Input BAM file is unsorted")
 
-            if (region.tid, position) < (last_tid, last_pos):
-                sys.stderr.write("ERROR: Input BAM file is unsorted\n")
-                return 1
+        window = self._window
+        if window.start is not None \
+                and position - window.start >= _WINDOW_SIZE:
+            _process_window(self._mapping, window, position)
 
-            last_pos = position
-            last_tid = region.tid
+        for record in records:
+            count_bases(self._args, window, record, self._rg_to_smlbid)
 
+        self._last_pos = position
+        self._last_tid = self._tid
+
+    def end_region(self):
         # Process columns in region after last read
-        mapping.process_counts(counts, last_pos, float("inf"))
-        mapping.finalize()
-    timer.finalize()
+        _process_window(self._mapping, self._window, self._window.end)
+
+    def finalize(self):
+        return self._totals
+
+    @classmethod
+    def merge(cls, result, partial):
+        return merge_totals(result, partial)
+
+
+def merge_totals(totals, partial):
+    """Adds the depth histograms in 'partial' to those in 'totals'. Both
+    dicts must have been built using 'build_totals_dict', and histograms
+    shared between keys are therefore only added once."""
+    merged = set()
+    for (key, counts) in partial.iteritems():
+        if id(counts) not in merged:
+            merged.add(id(counts))
+
+            dst_counts = totals[key]
+            for (depth, count) in counts.iteritems():
+                dst_counts[depth] += count
+
+    return totals
+
+
+def process_file(handle, args):
+    args.accumulators = (DepthHistogramAccumulator,)
+    totals, = scan_file(handle, args)
 
-    print_table(handle, args, totals)
+    print_table(handle, args, totals, args.outfile, args.raw_counts)
 
     return 0
 
@@ -37,6 +37,9 @@ import pysam
 
 import pypeline.common.bamfiles as bamfiles
 
+from pypeline.tools.bam_stats.scanner import \
+    Accumulator
+
 
 def get_template_length(record):
     """Returns the template length of the given record for paired or collapsed
@@ -78,22 +81,50 @@ def process_records(records, counts):
         counts[count] += 1
 
 
+def write_histogram(counts, handle):
+    """Writes a histogram to 'handle' as tab-separated (key, count) lines."""
+    for (key, count) in sorted(counts.iteritems()):
+        handle.write("%i\t%i\n" % (key, count))
+
+
+class DuplicateHistogramAccumulator(Accumulator):
+    """Collects a histogram of PCR duplicate counts (see 'process_records');
+    the result is a dict of {number of copies: count}."""
+
+    # Default filters, excepting that PCR duplicates are not filtered
+    excluded_flags = bamfiles.EXCLUDED_FLAGS & ~bamfiles.BAM_PCR_DUPLICATE
+
+    def __init__(self, args, handle):
+        Accumulator.__init__(self, args, handle)
+        self._counts = collections.defaultdict(int)
+
+    def process_records(self, position, records):
+        process_records(records, self._counts)
+
+    def finalize(self):
+        return self._counts
+
+    @classmethod
+    def merge(cls, result, partial):
+        for (key, count) in partial.iteritems():
+            result[key] += count
+        return result
+
+
 def main(argv):
     """Main function; takes a list of arguments equivalent to sys.argv[1:]."""
     parser = argparse.ArgumentParser(prog="paleomix duphist")
     parser.add_argument("bamfile", help="Sorted BAM file.")
     args = parser.parse_args(argv)
 
-    # Default filters, excepting that PCR duplicates are not filtered
-    mask = bamfiles.EXCLUDED_FLAGS & ~bamfiles.BAM_PCR_DUPLICATE
+    mask = DuplicateHistogramAccumulator.excluded_flags
     counts = collections.defaultdict(int)
     with pysam.Samfile(args.bamfile) as handle:
         for region in bamfiles.BAMRegionsIter(handle, exclude_flags=mask):
             for (_, records) in region:
                 process_records(records, counts)
 
-    for (key, count) in sorted(counts.iteritems()):
-        print "%i\t%i" % (key, count)
+    write_histogram(counts, sys.stdout)
 
 
 if __name__ == '__main__':
@@ -23,6 +23,11 @@
 import optparse
 
 import pypeline
+import pypeline.metrics
+import pypeline.profiling
+import pypeline.statecache
+import pypeline.executors.batch
+import pypeline.executors.remote
 
 import pypeline.tools.phylo_pipeline.parts.genotype as genotype
 import pypeline.tools.phylo_pipeline.parts.msa as msa
@@ -33,7 +38,8 @@ import pypeline.common.console as console
 from pypeline.config import \
      ConfigError, \
      PerHostValue, \
-     PerHostConfig
+     PerHostConfig, \
+     parse_memory_limit
 
 
 _DESCRIPTION = \
@@ -93,6 +99,11 @@ def _run_config_parser(argv):
                                 ui_default=PerHostValue("quiet"),
                                 color_default=PerHostValue("on"))
     pypeline.logger.add_optiongroup(parser, default = PerHostValue("warning"))
+    pypeline.statecache.add_optiongroup(parser)
+    pypeline.profiling.add_optiongroup(parser)
+    pypeline.executors.remote.add_optiongroup(parser, per_host_cfg.remote_secret)
+    pypeline.executors.batch.add_optiongroup(parser)
+    pypeline.metrics.add_optiongroup(parser)
 
     group  = optparse.OptionGroup(parser, "Scheduling")
     group.add_option("--samtools-max-threads",  default = PerHostValue(1), type = int,
@@ -101,6 +112,18 @@ def _run_config_parser(argv):
                      help = "Maximum number of threads to use for each instance of ExaML [%default]")
     group.add_option("--max-threads",        default = per_host_cfg.max_threads, type = int,
                      help = "Maximum number of threads to use in total [%default]")
+    group.add_option("--max-memory",         default = per_host_cfg.max_memory,
+                     help = "Maximum amount of memory to be used by running tasks, "
+                            "e.g. '64g'; 'auto' uses the amount of physical memory, "
+                            "while 'none' disables this limit [%default]")
+    group.add_option("--runtime-db",         default = per_host_cfg.runtime_db,
+                     help = "SQLite database in which the runtimes of tasks are "
+                            "recorded, and which is used to estimate runtimes; "
+                            "'none' disables this database [%default]")
+    group.add_option("--version-cache",      default = per_host_cfg.version_cache,
+                     help = "File in which the results of version checks are "
+                            "cached, until the programs in question change; "
+                            "'none' disables this cache [%default]")
     group.add_option("--dry-run",            default = False, action="store_true",
                      help = "If passed, only a dry-run in performed, the dependency tree is printed, "
                             "and no tasks are executed.")
@@ -143,6 +166,14 @@ def parse_config(argv):
     options, args  = _run_config_parser(argv)
     pypeline.ui.set_ui_colors(options.ui_colors)
 
+    if options.trust_state_cache and not options.state_cache:
+        raise ConfigError("ERROR: --trust-state-cache requires --state-cache!")
+    options.max_memory = parse_memory_limit(options.max_memory)
+    if options.runtime_db.lower() == "none":
+        options.runtime_db = None
+    if options.version_cache.lower() == "none":
+        options.version_cache = None
+
     if (len(args) < 2) and (args != ["mkfile"]):
         description = _DESCRIPTION.replace("%prog", "phylo_pipeline").strip()
         console.print_info("Phylogeny Pipeline %s\n" % (pypeline.__version__,))
@@ -28,10 +28,14 @@ import logging
 import pypeline.ui
 import pypeline.yaml
 import pypeline.logger
+import pypeline.profiling
+import pypeline.executors
 import pypeline.tools.phylo_pipeline.makefile
 import pypeline.tools.phylo_pipeline.mkfile as mkfile
 
+from pypeline.executors.base import ExecutorError
 from pypeline.pipeline import Pypeline
+from pypeline.checksums import is_manifest
 from pypeline.common.console import print_err
 from pypeline.tools.phylo_pipeline.makefile import \
     MakefileError, \
@@ -50,7 +54,8 @@ def list_orphan_files(config, makefiles, pipeline):
         for (dirpath, _, filenames) in os.walk(folder):
             for filename in filenames:
                 fpath = os.path.join(dirpath, filename)
-                files.add(os.path.abspath(fpath))
+                if not is_manifest(fpath):
+                    files.add(os.path.abspath(fpath))
     return files - pipeline.list_output_files()
 
 
@@ -71,6 +76,8 @@ def main(argv):
     if any((cmd in ("makefile", "mkfile")) for (cmd, _) in commands):
         return mkfile.main(args[1:])
 
+    pypeline.profiling.enable_from_options(config)
+
     if not os.path.exists(config.temp_root):
         try:
             os.makedirs(config.temp_root)
@@ -84,7 +91,8 @@ def main(argv):
         return 1
 
     try:
-        makefiles = read_makefiles(config, args, commands)
+        with pypeline.profiling.phase("Reading makefiles"):
+            makefiles = read_makefiles(config, args, commands)
     except (MakefileError, pypeline.yaml.YAMLError, IOError), error:
         print_err("Error reading makefiles:",
                   "\n  %s:\n   " % (error.__class__.__name__,),
@@ -99,7 +107,8 @@ def main(argv):
     pipeline = Pypeline(config)
     for (command_key, command_func) in commands:
         logger.info("Building %s pipeline ...", command_key)
-        command_func(pipeline, config, makefiles)
+        with pypeline.profiling.phase("Building nodes"):
+            command_func(pipeline, config, makefiles)
 
     for makefile in makefiles:
         if "Nodes" in makefile:
@@ -124,8 +133,22 @@ def main(argv):
             return 1
         return 0
 
+    try:
+        executor = pypeline.executors.executor_from_options(config)
+    except ExecutorError, error:
+        logger.error("ERROR: Could not set up executor: %s", error)
+        return 1
+
     if not pipeline.run(max_running=config.max_threads,
                         dry_run=config.dry_run,
-                        progress_ui=config.progress_ui):
+                        progress_ui=config.progress_ui,
+                        state_cache=config.state_cache,
+                        trust_state_cache=config.trust_state_cache,
+                        content_checksums=config.content_checksums,
+                        max_memory=config.max_memory,
+                        runtime_db=config.runtime_db,
+                        executor=executor,
+                        version_cache=config.version_cache,
+                        metrics_address=config.metrics_address):
         return 1
     return 0
@@ -28,6 +28,7 @@ import optparse
 
 import pypeline.nodegraph
 import pypeline.logger
+import pypeline.scheduler
 from pypeline.node import MetaNode
 from pypeline.common.console import \
     print_msg, \
@@ -104,6 +105,18 @@ class BaseUI(object):
         """Basic initializer; must be called in subclasses."""
         self.states = []
         self.threads = 0
+        # Estimated runtimes of nodes not yet DONE / failed, if enabled
+        self._estimate_runtime = None
+        self._estimates = {}
+        self._max_threads = 1
+
+    def set_runtime_estimates(self, estimate_runtime, max_threads):
+        """Enables estimates of the time left for the pipeline to finish,
+        using the function 'estimate_runtime' (see RunableQueue), and the
+        max number of threads used by the pipeline. Must be called prior to
+        adding the UI to a NodeGraph."""
+        self._estimate_runtime = estimate_runtime
+        self._max_threads = max(1, max_threads)
 
     def flush(self):
         """Called by the user of the UI to ensure that the UI to print
@@ -129,6 +142,27 @@ class BaseUI(object):
         self.states, self.threads \
             = self._count_states(nodegraph, nodegraph.iterflat())
 
+        if self._estimate_runtime is not None:
+            self._estimates = {}
+            for node in nodegraph.iterflat():
+                if nodegraph.get_node_state(node) not in (self.DONE,
+                                                          self.ERROR):
+                    self._estimates[node] = self._estimate(node)
+
+    def nodes_added(self, nodegraph, nodes):
+        """Called when nodes have been added to the nodegraph, which are
+        added to the state-counts."""
+        states, threads = self._count_states(nodegraph, nodes)
+        for (state, count) in enumerate(states):
+            self.states[state] += count
+        self.threads += threads
+
+        if self._estimate_runtime is not None:
+            for node in nodes:
+                if nodegraph.get_node_state(node) not in (self.DONE,
+                                                          self.ERROR):
+                    self._estimates[node] = self._estimate(node)
+
     def state_changed(self, node, old_state, new_state, _is_primary):
         """Observer function for NodeGraph; counts states of non-meta nodes."""
         if not isinstance(node, MetaNode):
@@ -139,6 +173,25 @@ class BaseUI(object):
             elif new_state == self.RUNNING:
                 self.threads += node.threads
 
+        if new_state in (self.DONE, self.ERROR):
+            self._estimates.pop(node, None)
+
+    def _describe_eta(self):
+        """Returns a description of the estimated time left for the pipeline
+        to finish, assuming that all threads are kept busy, or an empty
+        string if estimates are not enabled."""
+        if self._estimate_runtime is None:
+            return ""
+
+        runtime = sum(self._estimates.itervalues()) / self._max_threads
+        return ", ETA ~%s" % (_fmt_runtime(int(runtime)),)
+
+    def _estimate(self, node):
+        runtime = self._estimate_runtime(node)
+        if runtime is None:
+            runtime = pypeline.scheduler.estimate_cost(node)
+        return runtime * node.threads
+
     @classmethod
     def _count_states(cls, nodegraph, nodes, meta=False):
         """Counts the number of each state observed for a set of nodes, and
@@ -398,7 +451,8 @@ class ProgressUI(BaseUI):
         """Prints a summary of the pipeline progress."""
         time_label = datetime.datetime.now().strftime("%T")
         description = self._describe_states(self.states, self.threads)
-        print_msg("\n%s Pipeline: %s" % (time_label, description))
+        print_msg("\n%s Pipeline: %s%s" % (time_label, description,
+                                           self._describe_eta()))
         logfile = pypeline.logger.get_logfile()
         if logfile:
             print_debug("Log-file located at %r" % (logfile,))
@@ -440,9 +494,10 @@ class SummaryUI(BaseUI):
         time_label = datetime.datetime.now().strftime("%T")
         runtime = _fmt_runtime(int(time.time() - self._starting_time))
         description = self._describe_states(self.states, self.threads)
-        message = "%s Pipeline: %s in %s " % (time_label,
-                                              description,
-                                              runtime)
+        message = "%s Pipeline: %s in %s%s " % (time_label,
+                                                description,
+                                                runtime,
+                                                self._describe_eta())
 
         self._max_len = max(len(message), self._max_len)
         print_msg("\r%s" % (message.ljust(self._max_len),), end="")
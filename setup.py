@@ -88,7 +88,7 @@ setup(name='PALEOMIX Pipeline',
       author='Mikkel Schubert',
       author_email='MSchubert@snm.ku.dk',
       url='https://github.com/MikkelSchubert/paleomix',
-      requires=['pysam (>=0.7.5)'],
+      requires=['pysam (>=0.7.5)', 'numpy (>=1.6)'],
       packages=locate_packages(),
       scripts=locate_scripts(),
       cmdclass={'install_scripts': InstallLinks})
@@ -185,6 +185,35 @@ def test_builder__add_or_set_option__empty_key():
 ################################################################################
 ## AtomicCmdBuilder: pop_option
 
+def test_builder__replace_option():
+    builder = AtomicCmdBuilder("find")
+    builder.set_option("-maxdepth", 1)
+    builder.set_option("-name", "*.txt")
+    builder.replace_option("-maxdepth", 2)
+    assert_equal(builder.call, ["find", "-maxdepth", 2, "-name", "*.txt"])
+    assert_raises(AtomicCmdBuilderError, builder.set_option, "-maxdepth", 3)
+
+def test_builder__replace_option__missing_option():
+    builder = AtomicCmdBuilder("find")
+    assert_raises(KeyError, builder.replace_option, "-maxdepth", 2)
+
+def test_builder__replace_option__after_finalize():
+    builder = AtomicCmdBuilder("find")
+    builder.set_option("-maxdepth", 1)
+    builder.finalize()
+    assert_raises(AtomicCmdBuilderError, builder.replace_option, "-maxdepth", 2)
+
+def test_builder__replace_option__after_unfinalize():
+    builder = AtomicCmdBuilder("find")
+    builder.set_option("-maxdepth", 1)
+    cmd_1 = builder.finalize()
+    builder.unfinalize()
+    builder.replace_option("-maxdepth", 2)
+    cmd_2 = builder.finalize()
+    assert cmd_1 is not cmd_2
+    assert_equal(builder.call, ["find", "-maxdepth", 2])
+
+
 def test_builder__pop_option():
     def _do_test_builder__pop_option(setter):
         builder = AtomicCmdBuilder("find")
@@ -121,6 +121,38 @@ def test_atomiccmd__set_cwd__temp_in_out():
 
 
 
+################################################################################
+################################################################################
+## Constructor: memory
+
+def test_atomiccmd__memory__default():
+    assert_equal(AtomicCmd("ls").memory, 0)
+
+def test_atomiccmd__memory__explicit():
+    assert_equal(AtomicCmd("ls", memory=1024).memory, 1024)
+
+def test_atomiccmd__memory__invalid_values():
+    assert_raises(ValueError, AtomicCmd, "ls", memory=-1)
+    assert_raises(ValueError, AtomicCmd, "ls", memory="1g")
+
+def test_atomiccmd__memory__java():
+    def _do_test_atomiccmd__memory__java(call, expected):
+        assert_equal(AtomicCmd(call).memory, expected)
+
+    # Heap-size plus 25% overhead for the JVM
+    yield _do_test_atomiccmd__memory__java, ("java", "-jar", "foo.jar"), 0
+    yield _do_test_atomiccmd__memory__java, ("java", "-Xmx4g", "-jar", "foo.jar"), 5120
+    yield _do_test_atomiccmd__memory__java, ("/usr/bin/java", "-Xmx512m"), 640
+    # The last -Xmx takes precedence
+    yield _do_test_atomiccmd__memory__java, ("java", "-Xmx1g", "-Xmx2g"), 2560
+    # -Xmx is only meaningful for java
+    yield _do_test_atomiccmd__memory__java, ("echo", "-Xmx4g"), 0
+
+def test_atomiccmd__memory__java__explicit():
+    assert_equal(AtomicCmd(("java", "-Xmx4g"), memory=1).memory, 1)
+
+
+
 ################################################################################
 ################################################################################
 ## Constructor: Paths / pipes
@@ -501,6 +533,51 @@ def test_atomiccmd__join_wait():
 
 
 
+################################################################################
+################################################################################
+## Resource usage
+
+@with_temp_folder
+def test_atomiccmd__resource_usage(temp_folder):
+    cmd = AtomicCmd(("dd", "if=/dev/zero", "of=%(TEMP_OUT_FILE)s",
+                     "bs=1024", "count=1024"),
+                    TEMP_OUT_FILE = "output",
+                    OUT_STDERR = "/dev/null")
+    assert_equal(cmd.resource_usage, None)
+    cmd.run(temp_folder)
+    assert_equal(cmd.join(), [0])
+
+    usage = cmd.resource_usage
+    assert_equal(sorted(usage), ["max_rss", "read_bytes", "system_time",
+                                 "user_time", "write_bytes"])
+    assert usage["user_time"] + usage["system_time"] >= 0
+    assert usage["max_rss"] > 0
+    # Writes may not have reached storage (e.g. on tmpfs)
+    assert usage["write_bytes"] >= 0
+
+
+@with_temp_folder
+def test_atomiccmd__resource_usage__ready(temp_folder):
+    cmd = AtomicCmd("true")
+    cmd.run(temp_folder)
+    while not cmd.ready():
+        pass
+    assert cmd.resource_usage is not None
+    assert_equal(cmd.join(), [0])
+    assert cmd.resource_usage is not None
+
+
+@with_temp_folder
+def test_atomiccmd__resource_usage__reaped_elsewhere(temp_folder):
+    cmd = AtomicCmd("false")
+    cmd.run(temp_folder)
+    while cmd._proc.poll() is None:
+        pass
+    assert_equal(cmd.join(), [1])
+    assert_equal(cmd.resource_usage, None)
+
+
+
 ################################################################################
 ################################################################################
 ## Terminate
@@ -149,6 +149,40 @@ def test_atomicsets__duplicate_cmds():
 
 
 
+def test_atomicsets__memory():
+    def _do_test_atomicsets__memory(cls, expected):
+        cmds = cls([AtomicCmd("true", memory=1024),
+                    AtomicCmd("false", memory=512),
+                    AtomicCmd("ls")])
+        assert_equal(cmds.memory, expected)
+
+    yield _do_test_atomicsets__memory, ParallelCmds, 1536
+    yield _do_test_atomicsets__memory, SequentialCmds, 1024
+
+
+
+def test_atomicsets__resource_usage():
+    def _usage(value):
+        return {"user_time": value, "system_time": value * 2,
+                "max_rss": value * 3, "read_bytes": value * 4,
+                "write_bytes": value * 5}
+
+    def _do_test_atomicsets__resource_usage(cls, expected_rss):
+        cmd_1, cmd_2, cmd_3 = [AtomicCmd("true") for _ in range(3)]
+        cmd_1._resource_usage = _usage(1)
+        cmd_2._resource_usage = _usage(2)
+        cmds = cls([cmd_1, cmd_2, cmd_3])
+
+        expected = _usage(3)
+        expected["max_rss"] = expected_rss
+        assert_equal(cmds.resource_usage, expected)
+        assert_equal(cls([cmd_3]).resource_usage, None)
+
+    yield _do_test_atomicsets__resource_usage, ParallelCmds, 9
+    yield _do_test_atomicsets__resource_usage, SequentialCmds, 6
+
+
+
 ################################################################################
 ################################################################################
 ## Parallel commands
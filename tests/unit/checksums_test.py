@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is herby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+import cPickle
+
+from nose.tools import \
+    assert_equal
+from flexmock import \
+    flexmock
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
+from pypeline.node import \
+    Node, \
+    MetaNode
+from pypeline.nodegraph import \
+    FileStatusCache
+import pypeline.checksums as checksums
+
+
+def _build_node(temp_folder, dependencies=()):
+    input_file = os.path.join(temp_folder, "input")
+    output_file = os.path.join(temp_folder, "output")
+    set_file_contents(input_file, "input data")
+    set_file_contents(output_file, "output data")
+    return Node(input_files=(input_file,),
+                output_files=(output_file,),
+                dependencies=dependencies)
+
+
+def _build_upstream_node(temp_folder):
+    source_file = os.path.join(temp_folder, "source")
+    set_file_contents(source_file, "source data")
+    return Node(input_files=(source_file,),
+                output_files=(os.path.join(temp_folder, "input"),))
+
+
+def _set_mtime(fpath, mtime):
+    os.utime(fpath, (mtime, mtime))
+
+
+def _is_outdated(node):
+    cache = checksums.ChecksumStatusCache(FileStatusCache())
+    return cache.files_up_to_date(node.input_files, node.output_files)
+
+
+###############################################################################
+###############################################################################
+# Manifests
+
+def test_manifest_path():
+    assert_equal(checksums.manifest_path(("foo/b.txt", "foo/a.txt")),
+                 "foo/.a.txt.checksums")
+    assert_equal(checksums.manifest_path(()), None)
+
+
+def test_is_manifest():
+    assert checksums.is_manifest("foo/.a.txt.checksums")
+    assert not checksums.is_manifest("foo/a.txt")
+
+
+@with_temp_folder
+def test_write_manifest(temp_folder):
+    node = _build_node(temp_folder)
+    checksums.write_manifest(node)
+    manifest = checksums.read_manifest(
+        checksums.manifest_path(node.output_files))
+
+    input_file, = node.input_files
+    assert_equal(manifest["inputs"][input_file][2],
+                 "812f45842bc6d66ee14572ce20db8e86")
+    output_file, = node.output_files
+    assert_equal(manifest["outputs"][output_file][2],
+                 "15fbcac9f5428dccd0c8bfc71628b7ba")
+
+
+@with_temp_folder
+def test_write_manifest__reuses_previous_manifest(temp_folder):
+    node = _build_node(temp_folder)
+    checksums.write_manifest(node)
+    known = checksums.known_checksums(node)
+    assert_equal(sorted(known), sorted(node.input_files | node.output_files))
+
+    flexmock(checksums).should_receive("_hash_file").never()
+    checksums.write_manifest(node, known)
+
+
+@with_temp_folder
+def test_producer_manifests(temp_folder):
+    upstream = _build_upstream_node(temp_folder)
+    unrelated = Node(input_files=upstream.input_files,
+                     output_files=(os.path.join(temp_folder, "other"),))
+    node = Node(input_files=upstream.output_files,
+                output_files=(os.path.join(temp_folder, "output"),),
+                dependencies=(MetaNode(subnodes=(upstream, unrelated)),))
+
+    expected = frozenset((checksums.manifest_path(upstream.output_files),))
+    assert_equal(checksums.producer_manifests(node), expected)
+    # Dependencies are not pickled, but the manifests are recorded
+    assert_equal(cPickle.loads(cPickle.dumps(node)).producer_manifests,
+                 expected)
+
+
+@with_temp_folder
+def test_write_manifest__reuses_upstream_manifest(temp_folder):
+    upstream = _build_upstream_node(temp_folder)
+    node = _build_node(temp_folder, (upstream,))
+    checksums.write_manifest(upstream)
+    # Nodes are run without their dependencies
+    node = cPickle.loads(cPickle.dumps(node))
+
+    # Only the output file of the node itself is hashed
+    output_file, = node.output_files
+    flexmock(checksums).should_receive("_hash_file") \
+        .with_args(output_file).and_return("X").once()
+    checksums.write_manifest(node, checksums.known_checksums(node))
+
+    manifest = checksums.read_manifest(
+        checksums.manifest_path(node.output_files))
+    input_file, = node.input_files
+    assert_equal(manifest["inputs"][input_file][2],
+                 "812f45842bc6d66ee14572ce20db8e86")
+
+
+###############################################################################
+###############################################################################
+# ChecksumStatusCache
+
+@with_temp_folder
+def test_checksums__no_manifest_uses_timestamps(temp_folder):
+    node = _build_node(temp_folder)
+    _set_mtime(iter(node.input_files).next(), 2000000000)
+    assert _is_outdated(node)
+
+
+@with_temp_folder
+def test_checksums__timestamps_changed__contents_unchanged(temp_folder):
+    node = _build_node(temp_folder)
+    checksums.write_manifest(node)
+    _set_mtime(iter(node.input_files).next(), 2000000000)
+    assert not _is_outdated(node)
+
+    # Manifest is updated; files are not re-hashed
+    flexmock(checksums).should_receive("_hash_file").never()
+    assert not _is_outdated(node)
+
+
+@with_temp_folder
+def test_checksums__contents_changed(temp_folder):
+    node = _build_node(temp_folder)
+    checksums.write_manifest(node)
+    input_file = iter(node.input_files).next()
+    set_file_contents(input_file, "new input data")
+    _set_mtime(input_file, 1000000000)
+    assert _is_outdated(node)
+
+
+@with_temp_folder
+def test_checksums__unchanged_files_are_not_hashed(temp_folder):
+    node = _build_node(temp_folder)
+    checksums.write_manifest(node)
+    flexmock(checksums).should_receive("_hash_file").never()
+    assert not _is_outdated(node)
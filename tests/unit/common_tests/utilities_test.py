@@ -373,6 +373,30 @@ def test_cumsum__initial():
 
 
 
+################################################################################
+################################################################################
+## Tests for 'parse_size'
+
+def test_parse_size__bytes():
+    assert_equal(utils.parse_size("1234"), 1234)
+    assert_equal(utils.parse_size(1234), 1234)
+
+def test_parse_size__suffixes():
+    assert_equal(utils.parse_size("2k"), 2 * 1024)
+    assert_equal(utils.parse_size("3M"), 3 * 1024 ** 2)
+    assert_equal(utils.parse_size("4g"), 4 * 1024 ** 3)
+    assert_equal(utils.parse_size("1T"), 1024 ** 4)
+
+def test_parse_size__invalid_values():
+    assert_raises(ValueError, utils.parse_size, "")
+    assert_raises(ValueError, utils.parse_size, "g")
+    assert_raises(ValueError, utils.parse_size, "-4g")
+    assert_raises(ValueError, utils.parse_size, "4gb")
+    assert_raises(ValueError, utils.parse_size, "1.5g")
+
+
+
+
 ################################################################################
 ################################################################################
 ## Tests for 'fast_pickle_test'
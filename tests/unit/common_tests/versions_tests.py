@@ -22,6 +22,7 @@
 #
 # Disable warnings on strange function names
 # pylint: disable=C0103
+import os
 import pickle
 import operator
 
@@ -33,6 +34,10 @@ from nose.tools import \
     assert_not_equal, \
     assert_raises
 
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
 import pypeline.common.versions as versions
 
 
@@ -722,3 +727,130 @@ def test_requirement_highest_priority_retained():
     obj2 = versions.Requirement("echo", "", versions.LT(1), priority=0)
     assert_is(obj1, obj2)
     assert_equal(obj2.priority, 5)
+
+
+###############################################################################
+###############################################################################
+## VersionCache
+
+def _write_tool(temp_folder, version, mtime=1000000000):
+    filename = os.path.join(temp_folder, "tool")
+    set_file_contents(filename, "#!/bin/sh\necho %s\n" % (version,))
+    os.chmod(filename, 0755)
+    os.utime(filename, (mtime, mtime))
+    return filename
+
+
+@with_temp_folder
+def test_version_cache__lookup(temp_folder):
+    call = (_write_tool(temp_folder, "v1.2"), "--version")
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    assert_equal(cache.lookup(call), None)
+    cache.store(call, "v1.2\n")
+    assert_equal(cache.lookup(call), "v1.2\n")
+    assert_equal(cache.lookup(call + ("foo",)), None)
+
+
+@with_temp_folder
+def test_version_cache__executable_changed(temp_folder):
+    call = (_write_tool(temp_folder, "v1.2"),)
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    cache.store(call, "v1.2\n")
+    _write_tool(temp_folder, "v1.2", mtime=1000000001)
+    assert_equal(cache.lookup(call), None)
+
+
+@with_temp_folder
+def test_version_cache__file_argument_changed(temp_folder):
+    jar_file = os.path.join(temp_folder, "tool.jar")
+    set_file_contents(jar_file, "foo")
+    call = (_write_tool(temp_folder, "v1.2"), "-jar", jar_file)
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    cache.store(call, "v1.2\n")
+    assert_equal(cache.lookup(call), "v1.2\n")
+    set_file_contents(jar_file, "foobar")
+    assert_equal(cache.lookup(call), None)
+
+
+@with_temp_folder
+def test_version_cache__missing_executable(temp_folder):
+    call = (os.path.join(temp_folder, "tool"),)
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    cache.store(call, "v1.2\n")
+    assert_equal(cache.lookup(call), None)
+
+
+@with_temp_folder
+def test_version_cache__save_and_load(temp_folder):
+    filename = os.path.join(temp_folder, "subdir", "cache")
+    call = (_write_tool(temp_folder, "v1.2"),)
+    cache = versions.VersionCache(filename)
+    cache.store(call, "v1.2\n")
+    assert cache.save()
+    assert_equal(versions.VersionCache(filename).lookup(call), "v1.2\n")
+
+
+@with_temp_folder
+def test_version_cache__corrupt_file(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    set_file_contents(filename, "not a pickle")
+    call = (_write_tool(temp_folder, "v1.2"),)
+    assert_equal(versions.VersionCache(filename).lookup(call), None)
+
+
+@with_temp_folder
+def test_version_cache__used_by_requirementobj(temp_folder):
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    call = (_write_tool(temp_folder, "v1.2"), "--version")
+    previous = versions.set_version_cache(cache)
+    try:
+        obj = versions.RequirementObj(call=call,
+                                      search=r"v(\d+)\.(\d+)",
+                                      checks=versions.Any())
+        assert_equal(obj.version, (1, 2))
+        assert_equal(cache.lookup(call), "v1.2\n")
+
+        # Same size and mtime; cached output is used by new objects
+        versions._CALL_CACHE.clear()
+        _write_tool(temp_folder, "v3.4")
+        obj = versions.RequirementObj(call=call,
+                                      search=r"v(\d+)\.(\d+)",
+                                      checks=versions.Any())
+        assert_equal(obj.version, (1, 2))
+    finally:
+        versions.set_version_cache(previous)
+
+
+@with_temp_folder
+def test_version_cache__failures_not_cached(temp_folder):
+    cache = versions.VersionCache(os.path.join(temp_folder, "cache"))
+    call = (_write_tool(temp_folder, "error"),)
+    previous = versions.set_version_cache(cache)
+    try:
+        obj = versions.RequirementObj(call=call,
+                                      search=r"v(\d+)\.(\d+)",
+                                      checks=versions.Any())
+        assert_raises(versions.VersionRequirementError, getattr, obj,
+                      "version")
+        assert_equal(cache.lookup(call), None)
+    finally:
+        versions.set_version_cache(previous)
+
+
+###############################################################################
+###############################################################################
+## prefetch
+
+@with_temp_folder
+def test_prefetch(temp_folder):
+    objs = []
+    for version in ("v1.2", "v3.4"):
+        call = _echo_version(version + os.path.basename(temp_folder))
+        objs.append(versions.RequirementObj(call=call,
+                                            search=r"v(\d+)\.(\d+)",
+                                            checks=versions.Any()))
+
+    versions.prefetch(objs)
+    for obj in objs:
+        assert obj._call in versions._CALL_CACHE
+    assert_equal([obj.version for obj in objs], [(1, 2), (3, 4)])
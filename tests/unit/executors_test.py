@@ -0,0 +1,525 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+import time
+import pickle
+import threading
+import multiprocessing.connection
+
+from flexmock import flexmock
+
+from nose.tools import \
+    assert_equal, \
+    assert_raises
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents, \
+    get_file_contents
+
+from pypeline.node import \
+    Node, \
+    NodeError, \
+    CommandNode
+from pypeline.atomiccmd.command import \
+    AtomicCmd
+from pypeline.scheduler import \
+    DEFAULT_COST
+from pypeline.executors.base import \
+    BaseExecutor, \
+    ExecutorError, \
+    TaskConfig, \
+    make_task, \
+    run_task, \
+    serialize_node
+from pypeline.executors.local import \
+    LocalExecutor
+from pypeline.executors.batch import \
+    BatchExecutor
+from pypeline.executors.remote import \
+    RemoteExecutor, \
+    WorkerServer, \
+    parse_address, \
+    read_secret
+
+
+_SECRET = "not-so-secret"
+
+
+class _FailingNode(Node):
+    def _run(self, _config, _temp):
+        raise NodeError("Node failed as expected")
+
+
+class _ExitingNode(Node):
+    def _run(self, _config, _temp):
+        os._exit(1)
+
+
+def _copy_node(temp_folder, name, threads=1, memory=None):
+    input_file = os.path.join(temp_folder, name + ".in")
+    set_file_contents(input_file, name)
+    command = AtomicCmd(("cp", "%(IN_FILE)s", "%(OUT_FILE)s"),
+                        IN_FILE=input_file,
+                        OUT_FILE=os.path.join(temp_folder, name + ".out"))
+    return CommandNode(command, threads=threads, memory=memory)
+
+
+def _run_all(executor, nodes, config):
+    for (key, node) in enumerate(nodes):
+        executor.start(key, node, make_task(serialize_node(node), config))
+
+    results = {}
+    while len(results) < len(nodes):
+        result = executor.wait()
+        if result is not None:
+            results[result[0]] = result[1:]
+    return results
+
+
+def _start_workers(count, threads):
+    servers, serving = [], []
+    for _ in xrange(count):
+        server = WorkerServer(("localhost", 0), _SECRET, threads)
+        thread = threading.Thread(target=server.serve, args=(1,))
+        thread.start()
+        servers.append(server)
+        serving.append(thread)
+    return servers, serving
+
+
+def _stop_workers(servers, serving):
+    for thread in serving:
+        thread.join()
+    for server in servers:
+        server.close()
+
+
+###############################################################################
+###############################################################################
+# Task descriptors
+
+@with_temp_folder
+def test_run_task(temp_folder):
+    node = _copy_node(temp_folder, "a")
+    task = make_task(serialize_node(node), TaskConfig(temp_folder))
+    stats = run_task(task)
+    assert stats["wall_time"] >= 0
+    assert_equal(get_file_contents(os.path.join(temp_folder, "a.out")), "a")
+
+
+def test_run_task__wrong_version():
+    task = make_task(serialize_node(Node()), TaskConfig("/tmp"))
+    assert_raises(ExecutorError, run_task, (-1,) + task[1:])
+
+
+def test_make_task__config():
+    config = flexmock(temp_root="/tmp/foo", content_checksums=True,
+                      unused="bar")
+    task = make_task("payload", config)
+    assert "bar" not in task
+    assert_equal(task[1:], ("payload", "/tmp/foo", True))
+
+
+def test_serialize_node__unpicklable():
+    node = Node()
+    node.unpicklable = lambda: None
+    assert_raises(pickle.PicklingError, serialize_node, node)
+
+
+def test_base_executor__terminate_defaults_to_close():
+    executor = BaseExecutor(1)
+    flexmock(executor).should_receive("close").once()
+    executor.terminate()
+
+
+###############################################################################
+###############################################################################
+# LocalExecutor
+
+@with_temp_folder
+def test_local_executor(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, "a"), _FailingNode()]
+    executor = LocalExecutor(2)
+    try:
+        assert_equal(executor.max_threads, 2)
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    error, stats = results[0]
+    assert_equal(error, None)
+    assert stats["wall_time"] >= 0
+    assert_equal(get_file_contents(os.path.join(temp_folder, "a.out")), "a")
+
+    error, stats = results[1]
+    assert isinstance(error, NodeError)
+    assert_equal(stats, None)
+
+
+@with_temp_folder
+def test_local_executor__reuses_workers(temp_folder):
+    config = TaskConfig(temp_folder)
+    executor = LocalExecutor(2)
+    try:
+        for name in ("a", "b", "c"):
+            _run_all(executor, [_copy_node(temp_folder, name)], config)
+        assert_equal(len(executor._idle), 1)
+    finally:
+        executor.close()
+
+    assert_equal(get_file_contents(os.path.join(temp_folder, "c.out")), "c")
+
+
+@with_temp_folder
+def test_local_executor__worker_lost(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_ExitingNode(), _copy_node(temp_folder, "a")]
+    executor = LocalExecutor(2)
+    try:
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    error, stats = results[0]
+    assert isinstance(error, ExecutorError)
+    assert_equal(stats, None)
+    assert_equal(results[1][0], None)
+
+
+def test_local_executor__nothing_running():
+    executor = LocalExecutor(1)
+    try:
+        assert_equal(executor.wait(blocking=False), None)
+    finally:
+        executor.close()
+
+
+def _is_process_alive(pid):
+    try:
+        with open("/proc/%i/stat" % (pid,)) as handle:
+            stat = handle.read()
+    except IOError:
+        return False
+    # Zombies are not reaped if the init process does not do so
+    return stat[stat.rindex(")") + 2] != "Z"
+
+
+def _start_sleeping_node(executor, temp_folder):
+    """Starts a long-running command, returning the PID of the command."""
+    pid_file = os.path.join(temp_folder, "pid")
+    command = AtomicCmd(("sh", "-c", "echo $$ > %s; exec sleep 30"
+                         % (pid_file,)))
+    node = CommandNode(command)
+    executor.start(0, node, make_task(serialize_node(node),
+                                      TaskConfig(temp_folder)))
+    for _ in xrange(100):
+        if os.path.exists(pid_file) and get_file_contents(pid_file):
+            break
+        time.sleep(0.1)
+    pid = int(get_file_contents(pid_file))
+    assert _is_process_alive(pid)
+    return pid
+
+
+@with_temp_folder
+def test_local_executor__terminate(temp_folder):
+    executor = LocalExecutor(1)
+    try:
+        pid = _start_sleeping_node(executor, temp_folder)
+    finally:
+        start_time = time.time()
+        executor.terminate()
+
+    assert time.time() - start_time < 10
+    assert not _is_process_alive(pid)
+    assert_equal(executor.process_ids(), {})
+
+
+###############################################################################
+###############################################################################
+# RemoteExecutor
+
+@with_temp_folder
+def test_remote_executor(temp_folder):
+    config = TaskConfig(temp_folder)
+    servers, serving = _start_workers(2, 1)
+    executor = RemoteExecutor([server.address for server in servers], _SECRET)
+    try:
+        assert_equal(executor.max_threads, 2)
+        nodes = [_copy_node(temp_folder, name, threads)
+                 for (name, threads) in (("a", 1), ("b", 1), ("c", 4))]
+        nodes.append(_FailingNode())
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+        _stop_workers(servers, serving)
+
+    for (key, name) in enumerate("abc"):
+        error, stats = results[key]
+        assert_equal(error, None)
+        assert stats["wall_time"] >= 0
+        assert_equal(get_file_contents(os.path.join(temp_folder,
+                                                    name + ".out")), name)
+
+    error, stats = results[3]
+    assert isinstance(error, NodeError)
+    assert_equal(stats, None)
+
+
+@with_temp_folder
+def test_remote_executor__terminate(temp_folder):
+    servers, serving = _start_workers(1, 1)
+    executor = RemoteExecutor([servers[0].address], _SECRET)
+    try:
+        pid = _start_sleeping_node(executor, temp_folder)
+    finally:
+        start_time = time.time()
+        executor.terminate()
+        _stop_workers(servers, serving)
+
+    assert time.time() - start_time < 10
+    assert not _is_process_alive(pid)
+
+
+def test_remote_executor__wrong_secret():
+    servers, serving = _start_workers(1, 1)
+    try:
+        assert_raises(ExecutorError, RemoteExecutor,
+                      [servers[0].address], "wrong secret")
+        # Connection is rejected; allow the server to finish
+        RemoteExecutor([servers[0].address], _SECRET).close()
+    finally:
+        _stop_workers(servers, serving)
+
+
+def test_remote_executor__no_worker():
+    # Client retries refused connections for 20s; fail immediately instead
+    flexmock(multiprocessing.connection).should_receive("Client") \
+        .and_raise(IOError("Connection refused"))
+    assert_raises(ExecutorError, RemoteExecutor, [("localhost", 1)], _SECRET)
+
+
+###############################################################################
+###############################################################################
+# BatchExecutor
+
+# Fake submit command, running jobs in the background using the PID as job ID
+_FAKE_SUBMIT = """#!/bin/sh
+echo "$@" >> "%s"
+eval "sh \\"\\${$#}\\"" > /dev/null 2>&1 &
+echo "Submitted batch job $!"
+"""
+
+
+def _batch_executor(temp_folder, submit_script=_FAKE_SUBMIT, **kwargs):
+    submit = os.path.join(temp_folder, "submit.sh")
+    set_file_contents(submit, submit_script % (submit + ".log",))
+    return BatchExecutor(max_threads=4,
+                         submit_cmd="sh %s --threads={threads} "
+                                    "--memory={memory}" % (submit,),
+                         root=os.path.join(temp_folder, "jobs"),
+                         poll_interval=0.05,
+                         **kwargs)
+
+
+def _submissions(temp_folder):
+    filename = os.path.join(temp_folder, "submit.sh.log")
+    return get_file_contents(filename).strip().split("\n")
+
+
+def _failing_command_node():
+    return CommandNode(AtomicCmd(("false",)))
+
+
+def _estimate_runtime(_node):
+    # Recorded runtimes marking every node as cheap
+    return 1.0
+
+
+@with_temp_folder
+def test_batch_executor(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, "a"),
+             _copy_node(temp_folder, "b"),
+             _copy_node(temp_folder, "c", threads=2),
+             _failing_command_node()]
+    executor = _batch_executor(temp_folder)
+    executor.set_runtime_estimates(_estimate_runtime)
+    try:
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    for (key, name) in enumerate("abc"):
+        error, stats = results[key]
+        assert_equal(error, None)
+        assert stats["wall_time"] >= 0
+        assert_equal(get_file_contents(os.path.join(temp_folder,
+                                                    name + ".out")), name)
+
+    error, stats = results[3]
+    assert isinstance(error, NodeError)
+    assert_equal(stats, None)
+
+    # Small nodes are bundled into a single job
+    submissions = sorted(line.split()[0] for line in _submissions(temp_folder))
+    assert_equal(submissions, ["--threads=1", "--threads=2"])
+
+
+@with_temp_folder
+def test_batch_executor__bundle_size(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, name) for name in "abc"]
+    executor = _batch_executor(temp_folder, bundle_size=2)
+    executor.set_runtime_estimates(_estimate_runtime)
+    try:
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    assert_equal([error for (error, _) in results.itervalues()],
+                 [None, None, None])
+    assert_equal(len(_submissions(temp_folder)), 2)
+
+
+@with_temp_folder
+def test_batch_executor__unknown_costs_are_not_bundled(temp_folder):
+    # CommandNodes are not known to be cheap, and have no recorded runtimes
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, name) for name in "ab"]
+    executor = _batch_executor(temp_folder)
+    executor.set_runtime_estimates(lambda _node: None)
+    try:
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    assert_equal([error for (error, _) in results.itervalues()], [None, None])
+    assert_equal(len(_submissions(temp_folder)), 2)
+
+
+@with_temp_folder
+def test_batch_executor__expensive_nodes_are_not_bundled(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, name) for name in "ab"]
+    executor = _batch_executor(temp_folder)
+    executor.set_runtime_estimates(lambda _node: DEFAULT_COST)
+    try:
+        results = _run_all(executor, nodes, config)
+    finally:
+        executor.close()
+
+    assert_equal([error for (error, _) in results.itervalues()], [None, None])
+    assert_equal(len(_submissions(temp_folder)), 2)
+
+
+@with_temp_folder
+def test_batch_executor__default_memory(temp_folder):
+    config = TaskConfig(temp_folder)
+    nodes = [_copy_node(temp_folder, "a"),
+             _copy_node(temp_folder, "b", memory=500)]
+    executor = _batch_executor(temp_folder, "echo $@ >> %s; echo 1234",
+                               default_memory=123)
+    for (key, node) in enumerate(nodes):
+        executor.start(key, node, make_task(serialize_node(node), config))
+    executor.close()
+
+    submissions = sorted(line.split()[1] for line in _submissions(temp_folder))
+    assert_equal(submissions, ["--memory=123", "--memory=500"])
+
+
+@with_temp_folder
+def test_batch_executor__terminate(temp_folder):
+    # Jobs are never run, and are cancelled when the pipeline is terminated
+    config = TaskConfig(temp_folder)
+    cancel = os.path.join(temp_folder, "cancel.sh")
+    set_file_contents(cancel, "echo $@ > %s.log" % (cancel,))
+    executor = _batch_executor(temp_folder, "echo $@ >> %s; echo 1234",
+                               cancel_cmd="sh %s --cancel" % (cancel,))
+
+    node = _copy_node(temp_folder, "a")
+    executor.start(0, node, make_task(serialize_node(node), config))
+    executor.terminate()
+
+    assert_equal(get_file_contents(cancel + ".log"), "--cancel 1234\n")
+
+
+@with_temp_folder
+def test_batch_executor__submit_failed(temp_folder):
+    config = TaskConfig(temp_folder)
+    executor = _batch_executor(temp_folder, "echo $@ > %s; exit 1")
+    try:
+        results = _run_all(executor, [_copy_node(temp_folder, "a")], config)
+    finally:
+        executor.close()
+
+    error, stats = results[0]
+    assert isinstance(error, ExecutorError)
+    assert_equal(stats, None)
+
+
+@with_temp_folder
+def test_batch_executor__job_lost(temp_folder):
+    # Job is never run, and the status command reports that it is gone
+    config = TaskConfig(temp_folder)
+    executor = _batch_executor(temp_folder, "echo $@ > %s; echo 1234",
+                               status_cmd="true")
+    try:
+        results = _run_all(executor, [_copy_node(temp_folder, "a")], config)
+    finally:
+        executor.close()
+
+    error, stats = results[0]
+    assert isinstance(error, ExecutorError)
+    assert_equal(stats, None)
+
+
+###############################################################################
+###############################################################################
+# Misc functions
+
+def test_parse_address():
+    assert_equal(parse_address("host"), ("host", 24578))
+    assert_equal(parse_address("host:1234"), ("host", 1234))
+    assert_raises(ValueError, parse_address, "host:abc")
+
+
+@with_temp_folder
+def test_read_secret(temp_folder):
+    filename = os.path.join(temp_folder, "secret")
+    set_file_contents(filename, "foobar\n")
+    assert_equal(read_secret(filename), "foobar")
+
+
+@with_temp_folder
+def test_read_secret__empty_or_missing(temp_folder):
+    filename = os.path.join(temp_folder, "secret")
+    assert_raises(ExecutorError, read_secret, filename)
+    set_file_contents(filename, "\n")
+    assert_raises(ExecutorError, read_secret, filename)
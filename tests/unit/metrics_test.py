@@ -0,0 +1,215 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+import json
+import socket
+import urllib2
+
+from nose.tools import \
+    assert_equal, \
+    assert_raises
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
+from pypeline.node import \
+    Node
+from pypeline.nodegraph import \
+    NodeGraph
+from pypeline.scheduler import \
+    RunableQueue
+from pypeline.metrics import \
+    PipelineMetrics, \
+    MetricsServer, \
+    parse_address, \
+    _read_process_table, \
+    _process_tree_usage
+
+
+def _build_chain(temp_folder, length):
+    input_file = os.path.join(temp_folder, "input")
+    set_file_contents(input_file, "data")
+
+    nodes = []
+    for index in xrange(length):
+        output_file = os.path.join(temp_folder, "node_%i" % (index,))
+        node = Node(description="node_%i" % (index,),
+                    input_files=(input_file,),
+                    output_files=(output_file,),
+                    dependencies=nodes[-1:])
+        nodes.append(node)
+        input_file = output_file
+    return nodes
+
+
+def _build_metrics(temp_folder, process_ids=None):
+    nodes = _build_chain(temp_folder, 3)
+    nodegraph = NodeGraph(nodes[-1:])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    metrics = PipelineMetrics(runable, process_ids)
+    nodegraph.add_state_observer(metrics)
+    return nodegraph, nodes, metrics
+
+
+###############################################################################
+###############################################################################
+# PipelineMetrics
+
+@with_temp_folder
+def test_metrics__refresh(temp_folder):
+    _, _, metrics = _build_metrics(temp_folder)
+    snapshot = metrics.snapshot()
+
+    assert_equal(snapshot["states"], {"done": 0, "running": 0, "runable": 1,
+                                      "queued": 2, "outdated": 0,
+                                      "failed": 0})
+    assert_equal(snapshot["queue_depth"], 1)
+    assert_equal(snapshot["threads"], 0)
+    assert_equal(snapshot["running"], [])
+
+
+@with_temp_folder
+def test_metrics__running_nodes(temp_folder):
+    nodegraph, nodes, metrics = \
+        _build_metrics(temp_folder, lambda: {nodes[0]: os.getpid()})
+    nodegraph.set_node_state(nodes[0], NodeGraph.RUNNING)
+    snapshot = metrics.snapshot()
+
+    assert_equal(snapshot["states"]["running"], 1)
+    assert_equal(snapshot["states"]["runable"], 0)
+    assert_equal(snapshot["queue_depth"], 0)
+    assert_equal(snapshot["threads"], 1)
+    assert_equal(len(snapshot["running"]), 1)
+
+    running = snapshot["running"][0]
+    assert_equal(running["node"], "node_0")
+    assert_equal(running["pid"], os.getpid())
+    assert running["processes"] >= 1
+    assert running["rss"] > 0
+
+
+@with_temp_folder
+def test_metrics__running_nodes__no_pid(temp_folder):
+    nodegraph, nodes, metrics = _build_metrics(temp_folder, dict)
+    nodegraph.set_node_state(nodes[0], NodeGraph.RUNNING)
+    running = metrics.snapshot()["running"][0]
+
+    assert_equal(running["pid"], None)
+    assert_equal(running["cpu_time"], None)
+    assert_equal(running["rss"], None)
+
+
+@with_temp_folder
+def test_metrics__finished_nodes(temp_folder):
+    nodegraph, nodes, metrics = _build_metrics(temp_folder)
+    nodegraph.set_node_state(nodes[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(nodes[0], NodeGraph.DONE)
+    nodegraph.set_node_state(nodes[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(nodes[1], NodeGraph.ERROR)
+    snapshot = metrics.snapshot()
+
+    assert_equal(snapshot["states"]["done"], 1)
+    assert_equal(snapshot["states"]["failed"], 2)
+    assert_equal(snapshot["finished"], 1)
+    assert_equal(snapshot["failed"], 1)
+    assert snapshot["throughput"] > 0
+    assert_equal(snapshot["running"], [])
+
+
+###############################################################################
+###############################################################################
+# MetricsServer
+
+@with_temp_folder
+def test_metrics_server__tcp(temp_folder):
+    _, _, metrics = _build_metrics(temp_folder)
+    server = MetricsServer("localhost:0", metrics)
+    try:
+        url = "http://localhost:%i/metrics" % (server.address[1],)
+        snapshot = json.load(urllib2.urlopen(url))
+        assert_equal(snapshot["states"]["runable"], 1)
+
+        url = "http://localhost:%i/foo" % (server.address[1],)
+        assert_raises(urllib2.HTTPError, urllib2.urlopen, url)
+    finally:
+        server.close()
+
+
+@with_temp_folder
+def test_metrics_server__unix_socket(temp_folder):
+    _, _, metrics = _build_metrics(temp_folder)
+    filename = os.path.join(temp_folder, "metrics.sock")
+    set_file_contents(filename, "stale")
+    server = MetricsServer(filename, metrics)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(filename)
+        client.sendall("GET / HTTP/1.0\r\n\r\n")
+        response = "".join(iter(lambda: client.recv(4096), ""))
+        client.close()
+
+        header, body = response.split("\r\n\r\n", 1)
+        assert header.startswith("HTTP/1.0 200")
+        assert_equal(json.loads(body)["states"]["queued"], 2)
+    finally:
+        server.close()
+    assert not os.path.exists(filename)
+
+
+def test_parse_address():
+    assert_equal(parse_address("8080"), ("localhost", 8080))
+    assert_equal(parse_address("0.0.0.0:8080"), ("0.0.0.0", 8080))
+    assert_equal(parse_address("/tmp/metrics"), "/tmp/metrics")
+    assert_raises(ValueError, parse_address, "localhost")
+
+
+###############################################################################
+###############################################################################
+# Process usage
+
+def test_process_tree_usage():
+    table = {1: (0, 1.0, 100),
+             2: (1, 2.0, 200),
+             3: (2, 4.0, 400),
+             4: (1, 8.0, 800),
+             5: (0, 16.0, 1600)}
+
+    assert_equal(_process_tree_usage(table, 1), (4, 15.0, 1500))
+    assert_equal(_process_tree_usage(table, 2), (2, 6.0, 600))
+    assert_equal(_process_tree_usage(table, 5), (1, 16.0, 1600))
+    assert_equal(_process_tree_usage(table, 6), (None, None, None))
+
+
+def test_read_process_table():
+    table = _read_process_table()
+    if table:  # /proc is not available on all systems
+        parent_pid, cpu_time, rss = table[os.getpid()]
+        assert_equal(parent_pid, os.getppid())
+        assert cpu_time > 0
+        assert rss > 0
@@ -249,6 +249,65 @@ def test_constuctor__threads_meta():
     node = MetaNode()
     assert_equal(node.threads, 1)
 
+def test_set_threads__fixed():
+    def _do_test_set_threads__fixed(cls):
+        node = cls(threads = 2)
+        assert_equal(node.thread_range, (2, 2))
+        node.set_threads(2)
+        assert_raises(NodeError, node.set_threads, 1)
+        assert_raises(NodeError, node.set_threads, 3)
+        assert_equal(node.threads, 2)
+    for cls in (Node, _CommandNodeWrap):
+        yield _do_test_set_threads__fixed, cls
+
+def test_set_threads__range():
+    class _RangeNode(Node):
+        @property
+        def thread_range(self):
+            return (2, None)
+
+        def _set_threads(self, threads):
+            calls.append(threads)
+
+    calls = []
+    node = _RangeNode(threads = 4)
+    node.set_threads(4)
+    node.set_threads(16)
+    assert_raises(NodeError, node.set_threads, 1)
+    assert_equal(node.threads, 16)
+    assert_equal(calls, [16])
+
+
+
+################################################################################
+################################################################################
+## *Node: Constructor tests: memory
+
+def test_constructor__memory():
+    def _do_test_constructor__memory(cls, memory):
+        node = cls(memory = memory)
+        assert_equal(node.memory, memory)
+    for cls in (Node, _CommandNodeWrap):
+        yield _do_test_constructor__memory, cls, 0
+        yield _do_test_constructor__memory, cls, 4096L
+
+def test_constructor__memory_invalid_values():
+    def _do_test_constructor__memory_invalid_values(cls, memory, exception):
+        assert_raises(exception, cls, memory = memory)
+    for cls in (Node, _CommandNodeWrap):
+        yield _do_test_constructor__memory_invalid_values, cls, -1, ValueError
+        yield _do_test_constructor__memory_invalid_values, cls, "1", TypeError
+        yield _do_test_constructor__memory_invalid_values, cls, 2.7, TypeError
+
+def test_constructor__memory_default():
+    assert_equal(Node().memory, 0)
+    assert_equal(MetaNode().memory, 0)
+    assert_equal(_CommandNodeWrap().memory, 0)
+
+def test_constructor__memory_from_command():
+    command = AtomicCmd(("java", "-Xmx4g", "-jar", "foo.jar"))
+    assert_equal(CommandNode(command).memory, 5120)
+
 
 
 
@@ -42,8 +42,12 @@ from pypeline.common.testing import \
     set_file_contents, \
     get_file_contents
 
+from pypeline.node import \
+    Node, \
+    MetaNode
 from pypeline.nodegraph import \
     NodeGraph, \
+    NodeGraphError, \
     FileStatusCache
 
 
@@ -127,3 +131,291 @@ def test_nodegraph_is_outdated__updates():
     my_node = flexmock(input_files=("tests/data/timestamp_a_younger",),
                        output_files=("tests/data/timestamp_a_older",))
     assert NodeGraph._is_outdated(my_node, FileStatusCache())
+
+
+###############################################################################
+###############################################################################
+# FileStatusCache: prefetch
+
+@with_temp_folder
+def test_filestatuscache_prefetch__same_as_get_state(temp_folder):
+    fpaths = []
+    for dirname in ("a", "b", "c"):
+        os.mkdir(os.path.join(temp_folder, dirname))
+        for index in xrange(6):
+            fpath = os.path.join(temp_folder, dirname, "file_%i" % (index,))
+            if index % 2:
+                set_file_contents(fpath, "data")
+            fpaths.append(fpath)
+    fpaths.append(os.path.join(temp_folder, "missing", "file"))
+    fpaths.extend(_IN_FILES)
+
+    expected = [(os.path.getmtime(fpath) if os.path.exists(fpath) else None)
+                for fpath in fpaths]
+
+    cache = FileStatusCache()
+    cache.prefetch(fpaths)
+    flexmock(FileStatusCache).should_receive("_get_mtime").never()
+    assert_equal([cache._get_state(fpath) for fpath in fpaths], expected)
+
+
+@with_temp_folder
+def test_filestatuscache_prefetch__listdir_skips_missing_files(temp_folder):
+    fpaths = [os.path.join(temp_folder, "file_%i" % (index,))
+              for index in xrange(10)]
+    set_file_contents(fpaths[0], "data")
+
+    flexmock(FileStatusCache).should_call("_get_mtime").once()
+    cache = FileStatusCache()
+    cache.prefetch(fpaths)
+    assert_equal(cache.missing_files(fpaths), fpaths[1:])
+
+
+def test_filestatuscache_prefetch__missing_folder():
+    fpaths = ["tests/data/missing_folder/file_%i" % (index,)
+              for index in xrange(10)]
+
+    flexmock(FileStatusCache).should_receive("_get_mtime").never()
+    cache = FileStatusCache()
+    cache.prefetch(fpaths)
+    assert_equal(cache.missing_files(fpaths), fpaths)
+
+
+###############################################################################
+###############################################################################
+# NodeGraph: States
+
+class _MissingFilesCache(FileStatusCache):
+    """Cache reporting all files as missing."""
+
+    def prefetch(self, fpaths):
+        pass
+
+    def _get_state(self, fpath):
+        return None
+
+
+class _StateRecorder(object):
+    def __init__(self):
+        self.changes = []
+
+    def refresh(self, _nodegraph):
+        pass
+
+    def state_changed(self, node, old_state, new_state, is_primary):
+        self.changes.append((node, old_state, new_state, is_primary))
+
+    def nodes_added(self, _nodegraph, nodes):
+        self.changes.append(("added", nodes))
+
+
+def _build_chain(length, name="chain"):
+    nodes = []
+    input_file = "tests/data/empty_file_1"
+    for index in xrange(length):
+        output_file = "/nonexistant/%s_%i" % (name, index)
+        nodes.append(Node(input_files=input_file,
+                          output_files=output_file,
+                          dependencies=nodes[-1:]))
+        input_file = output_file
+    return nodes
+
+
+def test_nodegraph__deep_graph():
+    nodes = _build_chain(2500)
+    nodegraph = NodeGraph(nodes[-1:], _MissingFilesCache)
+    assert_equal(nodegraph.get_node_state(nodes[0]), NodeGraph.RUNABLE)
+    assert_equal(nodegraph.get_node_state(nodes[-1]), NodeGraph.QUEUED)
+
+    nodegraph.set_node_state(nodes[0], NodeGraph.ERROR)
+    assert_equal(nodegraph.get_node_state(nodes[-1]), NodeGraph.ERROR)
+
+
+def test_nodegraph__set_node_state__propagation():
+    chain_a = _build_chain(2, "a")
+    chain_b = _build_chain(2, "b")
+    final = Node(input_files=chain_a[-1].output_files | chain_b[-1].output_files,
+                 output_files="/nonexistant/final",
+                 dependencies=(chain_a[-1], chain_b[-1]))
+    nodegraph = NodeGraph(final, _MissingFilesCache)
+    recorder = _StateRecorder()
+    nodegraph.add_state_observer(recorder)
+
+    nodegraph.set_node_state(chain_a[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_a[0], NodeGraph.DONE)
+    nodegraph.set_node_state(chain_a[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_a[1], NodeGraph.DONE)
+    assert_equal(nodegraph.get_node_state(final), NodeGraph.QUEUED)
+
+    nodegraph.set_node_state(chain_b[0], NodeGraph.ERROR)
+    assert_equal(recorder.changes[-3:],
+                 [(chain_b[0], NodeGraph.RUNABLE, NodeGraph.ERROR, True),
+                  (chain_b[1], NodeGraph.QUEUED, NodeGraph.ERROR, False),
+                  (final, NodeGraph.QUEUED, NodeGraph.ERROR, False)])
+
+
+def test_nodegraph__metanode_running():
+    chain = _build_chain(2)
+    meta = MetaNode(subnodes=chain)
+    nodegraph = NodeGraph(meta, _MissingFilesCache)
+    assert_equal(nodegraph.get_node_state(meta), NodeGraph.QUEUED)
+    nodegraph.set_node_state(chain[0], NodeGraph.RUNNING)
+    assert_equal(nodegraph.get_node_state(meta), NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain[0], NodeGraph.DONE)
+    assert_equal(nodegraph.get_node_state(meta), NodeGraph.QUEUED)
+    nodegraph.set_node_state(chain[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain[1], NodeGraph.DONE)
+    assert_equal(nodegraph.get_node_state(meta), NodeGraph.DONE)
+
+
+def test_nodegraph__iterflat_is_topologically_sorted():
+    chain = _build_chain(10)
+    nodegraph = NodeGraph(MetaNode(dependencies=chain[-1]), _MissingFilesCache)
+    nodes = list(nodegraph.iterflat())
+    assert_equal(len(nodes), 11)
+    for (index, node) in enumerate(nodes):
+        for dependency in node.dependencies | node.subnodes:
+            assert nodes.index(dependency) < index
+
+
+###############################################################################
+###############################################################################
+# NodeGraph: File dependencies
+
+def test_nodegraph__input_dependencies__indirect_dependency():
+    # Final node depends on the first node only via the rest of the chain
+    chain = _build_chain(4)
+    final = Node(input_files=chain[0].output_files,
+                 output_files="/nonexistant/final",
+                 dependencies=chain[-1])
+    NodeGraph(final, _MissingFilesCache)
+
+
+def test_nodegraph__input_dependencies__via_subnodes():
+    chain = _build_chain(2)
+    meta = MetaNode(subnodes=chain)
+    final = Node(input_files=chain[0].output_files,
+                 output_files="/nonexistant/final",
+                 dependencies=meta)
+    NodeGraph(final, _MissingFilesCache)
+
+
+def test_nodegraph__input_dependencies__missing_dependency():
+    chain_a = _build_chain(3, "a")
+    chain_b = _build_chain(3, "b")
+    final = Node(input_files=chain_a[0].output_files,
+                 output_files="/nonexistant/final",
+                 dependencies=chain_b[-1])
+    assert_raises(NodeGraphError, NodeGraph, (final, chain_a[-1]),
+                  _MissingFilesCache)
+
+
+def test_nodegraph__input_dependencies__deep_graph():
+    # Every node in the chain requires the output of the first node
+    nodes = [Node(input_files="tests/data/empty_file_1",
+                  output_files="/nonexistant/first")]
+    for index in xrange(2500):
+        nodes.append(Node(input_files=("/nonexistant/first",),
+                          output_files="/nonexistant/node_%i" % (index,),
+                          dependencies=nodes[-1]))
+    NodeGraph(nodes[-1], _MissingFilesCache)
+
+
+###############################################################################
+###############################################################################
+# NodeGraph: Adding and pruning nodes
+
+def test_nodegraph__add_nodes():
+    chain = _build_chain(2)
+    nodegraph = NodeGraph(chain[0], _MissingFilesCache)
+    recorder = _StateRecorder()
+    nodegraph.add_state_observer(recorder)
+    nodegraph.set_node_state(chain[0], NodeGraph.RUNNING)
+
+    assert_equal(nodegraph.add_nodes(chain[1]), [chain[1]])
+    assert_equal(recorder.changes[-1], ("added", [chain[1]]))
+    assert_equal(list(nodegraph), [chain[1]])
+    assert_equal(nodegraph.get_node_state(chain[1]), NodeGraph.QUEUED)
+
+    nodegraph.set_node_state(chain[0], NodeGraph.DONE)
+    assert_equal(nodegraph.get_node_state(chain[1]), NodeGraph.RUNABLE)
+
+
+def test_nodegraph__add_nodes__existing_nodes():
+    chain = _build_chain(2)
+    nodegraph = NodeGraph(chain[-1], _MissingFilesCache)
+
+    assert_equal(nodegraph.add_nodes(chain), [])
+    assert_equal(list(nodegraph.iterflat()), chain)
+
+
+def test_nodegraph__add_nodes__failed_checks():
+    chain_a = _build_chain(2, "a")
+    chain_b = _build_chain(2, "b")
+    final = Node(input_files=chain_a[0].output_files,
+                 output_files="/nonexistant/final",
+                 dependencies=chain_b[-1])
+    nodegraph = NodeGraph(chain_a[-1], _MissingFilesCache)
+
+    assert_raises(NodeGraphError, nodegraph.add_nodes, (final, chain_a[-1]))
+    assert_equal(list(nodegraph.iterflat()), chain_a)
+
+
+def test_nodegraph__prune():
+    chain_a = _build_chain(2, "a")
+    chain_b = _build_chain(2, "b")
+    nodegraph = NodeGraph(chain_a + chain_b, _MissingFilesCache)
+    for node in chain_a + chain_b[:1]:
+        nodegraph.set_node_state(node, NodeGraph.RUNNING)
+        nodegraph.set_node_state(node, NodeGraph.DONE)
+
+    # chain_b[0] is required by chain_b[1], which is not done
+    assert_equal(nodegraph.prune(), 2)
+    assert_equal(list(nodegraph.iterflat()), chain_b)
+    assert_equal(list(nodegraph), chain_b[-1:])
+    assert_equal(nodegraph.get_node_state(chain_b[1]), NodeGraph.RUNABLE)
+
+    nodegraph.set_node_state(chain_b[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_b[1], NodeGraph.DONE)
+    assert_equal(nodegraph.prune(), 2)
+    assert_equal(list(nodegraph.iterflat()), [])
+
+
+def test_nodegraph__prune__min_fraction():
+    chain_a = _build_chain(2, "a")
+    chain_b = _build_chain(2, "b")
+    nodegraph = NodeGraph(chain_a + chain_b, _MissingFilesCache)
+    nodegraph.set_node_state(chain_a[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_a[0], NodeGraph.DONE)
+
+    # Only 1 of 4 nodes are DONE
+    assert_equal(nodegraph.prune(0.5), 0)
+    nodegraph.set_node_state(chain_a[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_a[1], NodeGraph.DONE)
+    nodegraph.set_node_state(chain_b[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_b[0], NodeGraph.DONE)
+    assert_equal(nodegraph.prune(0.5), 2)
+
+    # chain_b[0] was kept, and is not counted again
+    assert_equal(nodegraph.prune(0.5), 0)
+    nodegraph.set_node_state(chain_b[1], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain_b[1], NodeGraph.DONE)
+    assert_equal(nodegraph.prune(0.5), 2)
+
+
+def test_nodegraph__prune__readd_nodes():
+    chain = _build_chain(2)
+    nodegraph = NodeGraph(chain[0], _MissingFilesCache)
+    nodegraph.set_node_state(chain[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain[0], NodeGraph.ERROR)
+    assert_equal(nodegraph.prune(), 0)
+
+    nodegraph = NodeGraph(chain[0], _MissingFilesCache)
+    nodegraph.set_node_state(chain[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain[0], NodeGraph.DONE)
+    assert_equal(nodegraph.prune(), 1)
+
+    # Pruned nodes are re-added, and their states determined anew
+    assert_equal(nodegraph.add_nodes(chain[1]), chain)
+    assert_equal(nodegraph.get_node_state(chain[0]), NodeGraph.RUNABLE)
+    assert_equal(nodegraph.get_node_state(chain[1]), NodeGraph.QUEUED)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+import StringIO
+import subprocess
+
+from nose.tools import \
+    assert_equal, \
+    assert_in
+
+from pypeline.common.testing import \
+    with_temp_folder
+
+import pypeline.profiling as profiling
+
+
+def _finish():
+    handle = StringIO.StringIO()
+    profiling.finish(handle)
+    return handle.getvalue()
+
+
+def _phases(report):
+    phases = {}
+    for line in report.split("\n")[2:]:
+        fields = line.rsplit(None, 4)
+        if len(fields) == 5 and not line.startswith("  Total"):
+            phases[fields[0].strip()] = map(int, (fields[1], fields[3],
+                                                  fields[4]))
+    return phases
+
+
+def test_phase__not_enabled():
+    assert not profiling.is_enabled()
+    with profiling.phase("foo"):
+        os.path.exists("/")
+    assert_equal(_finish(), "")
+
+
+def test_phase__counts():
+    profiling.enable()
+    try:
+        assert profiling.is_enabled()
+        with profiling.phase("A"):
+            os.path.exists("/")
+            os.listdir("/")
+            with profiling.phase("B"):
+                subprocess.call(["true"])
+        with profiling.phase("A"):
+            os.path.exists("/")
+    finally:
+        report = _finish()
+
+    assert not profiling.is_enabled()
+    phases = _phases(report)
+    assert_equal(phases["A"], [2, 3, 1])
+    assert_equal(phases["B"], [1, 0, 1])
+
+
+def test_finish__functions_restored():
+    originals = (os.stat, os.listdir, open,
+                 vars(subprocess.Popen)["_execute_child"])
+    profiling.enable()
+    _finish()
+    assert_equal(originals, (os.stat, os.listdir, open,
+                             vars(subprocess.Popen)["_execute_child"]))
+
+
+@with_temp_folder
+def test_finish__cprofile_dump(temp_folder):
+    filename = os.path.join(temp_folder, "startup.pstats")
+    profiling.enable(filename)
+    report = _finish()
+    assert_in(filename, report)
+    assert os.path.exists(filename)
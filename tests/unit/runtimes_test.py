@@ -0,0 +1,242 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+import sqlite3
+
+from nose.tools import \
+    assert_equal, \
+    assert_raises
+from flexmock import \
+    flexmock
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
+from pypeline.node import \
+    Node, \
+    CommandNode, \
+    MetaNode
+from pypeline.atomiccmd.command import \
+    AtomicCmd
+from pypeline.runtimes import \
+    RuntimeDB, \
+    measure
+import pypeline.runtimes
+
+
+class _OtherNode(Node):
+    pass
+
+
+class _Config(object):
+    def __init__(self, temp_root):
+        self.temp_root = temp_root
+
+
+def _stats(wall_time):
+    return {"input_size": 10,
+            "wall_time": wall_time,
+            "cpu_time": wall_time / 2.0,
+            "max_rss": None}
+
+
+###############################################################################
+###############################################################################
+# measure
+
+@with_temp_folder
+def test_measure(temp_folder):
+    input_file = os.path.join(temp_folder, "input")
+    set_file_contents(input_file, "12345")
+    node = Node(input_files=(input_file,))
+
+    calls = []
+    stats = measure(calls.append, node, "foo")
+    assert_equal(calls, ["foo"])
+    assert_equal(stats["input_size"], 5)
+    assert stats["wall_time"] >= 0
+    assert stats["cpu_time"] >= 0
+
+
+@with_temp_folder
+def test_measure__commands(temp_folder):
+    node = CommandNode(AtomicCmd("true"))
+    stats = measure(node.run, node, _Config(temp_folder))
+    assert_equal(sorted(stats["commands"]),
+                 ["max_rss", "read_bytes", "system_time", "user_time",
+                  "write_bytes"])
+    assert stats["max_rss"] > 0
+    assert_equal(measure(id, Node(), None)["commands"], None)
+
+
+def test_measure__missing_input_files():
+    node = Node(input_files=("/does/not/exist",))
+    assert_equal(measure(id, node, None)["input_size"], None)
+
+
+###############################################################################
+###############################################################################
+# RuntimeDB
+
+@with_temp_folder
+def test_runtimedb__no_records(temp_folder):
+    database = RuntimeDB(os.path.join(temp_folder, "db", "runtimes.sqlite"))
+    assert_equal(database.estimate_runtime(Node(description="foo")), None)
+    assert_equal(database.estimate_runtime(MetaNode()), 0)
+
+
+@with_temp_folder
+def test_runtimedb__estimates(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    database = RuntimeDB(filename)
+    database.record(Node(description="foo"), _stats(10))
+    database.record(Node(description="foo"), _stats(20))
+    database.record(Node(description="bar"), _stats(60))
+    # Estimates are only updated when the database is opened
+    assert_equal(database.estimate_runtime(Node(description="foo")), None)
+    database.close()
+
+    database = RuntimeDB(filename)
+    # Latest runtime of the same node
+    assert_equal(database.estimate_runtime(Node(description="foo")), 20)
+    assert_equal(database.estimate_runtime(Node(description="bar")), 60)
+    # Mean runtime of nodes of the same class
+    assert_equal(database.estimate_runtime(Node(description="baz")), 30)
+    assert_equal(database.estimate_runtime(_OtherNode(description="foo")),
+                 None)
+
+    nodes = [Node(description="foo"), Node(description="bar"),
+             _OtherNode(description="foo")]
+    assert_equal(database.estimate_total(nodes), (80, 1))
+
+
+@with_temp_folder
+def test_runtimedb__record(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    database = RuntimeDB(filename)
+    database.record(Node(description="foo", threads=3), _stats(10))
+    database.close()
+
+    conn = sqlite3.connect(filename)
+    rows = conn.execute("SELECT node_class, description, input_size, "
+                        "threads, wall_time, cpu_time, max_rss "
+                        "FROM runtimes").fetchall()
+    assert_equal(rows, [("Node", "foo", 10, 3, 10.0, 5.0, None)])
+
+
+def _count_records(filename):
+    conn = sqlite3.connect(filename)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM runtimes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@with_temp_folder
+def test_runtimedb__record__batched(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    database = RuntimeDB(filename)
+    database.record(Node(description="foo"), _stats(10))
+    database.record(Node(description="bar"), _stats(20))
+    # Records are not written until the commit interval has passed
+    assert_equal(_count_records(filename), 0)
+    database.close()
+    assert_equal(_count_records(filename), 2)
+
+
+@with_temp_folder
+def test_runtimedb__record__commit_interval(temp_folder):
+    flexmock(pypeline.runtimes, _COMMIT_INTERVAL=0.0)
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    database = RuntimeDB(filename)
+    database.record(Node(description="foo"), _stats(10))
+    assert_equal(_count_records(filename), 1)
+    database.close()
+
+
+@with_temp_folder
+def test_runtimedb__record_commands(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    stats = _stats(10)
+    stats["commands"] = {"user_time": 3.0, "system_time": 1.0,
+                         "max_rss": 1024, "read_bytes": 512,
+                         "write_bytes": 4096}
+    database = RuntimeDB(filename)
+    database.record(Node(description="foo"), stats)
+    database.record(Node(description="bar"), _stats(10))
+    database.close()
+
+    conn = sqlite3.connect(filename)
+    rows = conn.execute("SELECT description, user_time, system_time, "
+                        "read_bytes, write_bytes FROM runtimes").fetchall()
+    assert_equal(rows, [("foo", 3.0, 1.0, 512, 4096),
+                        ("bar", None, None, None, None)])
+
+
+@with_temp_folder
+def test_runtimedb__upgrade_version_1(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    conn = sqlite3.connect(filename)
+    conn.executescript("""
+        CREATE TABLE runtimes (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            host TEXT NOT NULL,
+            node_class TEXT NOT NULL,
+            description TEXT NOT NULL,
+            input_size INTEGER,
+            threads INTEGER NOT NULL,
+            wall_time REAL NOT NULL,
+            cpu_time REAL,
+            max_rss INTEGER);
+        INSERT INTO runtimes VALUES (1, 0, 'host', 'Node', 'foo', 10, 1,
+                                     20.0, 10.0, NULL);
+        PRAGMA user_version = 1;""")
+    conn.close()
+
+    database = RuntimeDB(filename)
+    assert_equal(database.estimate_runtime(Node(description="foo")), 20)
+    database.record(Node(description="foo"), _stats(10))
+    database.close()
+
+    conn = sqlite3.connect(filename)
+    version, = conn.execute("PRAGMA user_version").fetchone()
+    assert_equal(version, 2)
+    rows = conn.execute("SELECT description, wall_time, user_time "
+                        "FROM runtimes").fetchall()
+    assert_equal(rows, [("foo", 20.0, None), ("foo", 10.0, None)])
+
+
+@with_temp_folder
+def test_runtimedb__wrong_version(temp_folder):
+    filename = os.path.join(temp_folder, "runtimes.sqlite")
+    conn = sqlite3.connect(filename)
+    conn.execute("PRAGMA user_version = 1000")
+    conn.close()
+
+    assert_raises(sqlite3.DatabaseError, RuntimeDB, filename)
@@ -0,0 +1,358 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is herby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+
+from nose.tools import \
+    assert_equal, \
+    assert_raises
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
+from pypeline.node import \
+    Node, \
+    MetaNode
+from pypeline.nodegraph import \
+    NodeGraph
+from pypeline.scheduler import \
+    RunableQueue, \
+    estimate_cost
+
+
+def _build_chain(temp_folder, length, name="chain", threads=1, memory=0):
+    """Builds a chain of nodes, each depending on the previous node."""
+    input_file = os.path.join(temp_folder, "input")
+    set_file_contents(input_file, "data")
+
+    nodes = []
+    for index in xrange(length):
+        output_file = os.path.join(temp_folder, "%s_%i" % (name, index))
+        node = Node(description="%s_%i" % (name, index),
+                    input_files=(input_file,),
+                    output_files=(output_file,),
+                    threads=threads,
+                    memory=memory,
+                    dependencies=nodes[-1:])
+        nodes.append(node)
+        input_file = output_file
+    return nodes
+
+
+class _AdaptiveNode(Node):
+    """Node that may be run using between 1 and 'max_threads' threads."""
+
+    def __init__(self, threads, max_threads, **kwargs):
+        Node.__init__(self, threads=threads, **kwargs)
+        self._max_threads = max_threads
+
+    @property
+    def thread_range(self):
+        return (1, self._max_threads)
+
+    def _set_threads(self, threads):
+        pass
+
+
+def _build_adaptive(temp_folder, name, threads=2, max_threads=None):
+    input_file = os.path.join(temp_folder, "input")
+    set_file_contents(input_file, "data")
+
+    return _AdaptiveNode(description=name,
+                         input_files=(input_file,),
+                         output_files=(os.path.join(temp_folder, name),),
+                         threads=threads,
+                         max_threads=max_threads)
+
+
+def _build_queue(nodes):
+    nodegraph = NodeGraph(nodes)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    return runable
+
+
+###############################################################################
+###############################################################################
+# RunableQueue
+
+@with_temp_folder
+def test_runable_queue__refresh(temp_folder):
+    chain_a = _build_chain(temp_folder, 3, "a")
+    chain_b = _build_chain(temp_folder, 3, "b")
+    nodegraph = NodeGraph(chain_a[-1:] + chain_b[-1:])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    assert_equal(set(runable), set((chain_a[0], chain_b[0])))
+
+
+@with_temp_folder
+def test_runable_queue__state_changed(temp_folder):
+    chain = _build_chain(temp_folder, 3)
+    nodegraph = NodeGraph(chain[-1:])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    nodegraph.set_node_state(chain[0], nodegraph.RUNNING)
+    assert_equal(list(runable), [])
+    set_file_contents(os.path.join(temp_folder, "chain_0"), "data")
+    nodegraph.set_node_state(chain[0], nodegraph.DONE)
+    assert_equal(list(runable), [chain[1]])
+
+
+@with_temp_folder
+def test_runable_queue__error_removes_dependants(temp_folder):
+    chain_a = _build_chain(temp_folder, 2, "a")
+    chain_b = _build_chain(temp_folder, 1, "b")
+    nodegraph = NodeGraph(chain_a[-1:] + chain_b)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    nodegraph.set_node_state(chain_a[0], nodegraph.ERROR)
+    assert_equal(list(runable), chain_b)
+
+
+@with_temp_folder
+def test_runable_queue__select__threads(temp_folder):
+    nodes = _build_chain(temp_folder, 1, "a", threads=3) \
+        + _build_chain(temp_folder, 1, "b", threads=1) \
+        + _build_chain(temp_folder, 1, "c", threads=2)
+    nodegraph = NodeGraph(nodes)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    order = list(runable)
+
+    selection = runable.select(3)
+    assert_equal(sum(node.threads for node in selection), 3)
+    assert_equal(selection, [node for node in order if node in selection])
+    assert_equal(runable.select(0), [])
+
+
+@with_temp_folder
+def test_runable_queue__select__idle_allows_oversized_node(temp_folder):
+    nodes = _build_chain(temp_folder, 1, "a", threads=4)
+    nodegraph = NodeGraph(nodes)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    assert_equal(runable.select(2), [])
+    assert_equal(runable.select(2, is_idle=True), nodes)
+
+
+@with_temp_folder
+def test_runable_queue__select__memory(temp_folder):
+    nodes = _build_chain(temp_folder, 1, "a", memory=4096) \
+        + _build_chain(temp_folder, 1, "b", memory=4096) \
+        + _build_chain(temp_folder, 1, "c")
+    nodegraph = NodeGraph(nodes)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    # Nodes without a (known) memory usage are not limited
+    selection = runable.select(3, idle_memory=6000)
+    assert_equal(len(selection), 2)
+    assert_equal(sum(node.memory for node in selection), 4096)
+    assert_equal(len(runable.select(3, idle_memory=8192)), 3)
+    assert_equal(len(runable.select(3)), 3)
+
+
+@with_temp_folder
+def test_runable_queue__select__idle_allows_oversized_memory(temp_folder):
+    nodes = _build_chain(temp_folder, 1, "a", memory=4096)
+    nodegraph = NodeGraph(nodes)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    assert_equal(runable.select(2, idle_memory=1024), [])
+    assert_equal(runable.select(2, True, idle_memory=1024), nodes)
+
+
+@with_temp_folder
+def test_runable_queue__select_threads__fixed_nodes(temp_folder):
+    nodes = _build_chain(temp_folder, 1, "a", threads=3) \
+        + _build_chain(temp_folder, 1, "b", threads=2)
+    runable = _build_queue(nodes)
+
+    # Nodes with a fixed number of threads are not changed
+    assert_equal(dict(runable.select_threads(10)), {nodes[0]: 3,
+                                                    nodes[1]: 2})
+    assert_equal(runable.select_threads(1), [])
+
+
+@with_temp_folder
+def test_runable_queue__select_threads__fewer_threads(temp_folder):
+    nodes = [_build_adaptive(temp_folder, "a", threads=4),
+             _build_adaptive(temp_folder, "b", threads=4),
+             _build_adaptive(temp_folder, "c", threads=4)]
+    runable = _build_queue(nodes)
+    order = list(runable)
+
+    # Nodes are started with fewer threads, rather than waiting
+    assert_equal(runable.select_threads(6),
+                 [(order[0], 4), (order[1], 2)])
+
+
+@with_temp_folder
+def test_runable_queue__select_threads__spread_idle(temp_folder):
+    nodes = [_build_adaptive(temp_folder, "a", threads=2),
+             _build_adaptive(temp_folder, "b", threads=2, max_threads=3)]
+    runable = _build_queue(nodes)
+
+    # Idle threads are divided between nodes, up to their maximum
+    assert_equal(dict(runable.select_threads(8)), {nodes[0]: 5,
+                                                   nodes[1]: 3})
+    assert_equal(dict(runable.select_threads(8, spread_idle=False)),
+                 dict.fromkeys(nodes, 2))
+    assert_equal(dict(runable.select_threads(10)), {nodes[0]: 7,
+                                                    nodes[1]: 3})
+
+
+@with_temp_folder
+def test_runable_queue__select_threads__queue_not_empty(temp_folder):
+    nodes = [_build_adaptive(temp_folder, "a", threads=2)] \
+        + _build_chain(temp_folder, 1, "b", threads=4)
+    runable = _build_queue(nodes)
+
+    # Node "b" does not fit, so no threads are divided between nodes
+    assert_equal(runable.select_threads(3), [(nodes[0], 2)])
+
+
+@with_temp_folder
+def test_runable_queue__critical_path_first(temp_folder):
+    short_chain = _build_chain(temp_folder, 1, "a")
+    long_chain = _build_chain(temp_folder, 3, "b")
+    nodegraph = NodeGraph(short_chain + long_chain[-1:])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    assert_equal(list(runable), [long_chain[0], short_chain[0]])
+    assert_equal(runable.select(1), [long_chain[0]])
+    assert_equal(runable.priority(long_chain[0]), 3 * estimate_cost(Node()))
+
+
+@with_temp_folder
+def test_runable_queue__critical_path__metanodes(temp_folder):
+    short_chain = _build_chain(temp_folder, 2, "a")
+    long_chain = _build_chain(temp_folder, 1, "b")
+    metanode = MetaNode(subnodes=long_chain)
+    final_node = Node(input_files=short_chain[-1].output_files,
+                      dependencies=[metanode, short_chain[-1]])
+    nodegraph = NodeGraph([final_node])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+
+    # MetaNodes do not add to the length of paths
+    assert_equal(runable.priority(metanode), runable.priority(final_node))
+    assert_equal(runable.priority(short_chain[0]),
+                 runable.priority(long_chain[0]) + estimate_cost(Node()))
+
+
+@with_temp_folder
+def test_runable_queue__estimate_runtime(temp_folder):
+    short_chain = _build_chain(temp_folder, 1, "a")
+    long_chain = _build_chain(temp_folder, 3, "b")
+    runtimes = {short_chain[0]: 1000}
+    nodegraph = NodeGraph(short_chain + long_chain[-1:])
+    runable = RunableQueue(runtimes.get)
+    nodegraph.add_state_observer(runable)
+
+    assert_equal(list(runable), [short_chain[0], long_chain[0]])
+    assert_equal(runable.priority(short_chain[0]), 1000)
+
+
+@with_temp_folder
+def test_runable_queue__fifo_for_equal_priorities(temp_folder):
+    chain_a = _build_chain(temp_folder, 2, "a")
+    chain_b = _build_chain(temp_folder, 2, "b")
+    nodegraph = NodeGraph(chain_a[-1:] + chain_b[-1:])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    first, second = list(runable)
+
+    nodegraph.set_node_state(first, nodegraph.RUNNING)
+    nodegraph.set_node_state(second, nodegraph.RUNNING)
+    nodegraph.set_node_state(second, nodegraph.DONE)
+    nodegraph.set_node_state(first, nodegraph.DONE)
+    assert_equal(len(runable), 2)
+    assert_equal([node.dependencies for node in runable],
+                 [frozenset((second,)), frozenset((first,))])
+
+
+###############################################################################
+###############################################################################
+# estimate_cost
+
+def test_estimate_cost():
+    assert_equal(estimate_cost(MetaNode()), 0)
+    assert estimate_cost(Node()) > 0
+
+    class ExaMLNode(Node):
+        pass
+    assert estimate_cost(ExaMLNode()) > estimate_cost(Node())
+
+
+@with_temp_folder
+def test_runable_queue__nodes_added(temp_folder):
+    chain_a = _build_chain(temp_folder, 1, "a")
+    chain_b = _build_chain(temp_folder, 2, "b")
+    nodegraph = NodeGraph(chain_a)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    nodegraph.add_nodes(chain_b[-1:])
+
+    assert_equal(list(runable), [chain_b[0], chain_a[0]])
+    assert_equal(runable.priority(chain_b[0]), 2 * estimate_cost(Node()))
+
+
+@with_temp_folder
+def test_runable_queue__nodes_added__updates_requirements(temp_folder):
+    chain_a = _build_chain(temp_folder, 2, "a")
+    chain_b = _build_chain(temp_folder, 3, "b")
+    nodegraph = NodeGraph(chain_a[-1:] + chain_b[:1])
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    assert_equal(list(runable), [chain_a[0], chain_b[0]])
+
+    # Nodes already in the graph gain the new nodes as dependants
+    nodegraph.add_nodes(chain_b[-1:])
+    assert_equal(runable.priority(chain_b[0]), 3 * estimate_cost(Node()))
+    assert_equal(list(runable), [chain_b[0], chain_a[0]])
+    assert_equal(runable.select(1), [chain_b[0]])
+
+
+@with_temp_folder
+def test_runable_queue__done_nodes_forgotten(temp_folder):
+    chain = _build_chain(temp_folder, 2)
+    nodegraph = NodeGraph(chain)
+    runable = RunableQueue()
+    nodegraph.add_state_observer(runable)
+    nodegraph.set_node_state(chain[0], NodeGraph.RUNNING)
+    nodegraph.set_node_state(chain[0], NodeGraph.DONE)
+
+    assert_raises(KeyError, runable.priority, chain[0])
+    assert_equal(list(runable), chain[1:])
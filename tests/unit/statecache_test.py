@@ -0,0 +1,314 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is herby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warning for missing docstring
+# pylint: disable=C0111
+# Disable warning caused by "invalid" function names
+# pylint: disable=C0103
+import os
+
+from nose.tools import \
+    assert_equal, \
+    assert_not_equal
+from flexmock import \
+    flexmock
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+
+from pypeline.node import \
+    Node, \
+    MetaNode, \
+    CommandNode
+from pypeline.pipeline import \
+    Pypeline
+from pypeline.atomiccmd.command import \
+    AtomicCmd
+from pypeline.executors.base import \
+    TaskConfig
+from pypeline.nodegraph import \
+    NodeGraph
+from pypeline.statecache import \
+    StateCache, \
+    node_signature
+import pypeline.statecache
+
+
+def _build_node(temp_folder):
+    data_folder = os.path.join(temp_folder, "data")
+    if not os.path.exists(data_folder):
+        os.mkdir(data_folder)
+    input_file = os.path.join(data_folder, "input")
+    output_file = os.path.join(data_folder, "output")
+    set_file_contents(input_file, "data")
+    return Node(input_files=(input_file,),
+                output_files=(output_file,))
+
+
+def _make_old(temp_folder):
+    """Backdates the data folder to avoid the cache considering it racy."""
+    data_folder = os.path.join(temp_folder, "data")
+    os.utime(data_folder, (1000000000, 1000000000))
+
+
+###############################################################################
+###############################################################################
+# node_signature
+
+def test_node_signature__depends_on_files():
+    node_a = Node(input_files="in_1", output_files="out")
+    node_b = Node(input_files="in_2", output_files="out")
+    node_c = Node(input_files="in_1", output_files="out")
+    assert_not_equal(node_signature(node_a), node_signature(node_b))
+    assert_equal(node_signature(node_a), node_signature(node_c))
+
+
+###############################################################################
+###############################################################################
+# StateCache
+
+@with_temp_folder
+def test_state_cache__save_and_load(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    node = _build_node(temp_folder)
+    set_file_contents(os.path.join(temp_folder, "data", "output"), "data")
+    _make_old(temp_folder)
+
+    cache = StateCache(filename)
+    nodegraph = NodeGraph([node], cache)
+    nodegraph.add_state_observer(cache)
+    assert_equal(nodegraph.get_node_state(node), NodeGraph.DONE)
+    assert cache.save()
+
+    cache = StateCache(filename)
+    # Only the folder itself is checked
+    flexmock(pypeline.statecache).should_call("_stat").once()
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.DONE)
+
+
+@with_temp_folder
+def test_state_cache__changed_dir_is_rechecked(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    node = _build_node(temp_folder)
+    _make_old(temp_folder)
+
+    cache = StateCache(filename)
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.RUNABLE)
+    cache.save()
+
+    set_file_contents(os.path.join(temp_folder, "data", "output"), "data")
+    cache = StateCache(filename)
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.DONE)
+
+
+@with_temp_folder
+def test_state_cache__trusted_skips_checks(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    node = _build_node(temp_folder)
+    set_file_contents(os.path.join(temp_folder, "data", "output"), "data")
+
+    cache = StateCache(filename)
+    nodegraph = NodeGraph([node], cache)
+    nodegraph.add_state_observer(cache)
+    cache.save()
+
+    cache = StateCache(filename, trusted=True)
+    cache.validate([node])
+    flexmock(pypeline.statecache).should_receive("_stat").never()
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.DONE)
+
+
+@with_temp_folder
+def test_state_cache__trusted__changed_node_is_checked(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    node = _build_node(temp_folder)
+    set_file_contents(os.path.join(temp_folder, "data", "output"), "data")
+
+    cache = StateCache(filename)
+    nodegraph = NodeGraph([node], cache)
+    nodegraph.add_state_observer(cache)
+    cache.save()
+
+    new_output = os.path.join(temp_folder, "data", "output_2")
+    new_node = Node(input_files=node.input_files, output_files=new_output)
+    cache = StateCache(filename, trusted=True)
+    cache.validate([new_node])
+    assert_equal(NodeGraph([new_node], cache).get_node_state(new_node),
+                 NodeGraph.RUNABLE)
+
+
+@with_temp_folder
+def test_state_cache__running_node_is_forgotten(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    node = _build_node(temp_folder)
+
+    cache = StateCache(filename, trusted=True)
+    nodegraph = NodeGraph([node], cache)
+    nodegraph.add_state_observer(cache)
+    nodegraph.set_node_state(node, NodeGraph.RUNNING)
+    set_file_contents(os.path.join(temp_folder, "data", "output"), "data")
+    nodegraph.set_node_state(node, NodeGraph.DONE)
+    cache.save()
+
+    cache = StateCache(filename, trusted=True)
+    cache.validate([node])
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.DONE)
+
+
+@with_temp_folder
+def test_state_cache__corrupt_cache_is_ignored(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    set_file_contents(filename, "not a pickle")
+    node = _build_node(temp_folder)
+
+    cache = StateCache(filename)
+    assert_equal(NodeGraph([node], cache).get_node_state(node),
+                 NodeGraph.RUNABLE)
+
+
+###############################################################################
+###############################################################################
+# StateCache: Completed nodes
+
+def _build_target(temp_folder):
+    node = _build_node(temp_folder)
+    final_file = os.path.join(temp_folder, "data", "final")
+    final_node = Node(input_files=node.output_files,
+                      output_files=(final_file,),
+                      dependencies=(node,))
+    return MetaNode(subnodes=(final_node,)), node, final_node
+
+
+def _write_output_files(*nodes):
+    """Writes output files in the order given, so that these are not
+    considered outdated."""
+    for node in nodes:
+        for fpath in node.output_files:
+            set_file_contents(fpath, "data")
+
+
+def _record_completed(filename, target):
+    cache = StateCache(filename)
+    nodegraph = NodeGraph([target], cache)
+    nodegraph.add_state_observer(cache)
+    cache.record_completed(nodegraph, [target])
+    cache.save()
+
+
+@with_temp_folder
+def test_state_cache__final_output_files(temp_folder):
+    target, node, final_node = _build_target(temp_folder)
+    assert_equal(pypeline.statecache._final_output_files(target),
+                 final_node.output_files)
+    assert_equal(pypeline.statecache._final_output_files(node),
+                 node.output_files)
+
+
+@with_temp_folder
+def test_state_cache__remove_completed(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    target, node, final_node = _build_target(temp_folder)
+    _write_output_files(node, final_node)
+    _record_completed(filename, target)
+
+    # Only the final output file is checked
+    cache = StateCache(filename, trusted=True)
+    flexmock(pypeline.statecache).should_call("_stat").once()
+    assert_equal(cache.remove_completed([target]), [])
+
+
+@with_temp_folder
+def test_state_cache__remove_completed__requires_trust(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    target, node, final_node = _build_target(temp_folder)
+    _write_output_files(node, final_node)
+    _record_completed(filename, target)
+
+    cache = StateCache(filename)
+    assert_equal(cache.remove_completed([target]), [target])
+
+
+@with_temp_folder
+def test_state_cache__remove_completed__changed_output(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    target, node, final_node = _build_target(temp_folder)
+    _write_output_files(node, final_node)
+    _record_completed(filename, target)
+
+    set_file_contents(list(final_node.output_files)[0], "changed data")
+    cache = StateCache(filename, trusted=True)
+    assert_equal(cache.remove_completed([target]), [target])
+
+
+@with_temp_folder
+def test_state_cache__remove_completed__incomplete_target(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    target, node, _ = _build_target(temp_folder)
+    _write_output_files(node)
+    _record_completed(filename, target)
+
+    cache = StateCache(filename, trusted=True)
+    assert_equal(cache.remove_completed([target]), [target])
+
+
+@with_temp_folder
+def test_state_cache__record_on_completion(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    target, node, final_node = _build_target(temp_folder)
+    cache = StateCache(filename)
+    nodegraph = NodeGraph([target], cache)
+    nodegraph.add_state_observer(cache)
+    cache.record_on_completion(nodegraph, [target])
+
+    for child in (node, final_node):
+        _write_output_files(child)
+        nodegraph.set_node_state(child, NodeGraph.RUNNING)
+        nodegraph.set_node_state(child, NodeGraph.DONE)
+    assert_equal(nodegraph.get_node_state(target), NodeGraph.DONE)
+    cache.save()
+
+    cache = StateCache(filename, trusted=True)
+    assert_equal(cache.remove_completed([target]), [])
+
+
+@with_temp_folder
+def test_state_cache__lazy_nodes_recorded(temp_folder):
+    filename = os.path.join(temp_folder, "cache")
+    input_file = os.path.join(temp_folder, "input")
+    set_file_contents(input_file, "data")
+    command = AtomicCmd(("cp", "%(IN_FILE)s", "%(OUT_FILE)s"),
+                        IN_FILE=input_file,
+                        OUT_FILE=os.path.join(temp_folder, "output"))
+    node = CommandNode(command)
+
+    pipeline = Pypeline(TaskConfig(temp_folder))
+    pipeline.add_lazy_nodes([[node]])
+    assert pipeline.run(progress_ui="quiet", state_cache=filename)
+
+    cache = StateCache(filename, trusted=True)
+    assert_equal(cache.remove_completed([node]), [])
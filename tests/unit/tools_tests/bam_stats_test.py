@@ -0,0 +1,742 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Mikkel Schubert <MSchubert@snm.ku.dk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disable warnings for missing docstrings and "invalid" function names
+# pylint: disable=C0111,C0103
+import os
+import sys
+import random
+import argparse
+import collections
+import StringIO
+
+import numpy
+import pysam
+
+from nose.tools import \
+    assert_equal, \
+    assert_raises
+from flexmock import \
+    flexmock
+
+from pypeline.common.testing import \
+    with_temp_folder, \
+    set_file_contents
+from pypeline.common.bamfiles import \
+    EXCLUDED_FLAGS
+
+import pypeline.tools.coverage as coverage
+import pypeline.tools.depths as depths
+import pypeline.tools.duphist as duphist
+import pypeline.tools.bam_stats.common as common
+import pypeline.tools.bam_stats.main as bam_stats
+import pypeline.tools.bam_stats.rawcounts as rawcounts
+import pypeline.tools.bam_stats.coverage as coverage_table
+
+
+###############################################################################
+###############################################################################
+# Test BAM files
+
+_CONTIGS = (("chr1", 600), ("chr2", 350), ("chr3", 40))
+# Two samples, one of which has two libraries, one of which has two readgroups
+_READGROUPS = (("rg1", "S1", "L1"),
+               ("rg2", "S1", "L1"),
+               ("rg3", "S1", "L2"),
+               ("rg4", "S2", "L3"))
+# Overlapping regions, and regions with and without names
+_REGIONS = (("chr1", 10, 200, "geneA"),
+            ("chr1", 150, 300, "geneA"),
+            ("chr2", 0, 100, None),
+            ("chr3", 5, 35, "geneB"))
+
+_Read = collections.namedtuple("_Read", ("name", "contig", "pos", "cigar",
+                                         "readgroup", "flag", "tlen"))
+
+
+def _random_cigar(rng):
+    """Returns a CIGAR with M/=/X blocks separated by I, D, or N operations,
+    optionally clipped; padding is not used, as this is not handled."""
+    cigar = []
+    if rng.random() < 0.2:
+        cigar.append((rng.choice((4, 5)), rng.randint(1, 5)))
+    cigar.append((rng.choice((0, 0, 7, 8)), rng.randint(1, 25)))
+    for _ in xrange(rng.randint(0, 2)):
+        operation = rng.choice((1, 2, 3))
+        length = rng.randint(1, 30 if operation == 3 else 4)
+        cigar.append((operation, length))
+        cigar.append((rng.choice((0, 0, 7, 8)), rng.randint(1, 25)))
+    if rng.random() < 0.2:
+        cigar.append((rng.choice((4, 5)), rng.randint(1, 5)))
+    return tuple(cigar)
+
+
+def _reference_length(cigar):
+    return sum(num for (operation, num) in cigar
+               if operation in (0, 2, 3, 7, 8))
+
+
+def _random_reads(seed=12345, count=600):
+    """Returns a sorted list of random reads, including collapsed reads,
+    (proper) paired reads, and reads excluded by flags (PCR duplicates)."""
+    rng = random.Random(seed)
+    contigs = dict(_CONTIGS)
+    reads = []
+    for index in xrange(count):
+        contig = rng.choice(_CONTIGS)[0]
+        cigar = _random_cigar(rng)
+        while _reference_length(cigar) >= contigs[contig]:
+            cigar = _random_cigar(rng)
+
+        pos = rng.randrange(contigs[contig] - _reference_length(cigar))
+        flag = rng.choice((0, 0x10, 0x41, 0x81, 0x43, 0x93, 0x400, 0x443))
+        name = "read%i" % (index,)
+        if not flag & 0x1 and rng.random() < 0.2:
+            name = "M_" + name
+
+        tlen = 0
+        if flag & 0x2:
+            tlen = rng.randint(50, 300) * (-1 if flag & 0x10 else 1)
+
+        reads.append(_Read(name, contig, pos, cigar,
+                           rng.choice(_READGROUPS)[0], flag, tlen))
+
+    order = [name for (name, _) in _CONTIGS]
+    reads.sort(key=lambda read: (order.index(read.contig), read.pos))
+    return reads
+
+
+def _write_bam(filename, reads):
+    """Writes a sorted and indexed BAM file containing 'reads'."""
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"},
+              "SQ": [{"SN": name, "LN": length}
+                     for (name, length) in _CONTIGS],
+              "RG": [{"ID": key, "SM": sample, "LB": library}
+                     for (key, sample, library) in _READGROUPS]}
+
+    order = [name for (name, _) in _CONTIGS]
+    with pysam.AlignmentFile(filename, "wb", header=header) as handle:
+        for read in reads:
+            length = sum(num for (operation, num) in read.cigar
+                         if operation in (0, 1, 4, 7, 8))
+
+            record = pysam.AlignedSegment()
+            record.query_name = read.name
+            record.flag = read.flag
+            record.reference_id = order.index(read.contig)
+            record.reference_start = read.pos
+            record.mapping_quality = 30
+            record.cigartuples = read.cigar
+            record.template_length = read.tlen
+            record.query_sequence = "A" * length
+            record.query_qualities = pysam.qualitystring_to_array("I" * length)
+            record.set_tag("RG", read.readgroup)
+            handle.write(record)
+
+    pysam.index(filename)
+
+
+def _write_regions(filename):
+    lines = []
+    for (contig, start, end, name) in _REGIONS:
+        fields = [contig, str(start), str(end)]
+        if name is not None:
+            fields.append(name)
+        lines.append("\t".join(fields) + "\n")
+
+    set_file_contents(filename, "".join(lines))
+
+
+def _build_bam(temp_folder, reads=None):
+    filename = os.path.join(temp_folder, "test.bam")
+    _write_bam(filename, _random_reads() if reads is None else reads)
+    return filename
+
+
+def _read_table(filename):
+    """Returns the lines of a table, excluding the (time-stamped) header."""
+    with open(filename) as handle:
+        return [line for line in handle if not line.startswith("#")]
+
+
+###############################################################################
+###############################################################################
+# Depth histograms
+
+def _naive_depths(reads):
+    """Returns the depth at each position, by (sample, library, contig)."""
+    samples_and_libraries = dict((key, (sample, library))
+                                 for (key, sample, library) in _READGROUPS)
+
+    result = {}
+    for (_, sample, library) in _READGROUPS:
+        for (contig, length) in _CONTIGS:
+            result[(sample, library, contig)] = numpy.zeros(length, dtype=int)
+
+    for read in reads:
+        if read.flag & EXCLUDED_FLAGS:
+            continue
+
+        sample, library = samples_and_libraries[read.readgroup]
+        array = result[(sample, library, read.contig)]
+        position = read.pos
+        for (operation, num) in read.cigar:
+            if operation in (0, 7, 8):
+                array[position:position + num] += 1
+            if operation in (0, 2, 3, 7, 8):
+                position += num
+
+    return result
+
+
+def _naive_histograms(reads, regions=None, genome=False):
+    """Returns the depth histograms expected in a totals dict (see
+    'depths.build_totals_dict'), calculated position by position."""
+    if regions is None:
+        regions = [(contig, 0, length, "<Genome>" if genome else contig)
+                   for (contig, length) in _CONTIGS]
+    else:
+        regions = [(contig, start, end, name or (contig + "*"))
+                   for (contig, start, end, name) in regions]
+
+    per_position = _naive_depths(reads)
+    samples = frozenset(sample for (_, sample, _) in _READGROUPS)
+    groups = collections.defaultdict(set)
+    for (_, sample, library) in _READGROUPS:
+        for key in ((sample, library), (sample, "*"), ("*", "*")):
+            groups[key].add((sample, library))
+
+    totals = {}
+    for ((sample, library), members) in groups.iteritems():
+        segments = collections.defaultdict(list)
+        for (contig, start, end, name) in regions:
+            summed = sum(per_position[(member_sm, member_lb, contig)][start:end]
+                         for (member_sm, member_lb) in members)
+            segments[name].append(summed)
+            segments["*"].append(summed)
+
+        for (name, arrays) in segments.iteritems():
+            if sample == "*" and name != "*" and len(samples) > 1:
+                # Per-contig histograms are not collected across samples
+                totals[(sample, library, name)] = {}
+                continue
+
+            histogram = numpy.bincount(numpy.concatenate(arrays))
+            totals[(sample, library, name)] \
+                = dict((depth, int(histogram[depth]))
+                       for depth in histogram.nonzero()[0] if depth)
+
+    return totals
+
+
+def _run_depths(temp_folder, filename, *args):
+    table = os.path.join(temp_folder, "table.depths")
+    counts = os.path.join(temp_folder, "table.depths.npz")
+    argv = [filename, table, "--raw-counts", counts, "--overwrite-output"]
+    assert_equal(depths.main(argv + list(args)), 0)
+
+    name, totals, lengths = depths.read_counts(counts)
+    totals = dict((key, dict(counts)) for (key, counts) in totals.iteritems())
+    return name, totals, lengths, _read_table(table)
+
+
+def _check_depths(temp_folder, filename, expected, *args):
+    name, totals, lengths, table = _run_depths(temp_folder, filename, *args)
+    assert_equal(totals, expected)
+
+    expected_table = os.path.join(temp_folder, "expected.depths")
+    depths.write_table(name, expected, lengths, expected_table)
+    assert_equal(table, _read_table(expected_table))
+
+
+def test_depth_window__no_blocks():
+    window = depths.DepthWindow(2)
+    assert_equal(window.flush(10), None)
+
+
+def test_depth_window__flush_across_windows():
+    window = depths.DepthWindow(2)
+    window.end = 10
+    window.add(0, 0, 10)
+    window.add(1, 2, 5)
+    start, result = window.flush(4)
+    assert_equal(start, 0)
+    assert_equal(result.tolist(), [[1, 1, 1, 1], [0, 0, 1, 1]])
+
+    # Blocks pending from the last window, and blocks extending past 'end'
+    window.end = 12
+    window.add(1, 4, 12)
+    start, result = window.flush(8)
+    assert_equal(start, 4)
+    assert_equal(result.tolist(), [[1, 1, 1, 1], [2, 1, 1, 1]])
+
+    # No bases are aligned at or past position 8, so nothing is pending
+    assert_equal(window.flush(8), None)
+    start, result = window.flush(20)
+    assert_equal(start, 8)
+    assert_equal(result.tolist(), [[1, 1, 0, 0], [1, 1, 1, 1]])
+    assert_equal(window.start, None)
+    assert_equal(window.flush(20), None)
+
+
+def test_depth_window__random_blocks():
+    rng = random.Random(54321)
+    for _ in xrange(20):
+        expected = numpy.zeros((3, 300), dtype=int)
+        observed = numpy.zeros((3, 300), dtype=int)
+
+        window = depths.DepthWindow(3)
+        position = 0
+        while position < 250:
+            # Depths are calculated for positions before the next block
+            if rng.random() < 0.2:
+                result = window.flush(position)
+                if result is not None:
+                    offset, values = result
+                    observed[:, offset:offset + values.shape[1]] = values
+
+            smlbid = rng.randrange(3)
+            end = position + rng.randint(1, 40)
+            window.end = max(window.end, end)
+            window.add(smlbid, position, end)
+            expected[smlbid, position:end] += 1
+            position += rng.randint(0, 10)
+
+        result = window.flush(window.end)
+        if result is not None:
+            offset, values = result
+            observed[:, offset:offset + values.shape[1]] = values
+
+        assert_equal(observed.tolist(), expected.tolist())
+
+
+@with_temp_folder
+def test_depths__contigs(temp_folder):
+    filename = _build_bam(temp_folder)
+    _check_depths(temp_folder, filename, _naive_histograms(_random_reads()))
+
+
+@with_temp_folder
+def test_depths__contigs__small_window(temp_folder):
+    # Blocks are flushed across many windows, including within reads
+    flexmock(depths, _WINDOW_SIZE=3)
+    filename = _build_bam(temp_folder)
+    _check_depths(temp_folder, filename, _naive_histograms(_random_reads()))
+
+
+@with_temp_folder
+def test_depths__regions(temp_folder):
+    filename = _build_bam(temp_folder)
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+
+    expected = _naive_histograms(_random_reads(), _REGIONS)
+    _check_depths(temp_folder, filename, expected,
+                  "--regions-file", regions)
+
+
+@with_temp_folder
+def test_depths__regions__small_window(temp_folder):
+    flexmock(depths, _WINDOW_SIZE=3)
+    filename = _build_bam(temp_folder)
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+
+    expected = _naive_histograms(_random_reads(), _REGIONS)
+    _check_depths(temp_folder, filename, expected,
+                  "--regions-file", regions)
+
+
+@with_temp_folder
+def test_depths__max_contigs(temp_folder):
+    filename = _build_bam(temp_folder)
+    expected = _naive_histograms(_random_reads(), genome=True)
+    _check_depths(temp_folder, filename, expected, "--max-contigs", "2")
+
+
+###############################################################################
+###############################################################################
+# Coverage
+
+def test_get_cigar_totals():
+    # 5S10M2I3D100N4=1X2H
+    cigar = ((4, 5), (0, 10), (1, 2), (2, 3), (3, 100), (7, 4), (8, 1), (5, 2))
+    assert_equal(coverage.get_cigar_totals(cigar), (15, 2, 3, 118))
+
+
+def test_get_cigar_totals__trailing_insertion():
+    assert_equal(coverage.get_cigar_totals(((0, 10), (1, 5))), (10, 5, 0, 15))
+
+
+def test_get_cigar_totals__matches_count_bases_in_region():
+    rng = random.Random(1234)
+    for _ in xrange(200):
+        cigar = _random_cigar(rng)
+        totals = coverage.get_cigar_totals(cigar)
+
+        # Every base is counted for alignments within 'extent' of the start
+        counts = [0] * 7
+        coverage.count_bases_in_region(counts, cigar, 100, 100,
+                                       100 + totals[3])
+        assert_equal(tuple(counts[4:]), totals[:3])
+
+        counts = [0] * 7
+        coverage.count_bases_in_region(counts, cigar, 100, 100,
+                                       99 + totals[3])
+        assert sum(counts[4:]) < sum(totals[:3])
+
+
+def _naive_coverage(reads, regions=None):
+    """Returns the hits and bases expected for each (sample, library, name),
+    as lists of counts corresponding to 'coverage._STATISTICS'; bases are
+    counted using 'count_bases_in_region' for every read."""
+    if regions is None:
+        regions = [(contig, 0, length, contig)
+                   for (contig, length) in _CONTIGS]
+    else:
+        regions = [(contig, start, end, name or (contig + "*"))
+                   for (contig, start, end, name) in regions]
+
+    samples_and_libraries = dict((key, (sample, library))
+                                 for (key, sample, library) in _READGROUPS)
+
+    result = {}
+    for (_, sample, library) in _READGROUPS:
+        for (_, _, _, name) in regions:
+            result[(sample, library, name)] = [0] * 7
+
+    for (contig, start, end, name) in regions:
+        for read in reads:
+            if read.flag & EXCLUDED_FLAGS or read.contig != contig:
+                continue
+            elif read.pos >= end \
+                    or read.pos + _reference_length(read.cigar) <= start:
+                continue
+
+            sample, library = samples_and_libraries[read.readgroup]
+            counts = result[(sample, library, name)]
+            if read.name.startswith("M_"):
+                counts[3] += 1
+            elif read.flag & 0x40:
+                counts[1] += 1
+            elif read.flag & 0x80:
+                counts[2] += 1
+            else:
+                counts[0] += 1
+
+            coverage.count_bases_in_region(counts, read.cigar, read.pos,
+                                           start, end)
+
+    return result
+
+
+def _check_coverage(temp_folder, expected, *args):
+    filename = _build_bam(temp_folder)
+    counts_file = os.path.join(temp_folder, "table.coverage.npz")
+    _run_tool(coverage, temp_folder, filename, "--raw-counts", counts_file,
+              *args)
+
+    count_fields, rows = rawcounts.read_counts(counts_file,
+                                               ("Name", "Sample", "Library",
+                                                "Contig"))
+    indices = [count_fields.index(key) for key in coverage._STATISTICS]
+    observed = dict((key[1:], [int(counts[index]) for index in indices])
+                    for (key, counts) in rows)
+
+    assert_equal(observed, expected)
+
+
+@with_temp_folder
+def test_coverage__contigs(temp_folder):
+    _check_coverage(temp_folder, _naive_coverage(_random_reads()))
+
+
+@with_temp_folder
+def test_coverage__regions(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+
+    # Bases outside the regions are not counted for overlapping reads
+    expected = _naive_coverage(_random_reads(), _REGIONS)
+    _check_coverage(temp_folder, expected, "--regions-file", regions)
+
+
+@with_temp_folder
+def test_coverage__cigar_cache_is_cleared(temp_folder):
+    flexmock(coverage, _MAX_CIGAR_CACHE_SIZE=2)
+    _check_coverage(temp_folder, _naive_coverage(_random_reads()))
+
+
+###############################################################################
+###############################################################################
+# Processing of BAM files in parallel
+
+def _split_regions(regions, threads):
+    args = argparse.Namespace(regions=regions, threads=threads)
+    handle = flexmock(references=[name for (name, _) in _CONTIGS],
+                      lengths=[length for (_, length) in _CONTIGS])
+    return common.split_regions(args, handle)
+
+
+def test_split_regions__contigs():
+    flexmock(common, _MIN_CHUNK_SIZE=1, _MAX_CHUNK_SIZE=100)
+    chunks = _split_regions(None, 2)
+
+    # Contigs are split into chunks named after the contig, in order
+    regions = [region for chunk in chunks for region in chunk]
+    for (contig, length) in _CONTIGS:
+        parts = [region for region in regions if region.contig == contig]
+        assert all(region.name == contig for region in parts)
+        assert all(region.end - region.start <= 100 for region in parts)
+        assert_equal(parts[0].start, 0)
+        assert_equal(parts[-1].end, length)
+        for (part_a, part_b) in zip(parts, parts[1:]):
+            assert_equal(part_a.end, part_b.start)
+
+    # Every chunk but the last covers at least the chunk size
+    for chunk in chunks[:-1]:
+        assert sum(region.end - region.start for region in chunk) >= 100
+
+
+def test_split_regions__single_chunk():
+    chunks = _split_regions(None, 4)
+    assert_equal(chunks, [[common.Region(name, 0, length, name)
+                           for (name, length) in _CONTIGS]])
+
+
+def test_split_regions__regions_are_not_split():
+    flexmock(common, _MIN_CHUNK_SIZE=1, _MAX_CHUNK_SIZE=100)
+    regions = [common.Region(*region) for region in _REGIONS]
+    chunks = _split_regions(regions, 2)
+    assert_equal([region for chunk in chunks for region in chunk], regions)
+    # Every region but the last is larger than the chunk size (470 / 8 bp)
+    assert_equal([len(chunk) for chunk in chunks], [1, 1, 1, 1])
+
+
+def _run_tool(module, temp_folder, filename, *args):
+    extension = module.__name__.rsplit(".", 1)[-1]
+    table = os.path.join(temp_folder, "table." + extension)
+    argv = [filename, table, "--overwrite-output"]
+    assert_equal(module.main(argv + list(args)), 0)
+    return _read_table(table)
+
+
+def _check_threads(module, temp_folder, *args):
+    """Checks that tables are identical when a BAM file is processed in
+    chunks, using several worker processes, and when it is not."""
+    filename = _build_bam(temp_folder)
+    expected = _run_tool(module, temp_folder, filename, *args)
+
+    # Reads span several chunks, and chunks are merged in arbitrary order
+    flexmock(common, _MIN_CHUNK_SIZE=1, _MAX_CHUNK_SIZE=25)
+    observed = _run_tool(module, temp_folder, filename, "--threads", "3",
+                         *args)
+    assert_equal(observed, expected)
+
+
+@with_temp_folder
+def test_depths__threads(temp_folder):
+    _check_threads(depths, temp_folder)
+
+
+@with_temp_folder
+def test_depths__threads__regions(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+    _check_threads(depths, temp_folder, "--regions-file", regions)
+
+
+@with_temp_folder
+def test_coverage__threads(temp_folder):
+    _check_threads(coverage, temp_folder)
+
+
+@with_temp_folder
+def test_coverage__threads__regions(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+    _check_threads(coverage, temp_folder, "--regions-file", regions)
+
+
+###############################################################################
+###############################################################################
+# Collection of several statistics in a single pass
+
+def _run_duphist(filename):
+    # Ambiguous reads are assigned randomly (see 'duphist.process_records')
+    random.seed(1234)
+    flexmock(sys, stdout=StringIO.StringIO())
+    duphist.main([filename])
+    return sys.stdout.getvalue().splitlines(True)
+
+
+def _naive_insert_sizes(reads):
+    counts = collections.defaultdict(int)
+    for read in reads:
+        if read.flag & EXCLUDED_FLAGS:
+            continue
+        elif read.flag & 0x1:
+            if read.flag & 0x2 and read.flag & 0x40:
+                counts[abs(read.tlen)] += 1
+        elif read.name.startswith("M_"):
+            counts[_reference_length(read.cigar)] += 1
+
+    return ["%i\t%i\n" % item for item in sorted(counts.iteritems())]
+
+
+@with_temp_folder
+def test_bam_stats__all_statistics(temp_folder):
+    filename = _build_bam(temp_folder)
+    expected_coverage = _run_tool(coverage, temp_folder, filename)
+    expected_depths = _run_tool(depths, temp_folder, filename)
+    expected_duphist = _run_duphist(filename)
+
+    outputs = dict((key, os.path.join(temp_folder, "output." + key))
+                   for key in ("coverage", "depths", "duphist", "sizes"))
+    random.seed(1234)
+    assert_equal(bam_stats.main([filename,
+                                 "--coverage", outputs["coverage"],
+                                 "--depths", outputs["depths"],
+                                 "--duphist", outputs["duphist"],
+                                 "--insert-sizes", outputs["sizes"]]), 0)
+
+    assert_equal(_read_table(outputs["coverage"]), expected_coverage)
+    assert_equal(_read_table(outputs["depths"]), expected_depths)
+    assert_equal(_read_table(outputs["duphist"]), expected_duphist)
+    assert_equal(_read_table(outputs["sizes"]),
+                 _naive_insert_sizes(_random_reads()))
+
+
+def _check_bam_stats(temp_folder, *args):
+    """Checks that 'paleomix bam_stats' produces the same coverage and depth
+    tables as 'paleomix coverage' and 'paleomix depths'."""
+    filename = _build_bam(temp_folder)
+    expected_coverage = _run_tool(coverage, temp_folder, filename, *args)
+    expected_depths = _run_tool(depths, temp_folder, filename, *args)
+
+    flexmock(common, _MIN_CHUNK_SIZE=1, _MAX_CHUNK_SIZE=25)
+    table_coverage = os.path.join(temp_folder, "output.coverage")
+    table_depths = os.path.join(temp_folder, "output.depths")
+    argv = [filename, "--coverage", table_coverage, "--depths", table_depths]
+    assert_equal(bam_stats.main(argv + list(args)), 0)
+
+    assert_equal(_read_table(table_coverage), expected_coverage)
+    assert_equal(_read_table(table_depths), expected_depths)
+
+
+@with_temp_folder
+def test_bam_stats__threads(temp_folder):
+    _check_bam_stats(temp_folder, "--threads", "3")
+
+
+@with_temp_folder
+def test_bam_stats__regions(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+    _check_bam_stats(temp_folder, "--regions-file", regions)
+
+
+@with_temp_folder
+def test_bam_stats__regions__threads(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+    _check_bam_stats(temp_folder, "--regions-file", regions, "--threads", "3")
+
+
+###############################################################################
+###############################################################################
+# Raw counts
+
+_KEY_FIELDS = ("Name", "Sample", "Library", "Contig")
+
+
+def test_sidecar_filename():
+    assert_equal(rawcounts.sidecar_filename("foo/bar.coverage"),
+                 "foo/bar.coverage.npz")
+
+
+@with_temp_folder
+def test_rawcounts__round_trip(temp_folder):
+    filename = os.path.join(temp_folder, "counts.npz")
+    rows = [(("bam", "S1", "L1", "chr1"), [100, 2 ** 40, 0]),
+            (("bam", "S1", "L2", "a much longer contig name"), [50, 3, 4])]
+    rawcounts.write_counts(filename, _KEY_FIELDS, ("Size", "A", "B"), rows)
+
+    count_fields, result = rawcounts.read_counts(filename, _KEY_FIELDS)
+    assert_equal(count_fields, ("Size", "A", "B"))
+    assert_equal([(key, list(counts)) for (key, counts) in result], rows)
+
+
+@with_temp_folder
+def test_rawcounts__round_trip__no_rows(temp_folder):
+    filename = os.path.join(temp_folder, "counts.npz")
+    rawcounts.write_counts(filename, _KEY_FIELDS, ("Size",), [])
+    assert_equal(rawcounts.read_counts(filename, _KEY_FIELDS), (("Size",), []))
+
+
+@with_temp_folder
+def test_rawcounts__unexpected_key_fields(temp_folder):
+    filename = os.path.join(temp_folder, "counts.npz")
+    rawcounts.write_counts(filename, _KEY_FIELDS, ("Size",), [])
+    assert_raises(ValueError, rawcounts.read_counts, filename, ("Name",))
+
+
+def _check_coverage_counts(temp_folder, *args):
+    """Checks that the raw counts written by 'paleomix coverage' contain the
+    same values as the text table, excepting totals."""
+    filename = _build_bam(temp_folder)
+    counts_file = os.path.join(temp_folder, "table.coverage.npz")
+    _run_tool(coverage, temp_folder, filename, "--raw-counts", counts_file,
+              *args)
+
+    from_table, from_counts = {}, {}
+    coverage_table.read_table(from_table,
+                              os.path.join(temp_folder, "table.coverage"))
+    coverage_table.read_counts(from_counts, counts_file)
+    assert_equal(from_counts, from_table)
+
+
+@with_temp_folder
+def test_coverage__read_counts_matches_read_table(temp_folder):
+    _check_coverage_counts(temp_folder)
+
+
+@with_temp_folder
+def test_coverage__read_counts_matches_read_table__regions(temp_folder):
+    regions = os.path.join(temp_folder, "regions.bed")
+    _write_regions(regions)
+    _check_coverage_counts(temp_folder, "--regions-file", regions)
+
+
+@with_temp_folder
+def test_coverage__write_table_from_counts(temp_folder):
+    # Tables built from raw counts are identical to the original tables
+    filename = _build_bam(temp_folder)
+    counts_file = os.path.join(temp_folder, "table.coverage.npz")
+    expected = _run_tool(coverage, temp_folder, filename,
+                         "--raw-counts", counts_file)
+
+    table = {}
+    coverage_table.read_counts(table, counts_file)
+    output_file = os.path.join(temp_folder, "output.coverage")
+    coverage_table.write_table(table, output_file)
+    assert_equal(_read_table(output_file), expected)